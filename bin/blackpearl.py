@@ -28,6 +28,9 @@ import binascii
 import logging
 import re
 
+# Start of the boot timeline (blackpearl.py boot-report)
+STARTED_AT = time.time()
+
 startup_notes = """
     BlackPearl is free software. License GPLv3+: GNU GPL version 3 or later
     <http://gnu.org/licenses/gpl.html>
@@ -72,6 +75,10 @@ CONFIG = {
 
     "listen": "127.0.0.1:80",
 
+    "production": False,
+
+    "hot_reload": False,
+
     "security": {
         "block_size": 256,
         "auto_generate_key": True
@@ -86,12 +93,38 @@ CONFIG = {
 
     "uwsgi_options": {
         "plugins": "python"
+    },
+
+    "jobs": {
+        "workers": 2,
+        "result_ttl": 86400,
+        "poll_interval": 1
+    },
+
+    "autoscale": {
+        "interval": 5,
+        "busy_high": 0.8,
+        "busy_low": 0.3,
+        "scale_down_after": 3
+    },
+
+    "analysis": {
+        "parallelism": 0,
+        "compile_workers": 0,
+        "unchecked_hash_pycs": False
+    },
+
+    "startup_profile": {
+        "enabled": False,
+        "budget": 2.0,
+        "import_budget": 0.2
     }
 }
 
 
 def validate_and_update(loaded_config, cwd):
-    category = ["path", "server", "hostname", "listen", "security", "logging", "uwsgi_options"]
+    category = ["path", "server", "hostname", "listen", "production", "hot_reload", "security", "logging",
+                "uwsgi_options", "jobs", "autoscale", "analysis", "startup_profile"]
 
     for key in loaded_config.keys():
         if key not in category:
@@ -218,6 +251,27 @@ def validate_and_update(loaded_config, cwd):
                          "It should be of format <ip/hostname>:<port>. eg: 127.0.0.1:80. "
                          "Valid characters: alphanumeric, . (dot) and - (hypen)" % loaded_config['listen'])
 
+    try:
+        loaded_config['production']
+    except KeyError:
+        loaded_config['production'] = CONFIG['production']
+
+    if not isinstance(loaded_config['production'], bool):
+        raise ValueError("Invalid value for 'production' <%s>. It should be true or false." %
+                         loaded_config['production'])
+
+    try:
+        loaded_config['hot_reload']
+    except KeyError:
+        loaded_config['hot_reload'] = CONFIG['hot_reload']
+
+    if not isinstance(loaded_config['hot_reload'], bool):
+        raise ValueError("Invalid value for 'hot_reload' <%s>. It should be true or false." %
+                         loaded_config['hot_reload'])
+
+    if loaded_config['hot_reload'] and loaded_config['production']:
+        raise ValueError("'hot_reload' can not be enabled in production mode.")
+
     _logging = ["level", "max_log_size", "max_log_files", 'format']
     try:
         logging_dict = loaded_config['logging']
@@ -268,6 +322,129 @@ def validate_and_update(loaded_config, cwd):
         c.update(uwsgi_option_dict)
         loaded_config['uwsgi_options'] = c
 
+    jobs = ["workers", "result_ttl", "poll_interval"]
+    try:
+        jobs_dict = loaded_config['jobs']
+    except KeyError:
+        loaded_config['jobs'] = CONFIG['jobs'].copy()
+    else:
+        for key in jobs_dict.keys():
+            if key not in jobs:
+                raise ValueError("Unknown value '<%s>' under category <jobs> in configuration file." % key)
+
+        c = CONFIG['jobs'].copy()
+        c.update(jobs_dict)
+        loaded_config['jobs'] = c
+
+    for key in ("workers", "result_ttl"):
+        try:
+            loaded_config['jobs'][key] = int(loaded_config['jobs'][key])
+        except ValueError:
+            raise ValueError("%s under category <jobs> should be an integer but found <%s>." % (
+                key, loaded_config['jobs'][key])) from None
+
+    try:
+        loaded_config['jobs']['poll_interval'] = float(loaded_config['jobs']['poll_interval'])
+    except ValueError:
+        raise ValueError("poll_interval under category <jobs> should be a number but found <%s>." %
+                         loaded_config['jobs']['poll_interval']) from None
+
+    autoscale = ["interval", "busy_high", "busy_low", "scale_down_after"]
+    try:
+        autoscale_dict = loaded_config['autoscale']
+    except KeyError:
+        loaded_config['autoscale'] = CONFIG['autoscale'].copy()
+    else:
+        for key in autoscale_dict.keys():
+            if key not in autoscale:
+                raise ValueError("Unknown value '<%s>' under category <autoscale> in configuration file." % key)
+
+        c = CONFIG['autoscale'].copy()
+        c.update(autoscale_dict)
+        loaded_config['autoscale'] = c
+
+    for key in ("interval", "busy_high", "busy_low"):
+        try:
+            loaded_config['autoscale'][key] = float(loaded_config['autoscale'][key])
+        except ValueError:
+            raise ValueError("%s under category <autoscale> should be a number but found <%s>." % (
+                key, loaded_config['autoscale'][key])) from None
+
+    try:
+        loaded_config['autoscale']['scale_down_after'] = int(loaded_config['autoscale']['scale_down_after'])
+    except ValueError:
+        raise ValueError("scale_down_after under category <autoscale> should be an integer but found <%s>." %
+                         loaded_config['autoscale']['scale_down_after']) from None
+
+    if not 0 <= loaded_config['autoscale']['busy_low'] < loaded_config['autoscale']['busy_high'] <= 1:
+        raise ValueError("busy_low and busy_high under category <autoscale> should be between 0 and 1 and "
+                         "busy_low should be less than busy_high.")
+
+    analysis = ["parallelism", "compile_workers", "unchecked_hash_pycs"]
+    try:
+        analysis_dict = loaded_config['analysis']
+    except KeyError:
+        loaded_config['analysis'] = CONFIG['analysis'].copy()
+    else:
+        for key in analysis_dict.keys():
+            if key not in analysis:
+                raise ValueError("Unknown value '<%s>' under category <analysis> in configuration file." % key)
+
+        c = CONFIG['analysis'].copy()
+        c.update(analysis_dict)
+        loaded_config['analysis'] = c
+
+    try:
+        loaded_config['analysis']['parallelism'] = int(loaded_config['analysis']['parallelism'])
+    except ValueError:
+        raise ValueError("parallelism under category <analysis> should be an integer but found <%s>." %
+                         loaded_config['analysis']['parallelism']) from None
+
+    if loaded_config['analysis']['parallelism'] < 0:
+        raise ValueError("parallelism under category <analysis> should not be negative. Use 0 to analyse as many "
+                         "webapps in parallel as the number of CPUs.")
+
+    try:
+        loaded_config['analysis']['compile_workers'] = int(loaded_config['analysis']['compile_workers'])
+    except ValueError:
+        raise ValueError("compile_workers under category <analysis> should be an integer but found <%s>." %
+                         loaded_config['analysis']['compile_workers']) from None
+
+    if loaded_config['analysis']['compile_workers'] < 0:
+        raise ValueError("compile_workers under category <analysis> should not be negative. Use 0 to byte-compile "
+                         "with as many processes as the number of CPUs.")
+
+    if not isinstance(loaded_config['analysis']['unchecked_hash_pycs'], bool):
+        raise ValueError("unchecked_hash_pycs under category <analysis> should be true or false but found <%s>." %
+                         loaded_config['analysis']['unchecked_hash_pycs'])
+
+    startup_profile = ["enabled", "budget", "import_budget"]
+    try:
+        startup_profile_dict = loaded_config['startup_profile']
+    except KeyError:
+        loaded_config['startup_profile'] = CONFIG['startup_profile'].copy()
+    else:
+        for key in startup_profile_dict.keys():
+            if key not in startup_profile:
+                raise ValueError("Unknown value '<%s>' under category <startup_profile> in configuration file." % key)
+
+        c = CONFIG['startup_profile'].copy()
+        c.update(startup_profile_dict)
+        loaded_config['startup_profile'] = c
+
+    if not isinstance(loaded_config['startup_profile']['enabled'], bool):
+        raise ValueError("enabled under category <startup_profile> should be true or false but found <%s>." %
+                         loaded_config['startup_profile']['enabled'])
+
+    for key in ("budget", "import_budget"):
+        try:
+            loaded_config['startup_profile'][key] = float(loaded_config['startup_profile'][key])
+        except ValueError:
+            raise ValueError("%s under category <startup_profile> should be a number but found <%s>." % (
+                key, loaded_config['startup_profile'][key])) from None
+        if loaded_config['startup_profile'][key] <= 0:
+            raise ValueError("%s under category <startup_profile> should be greater than zero." % key)
+
 
 def load(path, cwd=os.getcwd()):
     with open(path) as file:
@@ -298,7 +475,10 @@ Syntax: blackpearl.py [-c <config_path>] <action>
 Actions:
     1. startup
     2. shutdown
-    3. newapp <appname>""")
+    3. newapp <appname>
+    4. memory-report
+    5. startup-report
+    6. boot-report""")
 
 
 def start_server(daemon, config):
@@ -318,16 +498,33 @@ def start_server(daemon, config):
         except:
             pass
 
+        # Startup profiles of the workers in the last run are kept to be compared with the profiles of this run
+        startup_profiles = os.path.join(path['run'], 'uwsgi', 'startup')
+        if os.access(startup_profiles, os.F_OK) and os.listdir(startup_profiles):
+            previous_profiles = os.path.join(path['cache'], 'startup')
+            if os.access(previous_profiles, os.F_OK):
+                shutil.rmtree(previous_profiles)
+            shutil.move(startup_profiles, previous_profiles)
+
         shutil.rmtree(path['run'])
 
     os.mkdir(path['run'])
     os.mkdir(os.path.join(path['run'], 'uwsgi'))
     os.mkdir(os.path.join(path['run'], 'nginx'))
+    os.mkdir(os.path.join(path['run'], 'nginx', 'webapps'))
     os.mkdir(os.path.join(path['run'], 'uwsgi', 'pickle'))
+    os.mkdir(os.path.join(path['run'], 'uwsgi', 'startup'))
+    os.mkdir(os.path.join(path['run'], 'uwsgi', 'snapshots'))
 
     if not os.access(os.path.join(path['cache'], "virtenv"), os.F_OK):
         os.makedirs(os.path.join(path['cache'], "virtenv"))
 
+    if not os.access(os.path.join(path['cache'], "wheels"), os.F_OK):
+        os.makedirs(os.path.join(path['cache'], "wheels"))
+
+    if not os.access(os.path.join(path['cache'], "jobs"), os.F_OK):
+        os.makedirs(os.path.join(path['cache'], "jobs"))
+
     if not os.access(path['log'], os.F_OK):
         os.makedirs(path['log'])
     if not os.access(os.path.join(path['log'], "uwsgi"), os.F_OK):
@@ -336,13 +533,21 @@ def start_server(daemon, config):
     if not os.access(os.path.join(path['log'], "nginx"), os.F_OK):
         os.makedirs(os.path.join(path['log'], "nginx"))
 
+    if not os.access(os.path.join(path['log'], "jobs"), os.F_OK):
+        os.makedirs(os.path.join(path['log'], "jobs"))
+
     if not os.access(os.path.join(path['log'], "blackpearl"), os.F_OK):
         os.makedirs(os.path.join(path['log'], "blackpearl"))
 
+    # Loading the configuration and setting up the folders
+    from BlackPearl.common.timeline import Timeline
+    timeline = Timeline(STARTED_AT)
+    timeline.add("setup", STARTED_AT, time.time())
+
     # open(os.path.join(os.path.join(config.run, 'uwsgi'), "worker_reload.file"), "w").close()
     logger.info("Starting BlackPearl server ...")
     logger.info("Generating log files at %s" % path['log'])
-    appserver.start(config, daemon)
+    appserver.start(config, daemon, timeline)
 
 
 def stop_server(config):
@@ -487,13 +692,17 @@ if __name__ == "__main__":
     try:
         apr = ArgumentParserRules(
             with_arguments=['-c', 'newapp'],
-            without_arguments=['startup', 'shutdown', '-d', '--daemon'],
+            without_arguments=['startup', 'shutdown', 'memory-report', 'startup-report', 'boot-report', '-d',
+                               '--daemon'],
             should_not_be_with={
-                'startup': ['shutdown'],
-                'shutdown': ['startup'],
-                'newapp': ['startup', 'shutdown', '-c']
+                'startup': ['shutdown', 'memory-report', 'startup-report', 'boot-report'],
+                'shutdown': ['startup', 'memory-report', 'startup-report', 'boot-report'],
+                'newapp': ['startup', 'shutdown', 'memory-report', 'startup-report', 'boot-report', '-c'],
+                'memory-report': ['startup', 'shutdown', 'startup-report', 'boot-report'],
+                'startup-report': ['startup', 'shutdown', 'memory-report', 'boot-report'],
+                'boot-report': ['startup', 'shutdown', 'memory-report', 'startup-report']
             },
-            mandatory=[('startup', 'shutdown', 'newapp')]
+            mandatory=[('startup', 'shutdown', 'newapp', 'memory-report', 'startup-report', 'boot-report')]
         )
         ap = ArgumentParser(apr, sys.argv[1:])
         p_args = ap.parse()
@@ -547,3 +756,12 @@ if __name__ == "__main__":
             except:
                 print("SEVERE: Error occurred while creating new webapp.")
                 print("SEVERE:", traceback.format_exc())
+        elif "memory-report" in p_args:
+            from BlackPearl.tools import memreport
+            memreport.invoke(configuration)
+        elif "startup-report" in p_args:
+            from BlackPearl.tools import startupreport
+            startupreport.invoke(configuration)
+        elif "boot-report" in p_args:
+            from BlackPearl.tools import bootreport
+            bootreport.invoke(configuration)
@@ -21,17 +21,43 @@ import cgi
 import pickle
 import inspect
 import os
+import math
+import time
 import base64
+import atexit
+import functools
+import importlib
 import logging
+import threading
+import multiprocessing
+import urllib.parse
 
-from BlackPearl import testing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from BlackPearl.common import meminfo
+from BlackPearl.common import startupprofile
 from BlackPearl.core import sessions
 from BlackPearl.core import exceptions
+from BlackPearl.core import manifest
+from BlackPearl.core import hotreload
 from BlackPearl.core import utils
+from BlackPearl.core.jobs import JobQueue
+from BlackPearl.core.ratelimit import TokenBuckets
 from BlackPearl.core.exceptions import RequestInvalid, UnSuccessfulException
 
 logger = logging.getLogger(__name__)
 webapp = None
+dispatcher = None
+job_queue = None
+job_result_ttl = None
+cpu_pool = None
+cpu_pool_processes = None
+# Held while the cpu pool is replaced, as the threads of the worker use the pool concurrently
+cpu_pool_lock = threading.Lock()
+ratelimit_buckets = None
+keep_testsets = True
+hot_reloader = None
 
 
 def invoke_preprocessors(urlpath, session):
@@ -74,19 +100,75 @@ def invoke_posthandlers(urlpath, session, rets):
         return error
 
 
-def handle_request(module, session, parameter):
+def handle_request(module, session, parameter, urlpath=None):
         """This function handles the user request"""
         func = module['func']
         signature = module['signature']
+        if signature is None:
+            # Signature not stored in the manifest (annotations or defaults not picklable)
+            signature = module['signature'] = func.signature()
+        elif isinstance(signature, bytes):
+            # Signature pickled in the manifest, unpickled on the first request of the route
+            signature = module['signature'] = pickle.loads(signature)
 
         try:
             parameter = utils.validate_parameter(signature, parameter)
         except Exception as e:
             raise ParametersInvalid(str(e)) from None
 
+        if module.get('job'):
+            return enqueue_job(module, session, parameter, urlpath)
+
+        if module.get('cpu_bound'):
+            return run_in_cpu_pool(func, session, parameter)
+
         return func(session, parameter)
 
 
+def _invoke_in_pool(func, session, parameter):
+    # Runs inside the pool process. The session is returned along with the
+    # output as the changes done to it by the handler should reach the client.
+    return func(session, parameter), session
+
+
+def run_in_cpu_pool(func, session, parameter):
+    """Executes the handler in the process pool of the webapp and waits for its output.
+    The exceptions raised by the handler are re-raised here."""
+    try:
+        pickle.dumps(parameter)
+    except Exception as e:
+        raise ParametersInvalid("Parameters of cpu bound webmodule are not picklable. Error: <%s>" % e) from None
+
+    pool = cpu_pool
+    try:
+        future = pool.submit(_invoke_in_pool, func, session, parameter)
+    except BrokenProcessPool:
+        # Pool process died earlier (killed by the OOM killer, crashed ..). Pool is replaced and used for this request.
+        pool = restart_cpu_pool(pool)
+        future = pool.submit(_invoke_in_pool, func, session, parameter)
+
+    try:
+        output, pool_session = future.result()
+    except BrokenProcessPool:
+        # Pool process died while running this request, which might be the cause. So, it is not tried again.
+        restart_cpu_pool(pool)
+        raise CpuPoolBroken("Process running the cpu bound webmodule died before completing the request") from None
+    session.__dict__.clear()
+    session.__dict__.update(pool_session.__dict__)
+    return output
+
+
+def enqueue_job(module, session, parameter, urlpath):
+    """Adds the request to the job queue instead of executing it. Returns the job id"""
+    ttl = module['job']['ttl'] or job_result_ttl
+    try:
+        job_id = job_queue.enqueue(webapp.id, urlpath, session, parameter, ttl)
+    except ValueError as e:
+        raise ParametersInvalid(str(e)) from None
+
+    return {"job_id": job_id}
+
+
 def return_to_client(start_response, headers, session, data):
     status = "200 ok"
     # serializing the python object return from handler to JSON.
@@ -120,19 +202,107 @@ def return_to_client(start_response, headers, session, data):
             yield json_rets.encode('UTF-8')
 
 
+def check_queue_wait(environ):
+    """Returns the error to be sent to the client if the request waited in the uwsgi listen queue
+    for longer than the max_queue_wait configured in the webapp, otherwise None.
+
+    The time at which nginx passed the request is received in BLACKPEARL_REQUEST_START."""
+    if webapp.max_queue_wait is None:
+        return None
+
+    try:
+        waited = time.time() - float(environ['BLACKPEARL_REQUEST_START'])
+    except (KeyError, ValueError):
+        return None
+
+    if waited > webapp.max_queue_wait:
+        logger.warn("Rejecting request to <%s> as it waited <%.3f> seconds in queue" % (environ['PATH_INFO'], waited))
+        return {
+            "status": -601,
+            "desc": "Server is overloaded. Request waited <%.3f> seconds in queue" % waited
+        }
+    return None
+
+
+def check_ratelimit(module, urlpath, session, environ):
+    """Returns 0 if the request is within the rate limit of the webmodule,
+    otherwise the seconds to wait before retrying"""
+    limit = module.get('ratelimit')
+    if not limit:
+        return 0
+
+    key = urlpath
+    if limit['per'] == "session":
+        # New sessions are identified by the client address, so that the clients not
+        # sending the session cookie back are also limited.
+        if session.__status__ == "fetched":
+            key += "|" + repr(session.created)
+        else:
+            key += "|" + environ.get('REMOTE_ADDR', '')
+
+    return ratelimit_buckets.acquire(key, limit['rate'], limit['burst'])
+
+
+class WebappDispatcher:
+    """Selects the webapp serving the request, when the worker serves a shared pool of webapps.
+
+    The selected webapp is kept per thread and the attribute access is forwarded to it, so that
+    the dispatcher is used in place of the webapp."""
+
+    def __init__(self, webapps_list):
+        # Longest url_prefix is matched first, so that </app/sub> is not served by </app>
+        self.webapps = sorted(webapps_list, key=lambda w: len(w.url_prefix), reverse=True)
+        self._current = threading.local()
+
+    def select(self, urlpath):
+        """Selects the webapp for the urlpath in the current thread. Returns None if no webapp matches"""
+        for candidate in self.webapps:
+            prefix = candidate.url_prefix
+            if prefix == "/" or urlpath == prefix or urlpath.startswith(prefix + "/"):
+                self._current.webapp = candidate
+                return candidate
+        self._current.webapp = None
+        return None
+
+    def __getattr__(self, name):
+        return getattr(self._current.webapp, name)
+
+
 class ParametersInvalid(Exception):
     """This exception should be raised when invalid parameters are received"""
     pass
 
 
+class CpuPoolBroken(Exception):
+    """This exception is raised when the process of the cpu pool running the request dies"""
+    pass
+
+
 def __application__(environ, start_response):
     headers = [('Content-Type', "text/plain")]
 
     try:
+        # Modules changed since the last request are reloaded before the request is served (hot_reload)
+        if hot_reloader:
+            apply_hot_reload()
+
         # Request method (POST, GET .. etc)
         method = environ['REQUEST_METHOD']
         urlpath = environ['PATH_INFO']
 
+        # Selecting the webapp of the request, when the worker serves a shared pool of webapps
+        if dispatcher and not dispatcher.select(urlpath):
+            start_response('404 Requested URL not found', headers)
+            yield str("Requested URL not found : %s" % urlpath).encode('utf-8')
+            return
+
+        # Fast failing the request before parsing its input, if the webapp is overloaded
+        error = check_queue_wait(environ)
+        if error:
+            start_response('503 Service Unavailable', [('Content-Type', "text/json"), ('Retry-After', '1')])
+            yield json.dumps(error).encode('UTF-8')
+            return
+
         # Parsing the input values.
         # The FieldStorage will handle all methods and file upload as well.
         form_values = cgi.FieldStorage(fp=environ['wsgi.input'], environ=environ)
@@ -154,6 +324,16 @@ def __application__(environ, start_response):
                 session = sessions.parse_session(environ=environ)
                 headers = [('Content-Type', "text/json")]
 
+                wait = check_ratelimit(module=module, urlpath=urlpath, session=session, environ=environ)
+                if wait:
+                    start_response('429 Too Many Requests', headers + [('Retry-After', str(int(math.ceil(wait))))])
+                    rets = {
+                        "status": -602,
+                        "desc": "Rate limit of the webmodule exceeded. Retry after <%.3f> seconds" % wait
+                    }
+                    yield json.dumps(rets).encode('UTF-8')
+                    return
+
                 error = invoke_preprocessors(urlpath=urlpath, session=session)
                 if error:
                     for i in return_to_client(start_response=start_response, headers=headers,
@@ -162,7 +342,8 @@ def __application__(environ, start_response):
                 else:
                     # Invoking the request handler for this the URL
                     try:
-                        output = handle_request(module=module, session=session, parameter=form_values)
+                        output = handle_request(module=module, session=session, parameter=form_values,
+                                                urlpath=urlpath)
                     except ParametersInvalid as e:
                         rets = {
                             "status": -201,
@@ -188,6 +369,14 @@ def __application__(environ, start_response):
                         for i in return_to_client(start_response=start_response, headers=headers,
                                                   session=session, data=rets):
                             yield i
+                    except CpuPoolBroken as e:
+                        rets = {
+                            "status": -204,
+                            "desc": str(e)
+                        }
+                        for i in return_to_client(start_response=start_response, headers=headers,
+                                                  session=session, data=rets):
+                            yield i
                     except Exception:
                         error = traceback.format_exc()
                         rets = {
@@ -247,20 +436,258 @@ def __application__(environ, start_response):
 
 
 def initialize():
-    global webapp, BLOCK_SIZE, AES_KEY
-    # initializing the webapps from the pickled file.
+    global webapp, dispatcher, job_queue, job_result_ttl, ratelimit_buckets, keep_testsets, hot_reloader, \
+        BLOCK_SIZE, AES_KEY
+    # initializing the webapps from their manifest files.
+    sessions.BLOCK_SIZE = int(os.environ['BLACKPEARL_ENCRYPT_BLOCK_SIZE'])
+    sessions.AES_KEY = base64.b64decode(os.environ['BLACKPEARL_ENCRYPT_KEY'])
+    # In production mode, the testsets are left out of the worker and loaded only when a test route is used,
+    # except in the candidate instance of a blue-green deployment which runs them before it is promoted
+    keep_testsets = os.environ.get("BLACKPEARL_PRODUCTION") != "1" or \
+        os.environ.get("BLACKPEARL_CANDIDATE") == "1"
+
+    # Worker serving a shared pool gets the manifest files of all the webapps in the pool
+    manifest_files = os.environ['BLACKPEARL_PICKLE_FILE'].split(os.pathsep)
+    preload = os.environ.get("BLACKPEARL_PRELOAD") == "1"
+    base_rss = meminfo.rss()
+    webapps_list = []
+    webapps_rss = []
+    for manifest_file in manifest_files:
+        rss = meminfo.rss()
+        # Handler modules are imported on the first request of their webmodules, unless the webapp is
+        # preloaded in the uwsgi master to be shared by the workers.
+        with startupprofile.phase("manifest"):
+            loaded_webapp = manifest.load(manifest_file, testsets=keep_testsets)
+        if preload:
+            with startupprofile.phase("handlers"):
+                loaded_webapp.import_handlers()
+
+        webapps_list.append(loaded_webapp)
+        webapps_rss.append(meminfo.rss() - rss)
+
+    if len(webapps_list) == 1:
+        webapp = webapps_list[0]
+    else:
+        dispatcher = WebappDispatcher(webapps_list)
+        webapp = dispatcher
+        logger.info("Shared pool serving <%s> webapps. Base RSS of the worker <%s>. %s" % (
+            len(webapps_list), meminfo.to_mb(base_rss),
+            ", ".join("RSS added by webapp <%s>: <%s>" % (w.name, meminfo.to_mb(r))
+                      for w, r in zip(webapps_list, webapps_rss))))
+        # Each webapp served separately would have loaded the base (interpreter and BlackPearl) on its own
+        logger.info("Shared pool saves about <%s> per webapp in each worker compared to separate processes" %
+                    meminfo.to_mb(base_rss * (len(webapps_list) - 1) / len(webapps_list)))
+
+    webmodules = [webmodule for w in webapps_list for webmodule in w.webmodules.values()]
+
+    if [webmodule for webmodule in webmodules if webmodule.get("job")]:
+        job_queue = JobQueue(os.environ['BLACKPEARL_JOB_QUEUE'])
+        job_result_ttl = int(os.environ['BLACKPEARL_JOB_RESULT_TTL'])
+
+    if [webmodule for webmodule in webmodules if webmodule.get("ratelimit")]:
+        ratelimit_buckets = TokenBuckets(os.environ['BLACKPEARL_RATELIMIT_FILE'])
+
+    # Functions run in each worker after it is forked from the uwsgi master, when the webapps are preloaded
+    post_fork = []
+    if [webmodule for webmodule in webmodules if webmodule.get("cpu_bound")]:
+        processes = cpu_pool_size(max([w.cpu_bound_processes for w in webapps_list if w.cpu_bound_processes] or
+                                      [multiprocessing.cpu_count()]))
+        if preload:
+            # Initialized in the uwsgi master. The pool processes and the threads managing them do not
+            # survive the fork, so each worker starts its own pool after it is forked.
+            post_fork.append(functools.partial(start_cpu_pool, processes))
+        else:
+            with startupprofile.phase("cpu_pool"):
+                start_cpu_pool(processes)
+
+    # Worker start hooks open the resources of each worker, and the warm-up hooks may use them. Worker is ready
+    # to accept requests (and the chain reload moves to the next worker) only after this.
+    for loaded_webapp in webapps_list:
+        if loaded_webapp.worker_start_hooks or loaded_webapp.warmup_hooks or loaded_webapp.warmup_hook:
+            if preload:
+                # Run in each worker, as the uwsgi master doesn't serve the requests
+                post_fork.append(functools.partial(start_worker, loaded_webapp))
+            else:
+                start_worker(loaded_webapp)
+
+    if post_fork:
+        import uwsgi
+        uwsgi.post_fork_hook = functools.partial(run_all, post_fork)
+
+    # Enabled by the server only for the instances serving a single webapp
+    if os.environ.get("BLACKPEARL_HOT_RELOAD"):
+        hot_reloader = hotreload.HotReloader(
+            os.environ["BLACKPEARL_HOT_RELOAD"], os.environ["BLACKPEARL_RELOAD_FILE"],
+            [os.path.join(webapp.location, "src", "api"), os.path.join(webapp.location, "lib"),
+             os.path.join(webapp.location, "test")])
+
+
+def initialize_job_worker():
+    """Initializes the webapp in a job worker. Only the manifest (without the testsets) and the job queue are
+    loaded. The @on_worker_start hooks are called, as the job handlers may use the resources opened by them.
+    Warm-up hooks, the cpu pool and the rate limits are left to the uwsgi workers serving the requests."""
+    global webapp, job_queue, job_result_ttl, keep_testsets
     sessions.BLOCK_SIZE = int(os.environ['BLACKPEARL_ENCRYPT_BLOCK_SIZE'])
     sessions.AES_KEY = base64.b64decode(os.environ['BLACKPEARL_ENCRYPT_KEY'])
-    testing.listen = os.environ['BLACKPEARL_LISTEN']
-    pickle_file = os.environ['BLACKPEARL_PICKLE_FILE']
-    pfile = open("%s" % pickle_file, "rb")
-    with pfile:
-        webapp = pickle.load(pfile)
-
-    # We are generating signature object during initialization because, signature
-    # object is not picklable
-    for webmodule in webapp.webmodules.values():
-        webmodule["signature"] = inspect.signature(webmodule["handler"])
+    keep_testsets = False
+
+    webapp = manifest.load(os.environ['BLACKPEARL_PICKLE_FILE'], testsets=False)
+    job_queue = JobQueue(os.environ['BLACKPEARL_JOB_QUEUE'])
+    job_result_ttl = int(os.environ['BLACKPEARL_JOB_RESULT_TTL'])
+    for hook in webapp.worker_start_hooks:
+        run_hook(webapp, "Worker start", hook)
+
+
+def apply_hot_reload():
+    """Reloads the changed modules of the webapp, if the server has written a hot reload since the last request.
+    The chain reload of the instance is triggered if the change can not be applied in place."""
+    with hot_reloader.lock:
+        try:
+            files = hot_reloader.pending()
+            if files is None:
+                return
+            # Change is checked against the current and the new routes before any module is executed again
+            order = hot_reloader.modules_to_reload(files)
+            modules = set(order)
+            new = manifest.load(os.environ['BLACKPEARL_PICKLE_FILE'], testsets=keep_testsets)
+            check_hot_reload(webapp, new, modules)
+            hot_reloader.reload_modules(order)
+            webapp.replace_routes(new, modules)
+        except Exception:
+            logger.error("Hot reload of webapp <%s> failed. Reloading the workers of the instance." % webapp.name)
+            logger.error("%s" % traceback.format_exc())
+            hot_reloader.fallback()
+            return
+
+    logger.info("Hot reloaded the modules <%s> of webapp <%s>" % (", ".join(sorted(modules)), webapp.name))
+    if [hook for hook in webapp.warmup_hooks if hook['func'].module in modules]:
+        for hook in webapp.warmup_hooks:
+            run_hook(webapp, "Warm-up", hook, functools.partial(call_webmodule, webapp))
+    if webapp.warmup_hook and webapp.warmup_hook.rsplit(".", 1)[0] in modules:
+        run_warmup_hook(webapp)
+
+
+def check_hot_reload(current, new, modules):
+    """Raises HotReloadError if the modules to be reloaded are used where the old code would keep running, or
+    if the new routes of the webapp need what the worker has not initialized"""
+    for url, webmodule in current.webmodules.items():
+        if webmodule.get("cpu_bound") and webmodule["func"].module in modules:
+            # Processes of the pool have imported the old code
+            raise hotreload.HotReloadError("Cpu bound webmodule <%s> can not be hot reloaded" % url)
+    for url, webmodule in new.webmodules.items():
+        if webmodule.get("cpu_bound") and (not cpu_pool or webmodule["func"].module in modules):
+            # Processes of the pool have imported the old code
+            raise hotreload.HotReloadError("Cpu bound webmodule <%s> can not be hot reloaded" % url)
+        if webmodule.get("job") and not job_queue:
+            raise hotreload.HotReloadError("Job webmodule <%s> is new in the worker" % url)
+        if webmodule.get("ratelimit") and not ratelimit_buckets:
+            raise hotreload.HotReloadError("Rate limited webmodule <%s> is new in the worker" % url)
+    for hook in current.worker_start_hooks + new.worker_start_hooks:
+        if hook['func'].module in modules:
+            # Resources opened by the hook are lost when its module is executed again
+            raise hotreload.HotReloadError("Module <%s> having the worker start hook <%s> can not be hot "
+                                           "reloaded" % (hook['func'].module, hook['name']))
+
+
+def run_all(functions):
+    for function in functions:
+        function()
+
+
+def start_worker(loaded_webapp):
+    """Calls the @on_worker_start hooks, then the @warmup hooks and the warm-up hook configured for the webapp.
+    Errors are logged, so that a broken hook doesn't stop the worker from serving the requests."""
+    with startupprofile.phase("worker_start"):
+        for hook in loaded_webapp.worker_start_hooks:
+            run_hook(loaded_webapp, "Worker start", hook)
+    with startupprofile.phase("warmup"):
+        for hook in loaded_webapp.warmup_hooks:
+            run_hook(loaded_webapp, "Warm-up", hook, functools.partial(call_webmodule, loaded_webapp))
+        if loaded_webapp.warmup_hook:
+            run_warmup_hook(loaded_webapp)
+
+
+def run_hook(loaded_webapp, kind, hook, *args):
+    start = time.time()
+    try:
+        hook['func'](*args)
+    except Exception:
+        logger.error("%s hook <%s> of webapp <%s> failed." % (kind, hook['name'], loaded_webapp.name))
+        logger.error("%s" % traceback.format_exc())
+    else:
+        logger.info("%s hook <%s> of webapp <%s> completed in <%.3f> seconds" % (
+            kind, hook['name'], loaded_webapp.name, time.time() - start))
+
+
+def call_webmodule(loaded_webapp, url, **parameters):
+    """Calls the webmodule of the webapp in-process, as a GET request with the parameters calls it, and returns
+    its output. Preprocessors, posthandlers and the rate limit are not applied. Passed to the warm-up hooks."""
+    urlpath = utils.fixurl(url) if len(loaded_webapp.url_prefix) == 1 else \
+        loaded_webapp.url_prefix + utils.fixurl(url)
+    try:
+        module = loaded_webapp.webmodules[urlpath]
+    except KeyError:
+        raise ValueError("Webmodule <%s> not found in webapp <%s>" % (urlpath, loaded_webapp.name)) from None
+    if module.get('job'):
+        raise ValueError("Webmodule <%s> is a job. It can't be called by the warm-up hooks." % urlpath)
+
+    start = time.time()
+    form_values = cgi.FieldStorage(environ={"REQUEST_METHOD": "GET",
+                                            "QUERY_STRING": urllib.parse.urlencode(parameters, doseq=True)})
+    output = handle_request(module=module, session=sessions.Session(), parameter=form_values, urlpath=urlpath)
+    if inspect.isgenerator(output):
+        output = list(output)
+    logger.info("Warm-up call to webmodule <%s> completed in <%.3f> seconds" % (urlpath, time.time() - start))
+    return output
+
+
+def run_warmup_hook(loaded_webapp):
+    """Calls the warm-up hook of the webapp. Errors are logged, so that a broken hook doesn't stop the worker
+    from serving the requests."""
+    module_name, function_name = loaded_webapp.warmup_hook.rsplit(".", 1)
+    start = time.time()
+    try:
+        getattr(importlib.import_module(module_name), function_name)()
+    except Exception:
+        logger.error("Warm-up hook <%s> of webapp <%s> failed." % (loaded_webapp.warmup_hook, loaded_webapp.name))
+        logger.error("%s" % traceback.format_exc())
+    else:
+        logger.info("Warm-up hook <%s> of webapp <%s> completed in <%.3f> seconds" % (
+            loaded_webapp.warmup_hook, loaded_webapp.name, time.time() - start))
+
+
+def cpu_pool_size(processes):
+    """Returns the size of the cpu pool of each worker. processes are shared by all the workers of the uwsgi
+    instance, so that the instance doesn't start workers x processes pool processes."""
+    try:
+        import uwsgi
+        workers = uwsgi.numproc
+    except ImportError:
+        workers = 1
+    return max(int(math.ceil(processes / workers)), 1)
+
+
+def start_cpu_pool(processes):
+    global cpu_pool, cpu_pool_processes
+    cpu_pool = ProcessPoolExecutor(max_workers=processes)
+    cpu_pool_processes = processes
+    atexit.register(cpu_pool.shutdown, wait=False)
+
+    # Forking the pool processes upfront, so that the requests don't pay for it.
+    for future in [cpu_pool.submit(os.getpid) for i in range(processes)]:
+        future.result()
+    logger.info("Started process pool of <%s> processes for cpu bound webmodules" % processes)
+
+
+def restart_cpu_pool(broken_pool):
+    """Replaces the broken cpu pool with a new pool, unless it is already replaced by another thread.
+    Returns the pool to be used."""
+    with cpu_pool_lock:
+        if cpu_pool is broken_pool:
+            logger.error("Process of the cpu pool died. Starting a new process pool ..")
+            broken_pool.shutdown(wait=False)
+            start_cpu_pool(cpu_pool_processes)
+        return cpu_pool
 
 
 # This "application" is called for every request by the app_server (uwsgi)
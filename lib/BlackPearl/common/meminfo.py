@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+# This file is part of BlackPearl.
+
+# BlackPearl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BlackPearl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+# Size of the memory page, /proc reports the memory usage in pages
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def rss(pid="self"):
+    """Returns the resident set size of the process in bytes"""
+    with open("/proc/%s/statm" % pid) as statm:
+        return int(statm.read().split()[1]) * PAGE_SIZE
+
+
+def to_mb(size):
+    """Formats the size in bytes as megabytes"""
+    return "%.1f MB" % (size / (1024 * 1024))
+
+
+def smaps(pid="self"):
+    """Returns the memory usage of the process in bytes as a dict of
+    rss, pss (rss with the shared pages divided among the processes sharing them), private and shared."""
+    usage = {"rss": 0, "pss": 0, "private": 0, "shared": 0}
+    fields = {
+        "Rss:": "rss",
+        "Pss:": "pss",
+        "Private_Clean:": "private",
+        "Private_Dirty:": "private",
+        "Shared_Clean:": "shared",
+        "Shared_Dirty:": "shared"
+    }
+    # smaps_rollup (Linux 4.14+) has the sum of all the mappings in smaps
+    path = "/proc/%s/smaps_rollup" % pid
+    if not os.access(path, os.F_OK):
+        path = "/proc/%s/smaps" % pid
+
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if parts and parts[0] in fields:
+                usage[fields[parts[0]]] += int(parts[1]) * 1024
+    return usage
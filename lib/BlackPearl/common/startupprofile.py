@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+# This file is part of BlackPearl.
+
+# BlackPearl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BlackPearl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
+
+# Startup profile of the uwsgi worker, recorded when the startup profiling is enabled in the server config.
+# The time taken by each phase of the worker startup and by each module imported during the startup are
+# written to the run folder, where the server (blackpearl.py startup-report) reads them. When the profiling
+# is disabled, the phases are no-ops and the imports are not hooked.
+
+import os
+import sys
+import json
+import time
+import builtins
+import importlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Profile being recorded in this process, None if the profiling is disabled
+_profile = None
+_original_import = builtins.__import__
+_original_import_module = importlib.import_module
+
+
+def _worker_id():
+    """Returns the id of the uwsgi worker (0 in the uwsgi master), or the pid outside uwsgi"""
+    try:
+        import uwsgi
+        return uwsgi.worker_id()
+    except ImportError:
+        return os.getpid()
+
+
+def _process_age():
+    """Returns the seconds elapsed since the start of the process, or None if not known"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the command name (which can contain spaces); start time is the 22nd field
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 0.0)
+
+
+class StartupProfile:
+    def __init__(self, profile_file, budget, import_budget):
+        # <instance profile>.<worker id>.json, each worker of the instance writes its own profile
+        self.profile_file = profile_file
+        self.budget = budget
+        self.import_budget = import_budget
+        # [phase name, seconds] in the order the phases are completed. Nested phases are named parent/child
+        self.phases = []
+        # module name -> [cumulative seconds, self seconds] of its first import
+        self.imports = {}
+        self._phase_stack = []
+        # Seconds spent in the nested imports of each import in progress
+        self._import_stack = []
+
+        age = _process_age()
+        if age is not None:
+            # Interpreter and uwsgi startup, before the wsgi file is loaded
+            self.phases.append(["process", age])
+
+    def timed_import(self, module, function, *args):
+        self._import_stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._import_stack.pop()
+            if self._import_stack:
+                self._import_stack[-1] += elapsed
+            if module in sys.modules:
+                self.imports[module] = [elapsed, elapsed - nested]
+
+    def total(self):
+        return sum(seconds for name, seconds in self.phases if "/" not in name)
+
+    def violations(self):
+        """Returns the list of the budget violations"""
+        violations = []
+        if self.total() > self.budget:
+            violations.append("Startup took <%.3f> seconds, exceeding the budget of <%.3f> seconds" % (
+                self.total(), self.budget))
+        for module, (cumulative, own) in sorted(self.imports.items(), key=lambda item: -item[1][1]):
+            if own > self.import_budget:
+                violations.append("Import of <%s> took <%.3f> seconds, exceeding the budget of <%.3f> seconds" % (
+                    module, own, self.import_budget))
+        return violations
+
+    def write(self):
+        profile = {
+            "pid": os.getpid(),
+            "time": time.time(),
+            "total": self.total(),
+            "budget": self.budget,
+            "import_budget": self.import_budget,
+            "phases": self.phases,
+            "imports": self.imports,
+            "violations": self.violations()
+        }
+        # Written to a temporary file and renamed, so that the report never reads a partially written profile
+        work = "%s.%d" % (self.profile_file, os.getpid())
+        with open(work, "w") as f:
+            json.dump(profile, f)
+        os.rename(work, self.profile_file)
+
+
+class _Phase:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if _profile:
+            _profile._phase_stack.append(self.name)
+            self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if _profile:
+            _profile.phases.append(["/".join(_profile._phase_stack), time.perf_counter() - self.start])
+            _profile._phase_stack.pop()
+
+
+def phase(name):
+    """Returns the context manager recording the time taken by the phase of the worker startup"""
+    return _Phase(name)
+
+
+def _hooked_import(name, globals=None, locals=None, fromlist=(), level=0):
+    # Hooked function is kept by the modules which bound it (from importlib import import_module) while the
+    # profile was recorded, so it is still called after the profiling is finished
+    if _profile is None or level or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    return _profile.timed_import(name, _original_import, name, globals, locals, fromlist, level)
+
+
+def _hooked_import_module(name, package=None):
+    if _profile is None or name.startswith(".") or name in sys.modules:
+        return _original_import_module(name, package)
+    return _profile.timed_import(name, _original_import_module, name, package)
+
+
+def start():
+    """Starts recording the startup profile, if it is enabled for the worker"""
+    global _profile
+    profile_file = os.environ.get("BLACKPEARL_STARTUP_PROFILE")
+    if not profile_file:
+        return
+    _profile = StartupProfile("%s.%s.json" % (profile_file, _worker_id()), float(os.environ["BLACKPEARL_STARTUP_BUDGET"]),
+                              float(os.environ["BLACKPEARL_IMPORT_BUDGET"]))
+    builtins.__import__ = _hooked_import
+    importlib.import_module = _hooked_import_module
+
+
+def finish():
+    """Stops recording and writes the startup profile. The budget violations are logged as warnings."""
+    global _profile
+    if not _profile:
+        return
+    builtins.__import__ = _original_import
+    importlib.import_module = _original_import_module
+    profile, _profile = _profile, None
+
+    for violation in profile.violations():
+        logger.warn(violation)
+    try:
+        profile.write()
+    except OSError as e:
+        logger.error("Failed to write the startup profile to <%s>. Reason: %s" % (profile.profile_file, e))
+
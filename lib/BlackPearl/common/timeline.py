@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+# This file is part of BlackPearl.
+
+# BlackPearl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BlackPearl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
+
+# Timeline of the steps of the server boot (and of the analyzer processes run during the boot). Each step is
+# recorded as a span with its start and end time. Spans are named by their path (parent/child), so that the
+# nested steps are shown under their parent. Times are wall clock times, so that the timelines written by the
+# other processes can be merged.
+
+import json
+import time
+
+
+class Timeline:
+    def __init__(self, started=None):
+        self.started = time.time() if started is None else started
+        self.spans = []
+
+    def span(self, name):
+        """Returns the context manager recording the span"""
+        return _Span(self, name)
+
+    def add(self, name, start, end):
+        self.spans.append({"name": name, "start": start, "end": end})
+
+    def merge(self, timeline_file, parent):
+        """Adds the spans of the timeline written to the file by the other process under the parent span"""
+        try:
+            with open(timeline_file) as f:
+                spans = json.load(f)["spans"]
+        except (OSError, ValueError, KeyError):
+            return
+        for span in spans:
+            self.add("%s/%s" % (parent, span["name"]), span["start"], span["end"])
+
+    def write(self, timeline_file):
+        with open(timeline_file, "w") as f:
+            json.dump({"started": self.started, "spans": self.spans}, f)
+
+
+class _Span:
+    def __init__(self, timeline, name):
+        self.timeline = timeline
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.timeline.add(self.name, self.start, time.time())
+
+
+def load(timeline_file):
+    """Returns the timeline written to the file"""
+    with open(timeline_file) as f:
+        data = json.load(f)
+    timeline = Timeline(data["started"])
+    timeline.spans = data["spans"]
+    return timeline
@@ -15,6 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
 
+import re
 import inspect
 import logging
 
@@ -22,6 +23,9 @@ from . import utils
 
 logger = logging.getLogger(__name__)
 
+# Priority class of the webmodules not decorated with @priority
+DEFAULT_PRIORITY = "interactive"
+
 
 class ClassMethodInvoker:
     def __init__(self, name, target):
@@ -99,7 +103,11 @@ def weblocation(parameter):
                     "handler": method,
                     "type": "file" if inspect.isgeneratorfunction(method) else "json",
                     "arguments": utils.get_signature_details(method),
-                    "desc": target.__doc__
+                    "desc": target.__doc__,
+                    "job": getattr(method, "__job__", None),
+                    "cpu_bound": getattr(method, "__cpu_bound__", False),
+                    "priority": getattr(method, "__priority__", getattr(target, "__priority__", DEFAULT_PRIORITY)),
+                    "ratelimit": getattr(method, "__ratelimit__", getattr(target, "__ratelimit__", None))
                 })
             target.__webmodules__ = webmodules
 
@@ -112,7 +120,11 @@ def weblocation(parameter):
                 "handler": target,
                 "type": "file" if inspect.isgeneratorfunction(target) else "json",
                 "arguments": utils.get_signature_details(target),
-                "desc": target.__doc__
+                "desc": target.__doc__,
+                "job": getattr(target, "__job__", None),
+                "cpu_bound": getattr(target, "__cpu_bound__", False),
+                "priority": getattr(target, "__priority__", DEFAULT_PRIORITY),
+                "ratelimit": getattr(target, "__ratelimit__", None)
             }
         else:
             raise Exception("Not implemented to support " + str(type(target)))
@@ -122,6 +134,138 @@ def weblocation(parameter):
     return parameter_wrapper
 
 
+def _apply_to_webmodules(target, key, attribute):
+    """Applies the setting of the target to its webmodules, when the decorator is used above @weblocation.
+    On a class, the methods having the setting of their own keep it."""
+    if "__webmodule__" in vars(target):
+        target.__webmodule__[key] = getattr(target, attribute)
+    elif "__webmodules__" in vars(target):
+        for webmodule in target.__webmodules__:
+            if not hasattr(webmodule["handler"], attribute):
+                webmodule[key] = getattr(target, attribute)
+
+
+# Python decorator
+def priority(parameter):
+    """Sets the priority class of the webmodule (or all the webmodules of a class).
+
+    Each priority class of a webapp is served by a separate uwsgi socket and worker pool, so that
+    the webmodules of one class (say "bulk") doesn't add latency to the others (say "interactive").
+    The webmodules not decorated with @priority belongs to the "interactive" class.
+
+    The decorator can be used above or below @weblocation. On a class, a method decorated with
+    @priority keeps its own priority class."""
+
+    if not isinstance(parameter, str) or not re.match(r"^[a-zA-Z0-9_]+$", parameter):
+        raise Exception("The decorator <priority> requires string of "
+                        "alphanumeric characters and _ (underscore) as argument.")
+
+    def set_priority(target):
+        target.__priority__ = parameter
+        _apply_to_webmodules(target, "priority", "__priority__")
+        return target
+
+    return set_priority
+
+
+# Python decorator
+def ratelimit(rate, burst=None, per="webmodule"):
+    """Limits the rate at which the webmodule (or all the webmodules of a class) can be invoked.
+
+    rate - number of requests allowed per second.
+    burst - number of requests allowed at once after being idle (defaults to rate, minimum 1).
+    per - "webmodule" to apply the limit to all the requests of the webmodule or
+          "session" to apply it separately for each session (client address for new sessions).
+
+    Requests beyond the limit are rejected with 429 status.
+
+    The decorator can be used above or below @weblocation. On a class, a method decorated with
+    @ratelimit keeps its own limit."""
+
+    if not isinstance(rate, (int, float)) or rate <= 0:
+        raise Exception("The decorator <ratelimit> requires positive number as rate.")
+
+    if burst is None:
+        burst = max(1, rate)
+    elif not isinstance(burst, int) or burst < 1:
+        raise Exception("The decorator <ratelimit> requires positive integer as burst.")
+
+    if per not in ("webmodule", "session"):
+        raise Exception("The decorator <ratelimit> requires 'webmodule' or 'session' as per.")
+
+    def set_ratelimit(target):
+        target.__ratelimit__ = {
+            "rate": float(rate),
+            "burst": burst,
+            "per": per
+        }
+        _apply_to_webmodules(target, "ratelimit", "__ratelimit__")
+        return target
+
+    return set_ratelimit
+
+
+# python decorator
+def job(function=None, ttl=None):
+    """Makes the webmodule to be executed in the background by the job workers.
+
+    The request only enqueues the validated arguments and returns the job id. The status of the job,
+    and its result or error once it is finished, can be fetched using the /__jobs__ webmodule.
+    Changes done to the session by the webmodule are not saved, as the job runs after the response
+    is sent. The result is removed after <ttl> seconds (configured result_ttl if not specified).
+
+    Can be used as @job or @job(ttl=3600) on a function or on a method of a webmodule class."""
+
+    if ttl is not None and (not isinstance(ttl, int) or ttl <= 0):
+        raise Exception("The decorator <job> requires positive integer as ttl.")
+
+    def mark_job(target):
+        if not inspect.isfunction(target):
+            logger.warn("Not implemented to support " + str(type(target)))
+            logger.warn("Ignoring the job decorator")
+            return target
+
+        if inspect.isgeneratorfunction(target):
+            logger.warn("File output webmodule <%s> can't be executed as a job. "
+                        "Ignoring the job decorator" % target.__name__)
+            return target
+
+        target.__job__ = {"ttl": ttl}
+        # @job used above @weblocation
+        if hasattr(target, "__webmodule__"):
+            target.__webmodule__["job"] = target.__job__
+        return target
+
+    if function is not None:
+        return mark_job(function)
+    return mark_job
+
+
+# python decorator
+def cpu_bound(function):
+    """Makes the webmodule to be executed in the process pool of the webapp instead of the uwsgi worker,
+    so that the CPU heavy webmodules doesn't block the worker and can use the idle cores.
+
+    The validated arguments and the session are pickled and sent to the pool process. So, they
+    should be picklable (File arguments are not)."""
+
+    if not inspect.isfunction(function):
+        logger.warn("Not implemented to support " + str(type(function)))
+        logger.warn("Ignoring the cpu_bound decorator")
+        return function
+
+    if inspect.isgeneratorfunction(function):
+        logger.warn("File output webmodule <%s> can't be executed in process pool. "
+                    "Ignoring the cpu_bound decorator" % function.__name__)
+        return function
+
+    function.__cpu_bound__ = True
+    # @cpu_bound used above @weblocation
+    if hasattr(function, "__webmodule__"):
+        function.__webmodule__["cpu_bound"] = True
+    return function
+
+
 # python decorator
 def preprocessor(function):
     if inspect.isfunction(function):
@@ -165,4 +309,57 @@ def posthandler(function):
     else:
         logger.warn("Not implemented to support " + str(type(function)))
         logger.warn("Ignoring the posthandler")
-        return function
\ No newline at end of file
+        return function
+
+
+# python decorator
+def on_worker_start(function):
+    """Makes the function to be called without arguments when the webapp is loaded in a uwsgi worker, before
+    the worker accepts requests. Used to open the connections, start the threads etc. needed by each worker.
+    When the webapp is preloaded, it is called in each worker after it is forked from the uwsgi master."""
+    if inspect.isfunction(function):
+        signature = inspect.signature(function)
+        if len(signature.parameters) != 0:
+            logger.warn("Worker start hook should have no argument but"
+                        " <%s> has <%s> arguments" % (function.__name__ + " at " + utils.get_module_name(function),
+                                                      len(signature.parameters)))
+            logger.warn("Ignoring the on_worker_start decorator")
+            return function
+
+        function.__on_worker_start__ = {
+            "name": utils.get_module_name(function) + "." + function.__name__,
+            "func": function,
+            "desc": function.__doc__
+        }
+        return function
+    else:
+        logger.warn("Not implemented to support " + str(type(function)))
+        logger.warn("Ignoring the on_worker_start decorator")
+        return function
+
+
+# python decorator
+def warmup(function):
+    """Makes the function to be called after the worker start hooks, before the worker accepts requests, to
+    warm up the worker (import the lazily imported modules, fill the caches etc.). The function gets one
+    argument, call(url, **parameters), which calls the webmodule of the webapp in-process with the sample
+    parameters and returns its output. Time taken by each warm-up hook is logged."""
+    if inspect.isfunction(function):
+        signature = inspect.signature(function)
+        if len(signature.parameters) != 1:
+            logger.warn("Warm-up hook should have 1 argument but"
+                        " <%s> has <%s> arguments" % (function.__name__ + " at " + utils.get_module_name(function),
+                                                      len(signature.parameters)))
+            logger.warn("Ignoring the warmup decorator")
+            return function
+
+        function.__warmup__ = {
+            "name": utils.get_module_name(function) + "." + function.__name__,
+            "func": function,
+            "desc": function.__doc__
+        }
+        return function
+    else:
+        logger.warn("Not implemented to support " + str(type(function)))
+        logger.warn("Ignoring the warmup decorator")
+        return function
@@ -45,3 +45,7 @@ class UnSuccessfulException(Exception):
         self.status = status
         self.desc = desc
         self.data = data
+
+    def __reduce__(self):
+        # Required for sending the exception back from the process pool (see @cpu_bound)
+        return self.__class__, (self.status, self.desc, self.data)
@@ -129,4 +129,20 @@ def signature(url):
         "type": webapp.webmodules[url]['type'],
         "desc": webapp.webmodules[url]['desc'],
         "testsets": ts
-    }
\ No newline at end of file
+    }
+
+
+@weblocation('/__jobs__')
+def job_status(job_id):
+    """Return the status of the job submitted to a job webmodule
+    and its result or error once the job is finished"""
+    webapp = application.webapp
+
+    if not application.job_queue:
+        raise RequestInvalid("No job webmodules defined in webapp <%s>" % webapp.name)
+
+    job = application.job_queue.get(webapp.id, job_id)
+    if not job:
+        raise RequestInvalid("The job <%s> not found or its result is expired" % job_id)
+
+    return job
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+# This file is part of BlackPearl.
+
+# BlackPearl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BlackPearl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
+
+# Hot reload of the changed modules of the webapp inside the running uwsgi worker (hot_reload in the server
+# config). The server writes the changed source files to the hot reload file of the instance and the worker
+# checks the file before each request. The changed modules, and the modules using them, are reloaded in the
+# order of their dependencies, without restarting the worker. When the change can not be applied in place, the
+# worker triggers the chain reload of the instance instead.
+
+import os
+import sys
+import json
+import types
+import inspect
+import importlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def _source(module):
+    path = getattr(module, "__file__", None)
+    return os.path.realpath(path) if path else None
+
+
+def webapp_modules(folders):
+    """Returns {module name: module} of the imported modules having their source in the folders"""
+    folders = tuple(os.path.join(os.path.realpath(folder), "") for folder in folders)
+    modules = {}
+    for name, module in list(sys.modules.items()):
+        source = _source(module) if module else None
+        if source and source.startswith(folders):
+            modules[name] = module
+    return modules
+
+
+def dependencies(modules):
+    """Returns {module name: names of the modules it uses} of the modules. A module uses the modules, functions
+    and classes bound to its global names (import x, from x import y)."""
+    graph = {}
+    for name, module in modules.items():
+        used = set()
+        for value in list(vars(module).values()):
+            if isinstance(value, types.ModuleType):
+                used.add(value.__name__)
+            elif inspect.isclass(value) or inspect.isfunction(value):
+                used.add(value.__module__)
+        graph[name] = set(used_name for used_name in used if used_name in modules and used_name != name)
+    return graph
+
+
+def reload_order(changed, graph):
+    """Returns the changed modules and the modules using them (directly or through other modules), ordered so
+    that a module is reloaded after the modules it uses. Raises HotReloadError if they use each other."""
+    users = {name: set() for name in graph}
+    for name, used in graph.items():
+        for used_name in used:
+            users[used_name].add(name)
+
+    affected = set()
+    pending = list(changed)
+    while pending:
+        name = pending.pop()
+        if name not in affected:
+            affected.add(name)
+            pending.extend(users[name])
+
+    order = []
+    visiting = []
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise HotReloadError("Modules <%s> use each other" % ", ".join(visiting[visiting.index(name):]))
+        visiting.append(name)
+        for used_name in sorted(graph[name] & affected):
+            visit(used_name)
+        visiting.pop()
+        order.append(name)
+
+    for name in sorted(affected):
+        visit(name)
+    return order
+
+
+class HotReloader:
+    def __init__(self, signal_file, reload_file, folders):
+        # Written by the server with the changed files
+        self.signal_file = signal_file
+        # Touched to trigger the chain reload of the instance
+        self.reload_file = reload_file
+        # Source folders of the webapp
+        self.folders = folders
+        # Held while the hot reload is applied, so that it is applied once by a multi-threaded worker
+        self.lock = threading.Lock()
+        # Hot reload written before the worker is started is already in the code loaded by it
+        self._stamp = self._signal_stamp()
+
+    def _signal_stamp(self):
+        try:
+            return os.stat(self.signal_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def pending(self):
+        """Returns the list of the changed files, if the server has written a hot reload since the last call.
+        Otherwise None."""
+        stamp = self._signal_stamp()
+        if stamp == self._stamp:
+            return None
+        self._stamp = stamp
+        try:
+            with open(self.signal_file) as f:
+                return json.load(f)["files"]
+        except (OSError, ValueError, KeyError) as e:
+            raise HotReloadError("Failed to read the hot reload file <%s>. Reason: %s" % (self.signal_file, e))
+
+    def modules_to_reload(self, files):
+        """Returns the names of the imported modules of the changed files and the modules using them, in the
+        order they are to be reloaded. Modules which are not imported yet are imported from the new code
+        when they are used. Nothing is reloaded, so that the change can be checked first."""
+        modules = webapp_modules(self.folders)
+        changed_files = set(os.path.realpath(f) for f in files)
+        changed = [name for name, module in modules.items() if _source(module) in changed_files]
+        return reload_order(changed, dependencies(modules))
+
+    def reload_modules(self, order):
+        """Reloads the modules in the order returned by modules_to_reload"""
+        for name in order:
+            logger.info("Reloading module <%s>" % name)
+            importlib.reload(sys.modules[name])
+
+    def fallback(self):
+        """Triggers the chain reload of the instance, restarting the workers with the new code"""
+        with open(self.reload_file, "w") as f:
+            f.write("reload workers")
+
+
+class HotReloadError(Exception):
+    pass
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+# This file is part of BlackPearl.
+
+# BlackPearl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BlackPearl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import time
+import uuid
+import pickle
+import sqlite3
+import logging
+
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# Times a job is claimed by the job workers. A job interrupted this many times by the death of its job worker
+# (e.g. a job crashing the worker) is marked failed instead of being queued again.
+MAX_ATTEMPTS = 3
+
+
+class JobQueue:
+    """SQLite backed queue which holds the jobs submitted to the webmodules decorated with @job.
+
+    The same queue file is shared by the uwsgi workers (which enqueue the jobs) and the job
+    workers started by the AppServer (which execute them). A new connection is opened for
+    every operation as the queue is used from forked processes."""
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._init_db()
+
+    def _connect(self):
+        # isolation_level=None, so that the transactions are controlled explicitly
+        return sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+
+    def _init_db(self):
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                         "id TEXT PRIMARY KEY, webapp TEXT, url TEXT, session BLOB, arguments BLOB, "
+                         "status TEXT, result TEXT, error TEXT, ttl INTEGER, "
+                         "created REAL, started REAL, finished REAL, expires REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (webapp, status, created)")
+            # Queue created by an older version doesn't count the attempts
+            if "attempts" not in [column[1] for column in conn.execute("PRAGMA table_info(jobs)")]:
+                conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+    def enqueue(self, webapp_id, url, session, arguments, ttl):
+        """Adds a job to the queue and returns its id.
+
+        Raises ValueError if the session or the arguments can't be pickled."""
+        try:
+            session_bytes = pickle.dumps(session)
+            arguments_bytes = pickle.dumps(arguments)
+        except Exception as e:
+            raise ValueError("Job arguments are not picklable. Error: <%s>" % e) from None
+
+        job_id = uuid.uuid4().hex
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT INTO jobs (id, webapp, url, session, arguments, status, ttl, created) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (job_id, webapp_id, url, session_bytes, arguments_bytes, QUEUED, int(ttl), time.time()))
+        return job_id
+
+    def claim(self, webapp_id):
+        """Marks the oldest queued job of the webapp as running and returns it.
+        Returns None when no job is queued."""
+        with closing(self._connect()) as conn:
+            # BEGIN IMMEDIATE takes the write lock upfront, so that two workers never claim the same job
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT id, url, session, arguments FROM jobs "
+                                   "WHERE webapp = ? AND status = ? ORDER BY created LIMIT 1",
+                                   (webapp_id, QUEUED)).fetchone()
+                if row:
+                    conn.execute("UPDATE jobs SET status = ?, started = ?, attempts = attempts + 1 WHERE id = ?",
+                                 (RUNNING, time.time(), row[0]))
+                conn.execute("COMMIT")
+            except:
+                conn.execute("ROLLBACK")
+                raise
+
+        if not row:
+            return None
+
+        return {
+            "id": row[0],
+            "url": row[1],
+            "session": pickle.loads(row[2]),
+            "arguments": pickle.loads(row[3])
+        }
+
+    def _finish(self, job_id, status, result, error):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, expires = ? + ttl, "
+                         "session = NULL, arguments = NULL WHERE id = ?",
+                         (status, result, error, now, now, job_id))
+
+    def complete(self, job_id, result):
+        """Stores the result of the job. The result should be JSON serializable."""
+        self._finish(job_id, COMPLETED, json.dumps(result), None)
+
+    def fail(self, job_id, error):
+        """Stores the error (a dict of the form {"status": .., "desc": .., "data": ..}) of the job"""
+        self._finish(job_id, FAILED, None, json.dumps(error))
+
+    def requeue(self, job_id):
+        """Moves the job back to the queue, when its job worker is stopped. The attempt is not counted."""
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE jobs SET status = ?, started = NULL, attempts = attempts - 1 WHERE id = ?",
+                         (QUEUED, job_id))
+
+    def requeue_interrupted(self, webapp_id):
+        """Moves the jobs left in running state (by a killed job worker) back to the queue. Jobs which have
+        already been attempted MAX_ATTEMPTS times are marked failed. Returns the number of the requeued jobs.
+        Should be called only while no job worker of the webapp is running."""
+        error = json.dumps({
+            "status": -299,
+            "desc": "The job worker executing the job stopped unexpectedly <%s> times" % MAX_ATTEMPTS
+        })
+        now = time.time()
+        with closing(self._connect()) as conn:
+            failed = conn.execute("UPDATE jobs SET status = ?, error = ?, finished = ?, expires = ? + ttl, "
+                                  "session = NULL, arguments = NULL "
+                                  "WHERE webapp = ? AND status = ? AND attempts >= ?",
+                                  (FAILED, error, now, now, webapp_id, RUNNING, MAX_ATTEMPTS)).rowcount
+            count = conn.execute("UPDATE jobs SET status = ?, started = NULL WHERE webapp = ? AND status = ?",
+                                 (QUEUED, webapp_id, RUNNING)).rowcount
+        if failed:
+            logger.warn("Marked <%s> jobs of webapp <%s> failed after <%s> attempts" % (failed, webapp_id,
+                                                                                      MAX_ATTEMPTS))
+        return count
+
+    def get(self, webapp_id, job_id):
+        """Returns the details of the job or None if the job is not found or its result is expired"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT id, url, status, result, error, created, started, finished, expires "
+                               "FROM jobs WHERE id = ? AND webapp = ?", (job_id, webapp_id)).fetchone()
+
+        if not row or (row[8] is not None and row[8] < time.time()):
+            return None
+
+        return {
+            "id": row[0],
+            "url": row[1],
+            "status": row[2],
+            "result": json.loads(row[3]) if row[3] is not None else None,
+            "error": json.loads(row[4]) if row[4] is not None else None,
+            "created": row[5],
+            "started": row[6],
+            "finished": row[7],
+            "expires": row[8]
+        }
+
+    def purge(self):
+        """Removes the jobs whose result is expired"""
+        with closing(self._connect()) as conn:
+            count = conn.execute("DELETE FROM jobs WHERE expires < ?", (time.time(),)).rowcount
+        if count:
+            logger.info("Removed <%s> expired job results." % count)
+        return count
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+# This file is part of BlackPearl.
+
+# BlackPearl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BlackPearl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
+
+# Manifest of the analysed webapp, written by the analyzer and loaded by the uwsgi workers in place of the
+# pickled Webapp object. The manifest holds the routes, their argument specs (signatures with the datatypes)
+# and the import paths of the handlers. Loading it doesn't import the handler modules; a handler module is
+# imported on the first request of one of its routes. The signatures are kept pickled in the manifest and are
+# unpickled on the first request of their route, as their annotations can be datatypes defined by the webapp. Testsets are kept pickled separately in the manifest and
+# are unpickled only when they are first used. In production mode they are left out of the loaded manifest and
+# read again from the manifest file when they are first used.
+
+import inspect
+import pickle
+import importlib
+import logging
+
+from .decorators import ClassMethodInvoker, FunctionInvoker
+
+logger = logging.getLogger(__name__)
+
+# Incremented whenever the layout of the manifest changes
+MANIFEST_VERSION = 4
+
+# Attributes of the Webapp stored in the manifest in their own form
+_ROUTE_ATTRIBUTES = ("webmodules", "testsets", "preprocessors", "posthandlers", "worker_start_hooks", "warmup_hooks")
+
+
+def import_path(module, qualname):
+    """Imports the module and returns the object having the qualified name in it"""
+    target = importlib.import_module(module)
+    for name in qualname.split("."):
+        target = getattr(target, name)
+    return target
+
+
+class LazyFunction:
+    """Function referred by its import path. The module is imported on the first call."""
+
+    def __init__(self, module, qualname):
+        self.module = module
+        self.qualname = qualname
+        self._target = None
+
+    def __repr__(self):
+        return "%s.%s" % (self.module, self.qualname)
+
+    def _load(self):
+        return import_path(self.module, self.qualname)
+
+    def resolve(self):
+        if self._target is None:
+            self._target = self._load()
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __getstate__(self):
+        # Imported target is not pickled along (when sent to the cpu bound process pool)
+        state = self.__dict__.copy()
+        state["_target"] = None
+        return state
+
+
+class LazyInvoker(LazyFunction):
+    """Invoker of the webmodule defined as a function or as a method of the class"""
+
+    def __init__(self, module, qualname, method=None):
+        super().__init__(module, qualname)
+        self.method = method
+
+    def __repr__(self):
+        if self.method:
+            return "%s.%s.%s" % (self.module, self.qualname, self.method)
+        return super().__repr__()
+
+    def _load(self):
+        target = import_path(self.module, self.qualname)
+        if self.method is None:
+            return FunctionInvoker(target)
+        return ClassMethodInvoker(self.method, target)
+
+    def signature(self):
+        """Computes the signature of the handler. Used only when the signature in the manifest is not usable."""
+        invoker = self.resolve()
+        if self.method is None:
+            return inspect.signature(invoker.target)
+        return inspect.signature(getattr(invoker.target(), self.method))
+
+
+class LazyTestset(LazyFunction):
+    """Testset invoker of the webmodule"""
+
+    def __init__(self, module, qualname, webmodule):
+        super().__init__(module, qualname)
+        self.webmodule = webmodule
+
+    def _load(self):
+        invoker = import_path(self.module, self.qualname).__testset__["func"]
+        # Url of the webmodule is prefixed with the url_prefix during the analysis
+        invoker.webmodule = self.webmodule
+        return invoker
+
+
+class WebappManifest:
+    """Webapp as loaded from its manifest. Provides the same attributes as the Webapp used during
+    the request handling."""
+
+    def __init__(self, attributes, webmodules, preprocessors, posthandlers, testsets, worker_start_hooks,
+                 warmup_hooks, manifest_file=None):
+        self.__dict__.update(attributes)
+        self.webmodules = webmodules
+        self.preprocessors = preprocessors
+        self.posthandlers = posthandlers
+        self.worker_start_hooks = worker_start_hooks
+        self.warmup_hooks = warmup_hooks
+        # Pickled testsets, unpickled on the first access. None if they are left out when the manifest is loaded.
+        self._testsets = testsets
+        self._manifest_file = manifest_file
+
+    @property
+    def testsets(self):
+        if self._testsets is None:
+            logger.info("Loading the testsets of webapp <%s> from the manifest <%s>" % (self.name,
+                                                                                       self._manifest_file))
+            with open(self._manifest_file, "rb") as f:
+                self._testsets = pickle.load(f)["testsets"]
+        if isinstance(self._testsets, bytes):
+            self._testsets = pickle.loads(self._testsets)
+        return self._testsets
+
+    def import_handlers(self):
+        """Imports the modules of all the handlers upfront"""
+        for webmodule in self.webmodules.values():
+            webmodule["func"].resolve()
+        for handler in self.preprocessors + self.posthandlers + self.worker_start_hooks + self.warmup_hooks:
+            handler["func"].resolve()
+
+    def replace_routes(self, new, modules):
+        """Takes the routes from the new manifest of the webapp, after the modules are reloaded in place. The
+        webmodules of the reloaded modules, and the new webmodules, are replaced. The others keep their imported
+        handlers. Requests in progress keep the entry they already have."""
+        webmodules = {url: webmodule for url, webmodule in self.webmodules.items() if url in new.webmodules}
+        for url, webmodule in new.webmodules.items():
+            if url not in webmodules or webmodule["func"].module in modules:
+                webmodules[url] = webmodule
+        # Swapped at once, so that a request sees either the old or the new routes
+        self.webmodules = webmodules
+        self.preprocessors = new.preprocessors
+        self.posthandlers = new.posthandlers
+        self.worker_start_hooks = new.worker_start_hooks
+        self.warmup_hooks = new.warmup_hooks
+        self._testsets = new._testsets
+        self._manifest_file = new._manifest_file
+
+
+def _signature(url, webmodule):
+    """Returns the signature of the handler pickled, or None if it isn't picklable. Unpickling the annotations
+    and the defaults imports the modules defining their classes, so it is done on the first request."""
+    signature = inspect.signature(webmodule["handler"])
+    signature = signature.replace(return_annotation=inspect.Signature.empty)
+    try:
+        return pickle.dumps(signature, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        logger.info("Signature of the webmodule <%s> is not picklable. It is computed in the worker "
+                    "on the first request. Reason: %s" % (url, e))
+        return None
+
+
+def _webmodule(url, webmodule):
+    invoker = webmodule["func"]
+    if isinstance(invoker, ClassMethodInvoker):
+        func = LazyInvoker(invoker.target.__module__, invoker.target.__qualname__, invoker.name)
+    else:
+        func = LazyInvoker(invoker.target.__module__, invoker.target.__qualname__)
+
+    entry = {key: value for key, value in webmodule.items() if key != "handler"}
+    entry["func"] = func
+    entry["signature"] = _signature(url, webmodule)
+    return entry
+
+
+def _handler(handler):
+    entry = dict(handler)
+    entry["func"] = LazyFunction(handler["func"].__module__, handler["func"].__qualname__)
+    return entry
+
+
+def _testset(testset):
+    function = testset["func"].function
+    entry = dict(testset)
+    entry["func"] = LazyTestset(function.__module__, function.__qualname__, testset["webmodule"])
+    return entry
+
+
+def write(webapp, manifest_file):
+    """Writes the manifest of the analysed webapp to the file"""
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "attributes": {name: value for name, value in vars(webapp).items() if name not in _ROUTE_ATTRIBUTES},
+        "webmodules": {url: _webmodule(url, webmodule) for url, webmodule in webapp.webmodules.items()},
+        "preprocessors": [_handler(preprocessor) for preprocessor in webapp.preprocessors],
+        "posthandlers": [_handler(posthandler) for posthandler in webapp.posthandlers],
+        "worker_start_hooks": [_handler(hook) for hook in webapp.worker_start_hooks],
+        "warmup_hooks": [_handler(hook) for hook in webapp.warmup_hooks],
+        "testsets": pickle.dumps({url: [_testset(testset) for testset in testsets]
+                                  for url, testsets in webapp.testsets.items()}, protocol=pickle.HIGHEST_PROTOCOL)
+    }
+    with open(manifest_file, "wb") as f:
+        pickle.dump(manifest, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load(manifest_file, testsets=True):
+    """Loads the manifest of the webapp. The testsets are left out if testsets is False. They are then read
+    from the manifest file when they are first used.
+    Raises ManifestVersionError if the manifest is written by a different version of BlackPearl."""
+    with open(manifest_file, "rb") as f:
+        manifest = pickle.load(f)
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ManifestVersionError("Manifest <%s> is of version <%s> but version <%s> is expected. "
+                                   "Restart the server to analyse the webapp again." % (
+                                       manifest_file, manifest.get("version"), MANIFEST_VERSION))
+
+    return WebappManifest(manifest["attributes"], manifest["webmodules"], manifest["preprocessors"],
+                          manifest["posthandlers"], manifest["testsets"] if testsets else None,
+                          manifest["worker_start_hooks"], manifest["warmup_hooks"], manifest_file)
+
+
+class ManifestVersionError(Exception):
+    pass
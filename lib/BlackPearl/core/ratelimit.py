@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+# This file is part of BlackPearl.
+
+# BlackPearl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BlackPearl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import mmap
+import time
+import zlib
+import fcntl
+import hashlib
+import struct
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Number of buckets in the table. A key is hashed to a slot and its bucket is one of the PROBES buckets starting
+# from the slot. Bucket stores the hash of its key, so that two keys never share a bucket.
+BUCKETS = 4096
+PROBES = 8
+
+# Each bucket holds the hash of its key, the available tokens and the time at which it was last updated.
+_BUCKET = struct.Struct("Qdd")
+
+
+class TokenBuckets:
+    """Table of token buckets kept in a memory mapped file.
+
+    All the uwsgi workers of a webapp map the same file, so that the rate limits are applied
+    across the workers. Buckets of the slot of the key are locked (using fcntl record lock) while
+    the bucket is updated. When all the buckets of the slot are used by the other keys, the bucket
+    updated least recently is taken over by the key (starting full, as the limit of an idle key)."""
+
+    def __init__(self, path, buckets=BUCKETS):
+        self.path = path
+        self.buckets = buckets
+        size = buckets * _BUCKET.size
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._mm = mmap.mmap(self._fd, size)
+        # fcntl locks are held per process. So, the threads of the worker are serialized using this lock.
+        self._lock = threading.Lock()
+
+    def acquire(self, key, rate, burst):
+        """Takes a token from the bucket of the key.
+
+        The bucket is refilled at <rate> tokens per second up to <burst> tokens.
+        Returns 0 if the token is taken, otherwise the seconds to wait for the next token."""
+        encoded = key.encode('UTF-8')
+        # Buckets of the slot don't wrap around the end of the table, so that they are locked as one region
+        start = (zlib.crc32(encoded) % (self.buckets - PROBES + 1)) * _BUCKET.size
+        key_hash = int.from_bytes(hashlib.sha1(encoded).digest()[:8], "little") or 1
+
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, PROBES * _BUCKET.size, start)
+            try:
+                offset = self._find_bucket(start, key_hash)
+                bucket_hash, tokens, updated = _BUCKET.unpack_from(self._mm, offset)
+                now = time.time()
+                if bucket_hash != key_hash or updated == 0:
+                    # Bucket used by the key for the first time
+                    tokens = burst
+                else:
+                    tokens = min(burst, tokens + (now - updated) * rate)
+
+                if tokens >= 1:
+                    tokens -= 1
+                    wait = 0
+                else:
+                    wait = (1 - tokens) / rate
+
+                _BUCKET.pack_into(self._mm, offset, key_hash, tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, PROBES * _BUCKET.size, start)
+
+        return wait
+
+    def _find_bucket(self, start, key_hash):
+        """Returns the offset of the bucket of the key among the buckets of its slot. If the key has no bucket,
+        an unused bucket or else the bucket updated least recently is returned."""
+        candidate = None
+        candidate_updated = None
+        for offset in range(start, start + PROBES * _BUCKET.size, _BUCKET.size):
+            bucket_hash, tokens, updated = _BUCKET.unpack_from(self._mm, offset)
+            if bucket_hash == key_hash:
+                return offset
+            if candidate is None or updated < candidate_updated:
+                candidate, candidate_updated = offset, updated
+        return candidate
@@ -15,6 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
 
+import re
 import traceback
 import sys
 import inspect
@@ -22,13 +23,30 @@ import os
 import importlib
 import yaml
 import yaml.parser
-import pip
 import logging
 
 from . import utils
+from .decorators import DEFAULT_PRIORITY
 
 logger = logging.getLogger(__name__)
 
+# uwsgi listen queue size used when it is configured neither in the webapp nor in uwsgi_options
+DEFAULT_LISTEN_BACKLOG = 100
+
+# Options allowed in the performance section of the webapp config.yaml and the uwsgi options they are mapped to
+PERFORMANCE_OPTIONS = {
+    "processes": "workers",
+    "threads": "threads",
+    "listen": "listen",
+    "buffer_size": "buffer-size",
+    "max_requests": "max-requests",
+    "harakiri": "harakiri"
+}
+
+
+# Name of the shared pool of webapps. It is used in the file names of the uwsgi instance serving the pool.
+POOL_NAME = re.compile(r"^[a-zA-Z0-9_]+$")
+
 
 class WebAppMinimal:
     """WebAppMinimal will hold a minimal information about the webapp which are required for preparing the run
@@ -39,9 +57,36 @@ class WebAppMinimal:
         self.location = webapp.location
         self.pickle_file = pickle_file
         self.url_prefix = webapp.url_prefix
+        self.performance = webapp.performance
+        self.autoscale = webapp.autoscale
+        self.recycle = webapp.recycle
+        self.idle_timeout = webapp.idle_timeout
+        self.pool = webapp.pool
+        self.preload = webapp.preload
+        self.blue_green = webapp.blue_green
+        # URLs of the webmodules having testsets. Used for testing the new code before it is deployed.
+        self.testsets = sorted(webapp.testsets)
+        # uwsgi instance id of the shared pool serving the webapp. Assigned by the server.
+        self.pool_instance = None
+        self.jobs = [url for url, webmodule in webapp.webmodules.items() if webmodule.get("job")]
+        self.priority_workers = webapp.priority_workers
+        # URLs of the webmodules of each priority class other than the default one
+        self.priority_classes = {}
+        for url, webmodule in webapp.webmodules.items():
+            priority = webmodule.get("priority", DEFAULT_PRIORITY)
+            if priority != DEFAULT_PRIORITY:
+                self.priority_classes.setdefault(priority, []).append(url)
+        for urls in self.priority_classes.values():
+            urls.sort()
         self.python_home_path = None
         self.python_path = None
 
+    def instances(self):
+        """Returns the list of (instance id, priority class) of the uwsgi instances serving the webapp.
+        The default priority class is served by the instance having the webapp id as instance id."""
+        return [(self.id, DEFAULT_PRIORITY)] + [("%s.%s" % (self.id, priority), priority)
+                                                for priority in sorted(self.priority_classes)]
+
     def __repr__(self):
         return repr({
             "webapp": self.name,
@@ -63,6 +108,9 @@ class Webapp:
         self.testsets = {}
         self.preprocessors = []
         self.posthandlers = []
+        # Functions decorated with @on_worker_start and @warmup, in the order they are found
+        self.worker_start_hooks = []
+        self.warmup_hooks = []
 
         self.defined_preprocessors = []
         self.defined_posthandlers = []
@@ -202,6 +250,64 @@ class Webapp:
 
         logger.info("URL prefix <%s>" % self.url_prefix)
 
+        try:
+            self.cpu_bound_processes = int(config.cpu_bound_processes)
+            if self.cpu_bound_processes <= 0:
+                raise ValueError("Value should be greater than zero")
+        except AttributeError:
+            self.cpu_bound_processes = None
+        except (TypeError, ValueError):
+            logger.warn("Webapp<%s> - cpu_bound_processes should be a positive integer but <%s> found. "
+                        "Ignoring option .." % (self.name, config.cpu_bound_processes))
+            self.cpu_bound_processes = None
+
+        self._init_priority_workers(config)
+
+        self._init_performance(config)
+        self._init_autoscale(config)
+        self._init_recycle(config)
+
+        self._init_overload(config)
+
+        try:
+            self.idle_timeout = float(config.idle_timeout)
+            if self.idle_timeout <= 0:
+                raise ValueError("Value should be greater than zero")
+        except AttributeError:
+            self.idle_timeout = None
+        except (TypeError, ValueError):
+            logger.warn("Webapp<%s> - idle_timeout should be a positive number of seconds but <%s> found. "
+                        "Ignoring option .." % (self.name, config.idle_timeout))
+            self.idle_timeout = None
+
+        try:
+            self.pool = str(config.pool)
+            if not POOL_NAME.match(self.pool):
+                logger.warn("Webapp<%s> - pool name <%s> should contain only alphanumeric characters and "
+                            "underscore. Serving the webapp in its own processes .." % (self.name, self.pool))
+                self.pool = None
+        except AttributeError:
+            self.pool = None
+
+        try:
+            self.preload = bool(config.preload)
+        except AttributeError:
+            self.preload = False
+
+        try:
+            self.warmup_hook = str(config.warmup_hook)
+            if "." not in self.warmup_hook:
+                logger.warn("Webapp<%s> - warmup_hook <%s> should be in <module>.<function> format. "
+                            "Ignoring warmup_hook .." % (self.name, self.warmup_hook))
+                self.warmup_hook = None
+        except AttributeError:
+            self.warmup_hook = None
+
+        try:
+            self.blue_green = bool(config.blue_green)
+        except AttributeError:
+            self.blue_green = False
+
         try:
             self.defined_posthandlers = config.posthandlers
         except:
@@ -212,6 +318,129 @@ class Webapp:
         except:
             pass
 
+    def _init_priority_workers(self, config):
+        """Initializes the number of uwsgi workers of the instance serving each priority class defined under
+        priority_classes section"""
+        self.priority_workers = {}
+        try:
+            priority_classes = config.priority_classes
+        except AttributeError:
+            return
+
+        if not isinstance(priority_classes, dict):
+            logger.warn("Webapp<%s> - priority_classes section should map the priority classes to their number of "
+                        "workers. Ignoring section .." % self.name)
+            return
+
+        for priority, workers in priority_classes.items():
+            try:
+                workers = int(workers)
+                if workers <= 0:
+                    raise ValueError("Value should be greater than zero")
+            except (TypeError, ValueError):
+                logger.warn("Webapp<%s> - Workers of the priority class <%s> should be a positive integer "
+                            "but <%s> found. Ignoring priority class .." % (self.name, priority, workers))
+                continue
+            self.priority_workers[str(priority)] = workers
+
+    def _init_overload(self, config):
+        """Initializes the seconds (max_queue_wait) beyond which a request waiting in the uwsgi listen queue is
+        rejected. Set to None when it is not defined."""
+        self.max_queue_wait = None
+        try:
+            overload = config.overload
+        except AttributeError:
+            return
+
+        if not isinstance(overload, dict):
+            logger.warn("Webapp<%s> - overload section should define max_queue_wait. Ignoring section .." % self.name)
+            return
+
+        max_queue_wait = overload.get("max_queue_wait")
+        if max_queue_wait is None:
+            return
+        try:
+            max_queue_wait = float(max_queue_wait)
+            if max_queue_wait <= 0:
+                raise ValueError("Value should be greater than zero")
+        except (TypeError, ValueError):
+            logger.warn("Webapp<%s> - Option <max_queue_wait> under overload section should be a positive number "
+                        "but <%s> found. Ignoring option .." % (self.name, max_queue_wait))
+            return
+        self.max_queue_wait = max_queue_wait
+
+    def _init_performance(self, config):
+        """Initializes the uwsgi tuning options defined under performance section. The options not
+        defined are set to None, so that the uwsgi_options of the server or the defaults get used."""
+        self.performance = {option: None for option in PERFORMANCE_OPTIONS}
+        try:
+            performance = config.performance
+        except AttributeError:
+            return
+
+        for option, value in performance.items():
+            if option not in PERFORMANCE_OPTIONS:
+                logger.warn("Webapp<%s> - Unknown option <%s> under performance section. "
+                            "Ignoring option .." % (self.name, option))
+                continue
+            try:
+                value = int(value)
+                if value <= 0:
+                    raise ValueError("Value should be greater than zero")
+            except (TypeError, ValueError):
+                logger.warn("Webapp<%s> - Option <%s> under performance section should be a positive integer "
+                            "but <%s> found. Ignoring option .." % (self.name, option, value))
+                continue
+            self.performance[option] = value
+
+    def _init_autoscale(self, config):
+        """Initializes the worker bounds within which the uwsgi workers of the webapp are scaled.
+        Autoscaling is disabled (self.autoscale is None) when the autoscale section is not defined."""
+        self.autoscale = None
+        try:
+            autoscale = config.autoscale
+        except AttributeError:
+            return
+
+        try:
+            min_workers = int(autoscale.get("min_workers", 1))
+            max_workers = int(autoscale["max_workers"])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            logger.warn("Webapp<%s> - autoscale section should define max_workers and optionally min_workers "
+                        "as integers. Disabling autoscaling .." % self.name)
+            return
+
+        if not 0 < min_workers < max_workers:
+            logger.warn("Webapp<%s> - autoscale min_workers<%s> should be greater than zero and less than "
+                        "max_workers<%s>. Disabling autoscaling .." % (self.name, min_workers, max_workers))
+            return
+
+        self.autoscale = {"min_workers": min_workers, "max_workers": max_workers}
+
+    def _init_recycle(self, config):
+        """Initializes the limits (max_rss in MB and max_requests) beyond which the uwsgi workers of the
+        webapp are recycled by the server. Limits not defined are set to None."""
+        self.recycle = {"max_rss": None, "max_requests": None}
+        try:
+            recycle = config.recycle
+        except AttributeError:
+            return
+
+        for option, value in recycle.items():
+            if option not in self.recycle:
+                logger.warn("Webapp<%s> - Unknown option <%s> under recycle section. "
+                            "Ignoring option .." % (self.name, option))
+                continue
+            try:
+                value = int(value)
+                if value <= 0:
+                    raise ValueError("Value should be greater than zero")
+            except (TypeError, ValueError):
+                logger.warn("Webapp<%s> - Option <%s> under recycle section should be a positive integer "
+                            "but <%s> found. Ignoring option .." % (self.name, option, value))
+                continue
+            self.recycle[option] = value
+
     def _init_handlers(self, config):
         """Initializes the defined handler in the webapp"""
         try:
@@ -276,6 +505,15 @@ class Webapp:
             return False
         return True
 
+    @staticmethod
+    def _add_hook(hooks, hook):
+        """Adds the hook, unless it is already added from another handler module importing it"""
+        func = hook['func']
+        qualname = (func.__module__, func.__qualname__)
+        if [added for added in hooks if (added['func'].__module__, added['func'].__qualname__) == qualname]:
+            return
+        hooks.append(hook)
+
     def _parse_module(self, module):
         isfunction = inspect.isfunction
         isclass = inspect.isclass
@@ -307,6 +545,10 @@ class Webapp:
                               "listed in posthandler list.."
                               " Ignoring posthandler."
                               % (self.name, member.__posthandler__['name']))
+                elif hasattr(member, "__on_worker_start__"):
+                    self._add_hook(self.worker_start_hooks, member.__on_worker_start__)
+                elif hasattr(member, "__warmup__"):
+                    self._add_hook(self.warmup_hooks, member.__warmup__)
             elif isclass(member) and hasattr(member, "__webmodules__"):
                 for webmodule in member.__webmodules__:
                     if len(self.url_prefix) == 1:
@@ -323,6 +565,30 @@ class NotEnabledError(Exception):
     pass
 
 
+def get_pool(location, webapp_folder):
+    """Returns the shared pool configured in the webapp or None. Used by the server to select
+    the virtualenv of the webapp before it is analysed."""
+    try:
+        with open(os.path.join(location, webapp_folder, "config.yaml")) as config_file:
+            pool = yaml.load(config_file).get("pool")
+    except Exception:
+        return None
+
+    if pool is None or not POOL_NAME.match(str(pool)):
+        return None
+    return str(pool)
+
+
+def replace_minimal(webapps_minimal, webapp_minimal):
+    """Replaces the analysis result of the webapp in the list (in place), or adds it if the webapp is new"""
+    for index, analysed in enumerate(webapps_minimal):
+        if analysed.location == webapp_minimal.location:
+            webapps_minimal[index] = webapp_minimal
+            break
+    else:
+        webapps_minimal.append(webapp_minimal)
+
+
 def get_webapp_folders(location):
     if not os.access(location, os.F_OK):
         logger.warn("Webapps folder<%s> not found. Ignoring.. " % location)
@@ -341,20 +607,6 @@ def analyze(location, webapp_folder):
         logger.info("Adding <%s> to python path." % l)
         sys.path.append(l)
 
-    req_file = os.path.join(location, webapp_folder, "requirements.txt")
-
-    if os.access(req_file, os.F_OK):
-        logger.info("Requirements file found at <%s>" % req_file)
-        for package in req_file:
-            if pip.main(['install', package]) == 1:
-                logger.error("Failed to install the library <%s> required by the webapp <%s>.  " %
-                      (package, webapp_folder))
-                return
-
-        logger.info("Packages installed successfully.")
-    else:
-        logger.info("Requirements file not found.")
-
     try:
         webapp = Webapp(location, webapp_folder)
         if webapp.initialize():
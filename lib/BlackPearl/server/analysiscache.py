@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+# This file is part of BlackPearl.
+
+# BlackPearl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BlackPearl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
+
+# Cache of the webapp analysis results, kept across the server restarts. The analysis result of a webapp is reused
+# as long as the fingerprint of the webapp is not changed. The fingerprint covers the content of the webapp folder
+# (static files excluded), the python used for the webapp, the BlackPearl code doing the analysis and the kind of
+# pycs written by the analyzer.
+
+import os
+import sys
+import json
+import shutil
+import pickle
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Folders of the webapp which are not analysed
+_IGNORED_FOLDERS = (os.path.join("src", "static"),)
+
+
+def cache_folder(analysis_folder, location):
+    """Returns the cache folder of the webapp deployed at the location"""
+    return os.path.join(analysis_folder, "%s_%s" % (hashlib.sha1(location.encode('UTF-8')).hexdigest()[:16],
+                                                    os.path.basename(location)))
+
+
+def _hash_files(root, files, known_files):
+    """Adds the (mtime, size, sha1) of the files under the root to the files dict. The hash is reused from
+    known_files when the mtime and size of the file are not changed."""
+    if os.path.isfile(root):
+        walk = [(os.path.dirname(root), [], [os.path.basename(root)])]
+    else:
+        walk = os.walk(root)
+    for path, dirs, names in walk:
+        relative_dir = os.path.relpath(path, root)
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__" and
+                         os.path.normpath(os.path.join(relative_dir, d)) not in _IGNORED_FOLDERS)
+        for name in sorted(names):
+            file_path = os.path.join(path, name)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            known = known_files.get(file_path)
+            if known and known[0] == stat.st_mtime_ns and known[1] == stat.st_size:
+                files[file_path] = known
+                continue
+            sha1 = hashlib.sha1()
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(65536), b""):
+                    sha1.update(block)
+            files[file_path] = [stat.st_mtime_ns, stat.st_size, sha1.hexdigest()]
+
+
+def fingerprint(location, virtenv, pypath, known_files=None, unchecked_hash_pycs=False):
+    """Returns (fingerprint, files) of the webapp deployed at the location. files holds the (mtime, size, sha1)
+    of each file covered by the fingerprint, to be passed as known_files next time. The kind of pycs written by
+    the analyzer is a part of the fingerprint, so that the webapp is compiled again when it is changed."""
+    files = {}
+    _hash_files(location, files, known_files or {})
+    _hash_files(os.path.join(pypath, "BlackPearl", "core"), files, known_files or {})
+    _hash_files(os.path.join(pypath, "BlackPearl", "server", "analyzer.py"), files, known_files or {})
+
+    sha1 = hashlib.sha1()
+    sha1.update(sys.version.encode('UTF-8'))
+    sha1.update(os.path.realpath(os.path.join(virtenv, "bin", "python")).encode('UTF-8'))
+    sha1.update(("unchecked-hash" if unchecked_hash_pycs else "timestamp").encode('UTF-8'))
+    for file_path in sorted(files):
+        sha1.update(("%s %s\n" % (file_path, files[file_path][2])).encode('UTF-8'))
+    return sha1.hexdigest(), files
+
+
+def load(folder, webapp_fingerprint, pickle_folder):
+    """Returns the cached WebAppMinimal if the fingerprint matches the cached one, otherwise None.
+    The cached webapp manifest is copied to the pickle folder."""
+    try:
+        with open(os.path.join(folder, "fingerprint.json")) as f:
+            if json.load(f)["fingerprint"] != webapp_fingerprint:
+                return None
+        with open(os.path.join(folder, "minimal.pickle"), "rb") as f:
+            webapp_minimal = pickle.load(f)
+    except (OSError, ValueError, KeyError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+        logger.debug("Analysis cache at <%s> not usable. Reason: %s" % (folder, e))
+        return None
+
+    webapp_minimal.pickle_file = os.path.join(pickle_folder, os.path.basename(webapp_minimal.pickle_file))
+    shutil.copyfile(os.path.join(folder, "webapp.manifest"), webapp_minimal.pickle_file)
+    return webapp_minimal
+
+
+def known_files(folder):
+    """Returns the files of the fingerprint stored in the cache folder"""
+    try:
+        with open(os.path.join(folder, "fingerprint.json")) as f:
+            return json.load(f)["files"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def changed_files(old_files, new_files):
+    """Returns the sorted list of the files added, removed or changed between the two files of the fingerprint"""
+    return sorted(path for path in set(old_files) | set(new_files)
+                  if old_files.get(path, [None] * 3)[2] != new_files.get(path, [None] * 3)[2])
+
+
+def store(folder, webapp_fingerprint, files, webapp_minimal):
+    """Stores the analysis result of the webapp in the cache folder"""
+    if not os.access(folder, os.F_OK):
+        os.makedirs(folder)
+    elif os.access(os.path.join(folder, "fingerprint.json"), os.F_OK):
+        os.remove(os.path.join(folder, "fingerprint.json"))
+    shutil.copyfile(webapp_minimal.pickle_file, os.path.join(folder, "webapp.manifest"))
+    with open(os.path.join(folder, "minimal.pickle"), "wb") as f:
+        pickle.dump(webapp_minimal, f)
+    # Fingerprint is written last, so that a partially written cache is never used
+    with open(os.path.join(folder, "fingerprint.json"), "w") as f:
+        json.dump({"fingerprint": webapp_fingerprint, "files": files}, f)
@@ -17,33 +17,103 @@
 
 import os
 import sys
+import fcntl
 import pickle
+import hashlib
 import traceback
+import py_compile
 import pip
 import logging
 
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 from pip import basecommand
 
+from BlackPearl.common.timeline import Timeline
+
 logger = logging.getLogger()
 
+# Steps of the analyzer, written for the boot timeline of the server
+timeline = Timeline()
+
+
+# Packages required by BlackPearl in the virtualenv of the webapp
+BASE_PACKAGES = ('pip', 'PyYaml', 'pycrypto', 'requests')
+
+
+def _requirements_hash(req_file):
+    sha1 = hashlib.sha1(" ".join(BASE_PACKAGES).encode('UTF-8'))
+    if req_file and os.access(req_file, os.F_OK):
+        with open(req_file, "rb") as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()
 
-def _upgrade_pip():
-    if pip.main(['install', "--upgrade", "pip"]) == 1:
-        logger.error("Failed to upgrade pip in the virtualenv.")
-        sys.exit(1)
 
+@contextmanager
+def _wheelhouse_lock(wheelhouse, operation):
+    """Locks the wheelhouse shared by the analyzers of all the webapps. Wheels are installed holding the shared
+    lock and built holding the exclusive lock, so that an analyzer never picks up a half written wheel."""
+    with open(os.path.join(wheelhouse, ".lock"), "a") as lock_file:
+        fcntl.flock(lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
 
-def _install():
-    for package in ('PyYaml', 'pycrypto', 'requests'):
-        if pip.main(['install', package]) == 1:
-            logger.error("Failed to install package<%s> in the new virtualenv." % package)
+
+def _pip_install(wheelhouse, args, step):
+    """Installs the packages from the wheels in the wheelhouse, without going to the network. Wheels which are
+    not in the wheelhouse yet are built (downloading the packages) into the wheelhouse first."""
+    install = ['install', '--upgrade', '--no-index', '--find-links', wheelhouse] + args
+    with timeline.span("%s/pip install" % step), _wheelhouse_lock(wheelhouse, fcntl.LOCK_SH):
+        if pip.main(install) == 0:
+            return True
+
+    logger.info("Packages not found in the wheel cache <%s>. Building the wheels .." % wheelhouse)
+    with timeline.span("%s/pip wheel" % step), _wheelhouse_lock(wheelhouse, fcntl.LOCK_EX):
+        if pip.main(['wheel', '--wheel-dir', wheelhouse, '--find-links', wheelhouse] + args) != 0:
+            return False
+    with timeline.span("%s/pip install (built wheels)" % step), _wheelhouse_lock(wheelhouse, fcntl.LOCK_SH):
+        return pip.main(install) == 0
+
+
+def install_requirements(wheelhouse, req_file, name):
+    """Installs the packages required by BlackPearl and the packages in the requirements file (if given).
+    Nothing is installed if the requirements are not changed since the last install in the virtualenv."""
+    # Marker is kept per webapp (name), as the webapps of a shared pool use the same virtualenv
+    marker = os.path.join(sys.prefix, ".blackpearl_requirements_%s" % name)
+    req_hash = _requirements_hash(req_file)
+    try:
+        with open(marker) as f:
+            if f.read() == req_hash:
+                logger.info("Requirements are not changed since the last install. Skipping the install.")
+                return
+    except OSError:
+        pass
+
+    logger.info("Going to install basic required packages by blackpearl.")
+    if not _pip_install(wheelhouse, list(BASE_PACKAGES), "requirements/base packages"):
+        logger.error("Failed to install the packages <%s> in the virtualenv." % ", ".join(BASE_PACKAGES))
+        sys.exit(1)
+
+    if req_file and os.access(req_file, os.F_OK):
+        logger.info("Requirements file found at <%s>" % req_file)
+        if not _pip_install(wheelhouse, ['-r', req_file], "requirements/webapp packages"):
+            logger.error("Failed to install the libraries required by the webapp <%s>." % name)
             sys.exit(1)
+    elif req_file:
+        logger.info("Requirements file not found.")
+
+    with open(marker, "w") as f:
+        f.write(req_hash)
+    logger.info("Packages installed successfully.")
 
 
 # Analyses the single webapp folder
 def analyser(webapps_pickle_minimal, pickle_folder, location, folder):
     from BlackPearl.core.webapps import WebAppMinimal
     from BlackPearl.core import webapps as webapps
+    from BlackPearl.core import manifest
 
     if not os.access(webapps_pickle_minimal, os.F_OK):
         webapps_minimal = []
@@ -58,53 +128,122 @@ def analyser(webapps_pickle_minimal, pickle_folder, location, folder):
         logger.info("Webapp analysing completed.")
         logger.info("Webapp details : %s" % webapp)
 
-        # Pickling the webapp information
-        f = os.path.join(pickle_folder, webapp.id + ".pickle")
+        # Writing the manifest of the webapp, loaded by the uwsgi workers
+        f = os.path.join(pickle_folder, webapp.id + ".manifest")
         logger.info("Writing analysed information to file <%s>." % f)
-        with open(f, "wb") as pickle_file:
-            pickle.dump(webapp, pickle_file)
+        manifest.write(webapp, f)
         logger.info("Write completed")
 
         webapp_minimal = WebAppMinimal(webapp, f)
         webapp_minimal.python_home_path = sys.exec_prefix
         webapp_minimal.python_path = sys.executable
-        webapps_minimal.append(webapp_minimal)
+        # Analysis result of the webapp is replaced in place, when it is analysed again after a code change
+        webapps.replace_minimal(webapps_minimal, webapp_minimal)
 
         with open(webapps_pickle_minimal, "wb") as f:
             pickle.dump(webapps_minimal, f)
     except:
         logger.error("Fatal error during analysing webapps.")
         logger.error("%s" % traceback.format_exc())
+        # Server uses the exit code to know whether the analysis result is written
+        sys.exit(1)
 
 
-def main():
-    webapps_pickle_minimal = sys.argv[1]
-    pickle_folder = sys.argv[2]
-    webapps_location = sys.argv[3]
-    webapp_folder = sys.argv[4]
+def _source_files(location, folder):
+    """Returns the python source files in the folders of the webapp added to the python path"""
+    sources = []
+    for source_folder in (os.path.join("src", "api"), "lib", "test"):
+        for path, dirs, names in os.walk(os.path.join(location, folder, source_folder)):
+            dirs[:] = [d for d in dirs if d != "__pycache__"]
+            sources.extend(os.path.join(path, name) for name in names if name.endswith(".py"))
+    return sources
 
-    log_level = int(sys.argv[5])
-    log_format = sys.argv[6]
 
+def _compile(source, unchecked_hash):
+    """Byte-compiles the source file. Returns the error message, or None if the file is compiled."""
+    try:
+        if unchecked_hash:
+            py_compile.compile(source, doraise=True,
+                               invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+        else:
+            py_compile.compile(source, doraise=True)
+    except (py_compile.PyCompileError, OSError) as e:
+        return str(e)
+    return None
+
+
+def compile_sources(location, folder, workers, unchecked_hash):
+    """Byte-compiles the sources of the webapp in parallel, so that the uwsgi workers start from the compiled
+    code instead of compiling (and writing __pycache__) from each worker. With unchecked_hash, the pycs are not
+    checked against the source files when imported, which saves the stat of each source file. They are written
+    again when the webapp is analysed after a code change."""
+    if unchecked_hash and not hasattr(py_compile, "PycInvalidationMode"):
+        logger.warn("Unchecked hash based pycs require python 3.7 or later. Writing the timestamp based pycs.")
+        unchecked_hash = False
+
+    sources = _source_files(location, folder)
+    if not sources:
+        return
+    logger.info("Byte-compiling <%s> source files of the webapp .." % len(sources))
+    with ProcessPoolExecutor(max_workers=workers or None) as executor:
+        errors = list(executor.map(_compile, sources, [unchecked_hash] * len(sources)))
+    for error in errors:
+        if error:
+            # Workers compile the file themselves when importing it
+            logger.warn("Failed to byte-compile. Reason: %s" % error)
+
+
+def _init_logging(log_level, log_format):
     logger.setLevel(log_level)
     ch = logging.StreamHandler()
     ch.setLevel(log_level)
     ch.setFormatter(logging.Formatter(log_format))
     logger.addHandler(ch)
 
-    logger.info("Going to install basic required packages by blackpearl.")
-
     # pip is removing our log handler and initializing their own handlers.
     # I am just stopping their logger initialization using below code. It is the worst way to do it but it works.
     # TODO: Need to find a cleaner way
     basecommand.logging_dictConfig = lambda *args, **kwargs: None
-    _upgrade_pip()
-    _install()
 
-    logger.info("Packages installed successfully.")
 
-    analyser(webapps_pickle_minimal, pickle_folder, webapps_location, webapp_folder)
+def main():
+    if sys.argv[1] == "--base":
+        # Installing the packages required by BlackPearl in the base virtualenv, which is cloned for the webapps
+        wheelhouse = sys.argv[2]
+        _init_logging(int(sys.argv[3]), sys.argv[4])
+        try:
+            with timeline.span("requirements"):
+                install_requirements(wheelhouse, None, "__base__")
+        finally:
+            timeline.write(sys.argv[5])
+        return
+
+    webapps_pickle_minimal = sys.argv[1]
+    pickle_folder = sys.argv[2]
+    webapps_location = sys.argv[3]
+    webapp_folder = sys.argv[4]
+
+    log_level = int(sys.argv[5])
+    log_format = sys.argv[6]
+    wheelhouse = sys.argv[7]
+    compile_workers = int(sys.argv[8])
+    unchecked_hash = sys.argv[9] == "unchecked-hash"
+
+    _init_logging(log_level, log_format)
+    try:
+        with timeline.span("requirements"):
+            install_requirements(wheelhouse, os.path.join(webapps_location, webapp_folder, "requirements.txt"),
+                                 webapp_folder)
+
+        with timeline.span("analyse"):
+            analyser(webapps_pickle_minimal, pickle_folder, webapps_location, webapp_folder)
+
+        with timeline.span("compile"):
+            compile_sources(webapps_location, webapp_folder, compile_workers, unchecked_hash)
+    finally:
+        # Written even if the analysis failed, as the time spent is still a part of the boot
+        timeline.write(webapps_pickle_minimal + ".timeline")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
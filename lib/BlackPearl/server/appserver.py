@@ -17,6 +17,7 @@
 
 import traceback
 import sys
+import json
 import signal
 import asyncio
 import multiprocessing
@@ -24,6 +25,9 @@ import pickle
 import virtualenv
 import shutil
 import os
+import time
+import socket
+import binascii
 import functools
 import pyinotify
 import logging
@@ -33,23 +37,68 @@ from datetime import datetime
 from enum import Enum
 
 from BlackPearl.server.core import process
+from BlackPearl.server.core import uwsgictl
 from BlackPearl.server.core.process import Process, ProcessGroup, AsyncTask, ProcessStatus
 from BlackPearl.server import prechecks
+from BlackPearl.server import analysiscache
+from BlackPearl.server import virtenvs
+from BlackPearl.server.changedetector import ChangeDetector
 from BlackPearl.common import fileutils
+from BlackPearl.common import meminfo
+from BlackPearl.common.timeline import Timeline
 from BlackPearl.core import webapps as webapps
+from BlackPearl.core.jobs import JobQueue
 
 
 logger = logging.getLogger(__name__)
 ch = logging.NullHandler()
 logger.addHandler(ch)
 
+# Seconds between the checks for idle webapps
+IDLE_CHECK_INTERVAL = 5
+
+# Seconds between the checks for workers to be recycled
+RECYCLE_CHECK_INTERVAL = 10
+
+# Blue-green deployment: seconds to wait for the candidate to load the webapp, for its testsets to complete
+# and for the old instance to serve its in-flight requests
+CANDIDATE_READY_TIMEOUT = 120
+CANDIDATE_TEST_TIMEOUT = 300
+DRAIN_TIMEOUT = 30
+# Seconds given to the old nginx workers to finish with the previous conf after nginx is reloaded
+NGINX_RELOAD_GRACE = 2
+
 
 @asyncio.coroutine
-def analyse_and_pickle_webapps(config, pypath, virtenv_folder, pickle_folder, *app_dirs):
+def _timed(timeline, name, coroutine):
+    """Runs the coroutine, recording it as the span in the timeline"""
+    with timeline.span(name):
+        return (yield from coroutine)
+
+
+@asyncio.coroutine
+def analyse_and_pickle_webapps(config, pypath, virtenv_folder, pickle_folder, *app_dirs, webapp_folders=None,
+                               timeline=None):
+    """Analyses the webapps deployed in the app_dirs and returns the list of WebAppMinimal.
+
+    If webapp_folders (list of (app dir, webapp folder)) is given, only those webapps are analysed again. The
+    analysis results of the other webapps are taken from the previous analysis.
+
+    Webapps are analysed concurrently (up to analysis.parallelism analyzer processes). Each analyzer writes its
+    result to its own file and the results are merged into webapps.pickle.minimal in the order of the webapps.
+    The steps of the analysis are recorded in the timeline (if given) under the analysis span."""
+    if timeline is None:
+        timeline = Timeline()
     # Will be used to hold the list of webapp analysis result
     logger.info("Analysing deployed webapps ....")
 
     webapps_minimal_file = os.path.join(pickle_folder, "webapps.pickle.minimal")
+    parallelism = config['analysis']['parallelism'] or multiprocessing.cpu_count()
+    semaphore = asyncio.Semaphore(parallelism)
+    # Webapps of a shared pool use the same virtualenv. So, they are not analysed at the same time.
+    virtenv_locks = {}
+    jobs = []
+    tasks = []
     # Looping over the webapp deployment folders
     for app_dir in app_dirs:
         logger.info("Initializing webapps located at <%s>" % app_dir)
@@ -58,42 +107,30 @@ def analyse_and_pickle_webapps(config, pypath, virtenv_folder, pickle_folder, *a
         # Looping over the webapp folders deployed in a deployment folder
         for webapp_folder in webapps.get_webapp_folders(app_dir):
             count += 1
+            if webapp_folders is not None and (app_dir, webapp_folder) not in webapp_folders:
+                continue
             webapp_virtenv = os.path.join(virtenv_folder, webapp_folder + "_path_" + str(count))
-            if not os.access(webapp_virtenv, os.F_OK):
-                logger.info("Creating the virtual environment at <%s>. This till take some time." % webapp_virtenv)
-                virtualenv.create_environment(webapp_virtenv)
-                logger.info("The virtual environment completed successfully.")
-            else:
-                logger.info("Using the virtual environment at <%s>" % webapp_virtenv)
-            # Running the analysing working in a separate process to avoid webapp modules getting imported to main
-            # process
-
-            command = [os.path.join(webapp_virtenv, "bin/python"),
-                       os.path.join(os.path.dirname(__file__), 'analyzer.py'), webapps_minimal_file,
-                       pickle_folder, app_dir, webapp_folder, str(config['logging']['level']),
-                       config['logging']['format']]
-            with open(os.path.join(config['path']['log'], "blackpearl", "%s_analysis.out" % webapp_folder), "w") as out:
-                p = Process("Process: Webapp <%s> initializer" % app_dir, command, env={
-                    "PYTHONPATH": ":".join(
-                        [pypath,
-                         os.path.join(app_dir, webapp_folder, "src", "api"),
-                         os.path.join(app_dir, webapp_folder, "lib"),
-                         os.path.join(app_dir, webapp_folder, 'test')]
-                    )
-                }, stdout=out, stderr=out)
-                yield from p.start()
-                yield from p.wait_for_completion()
-
-            with open(os.path.join(config['path']['log'], "blackpearl", "%s_analysis.out" % webapp_folder),
-                      encoding="UTF-8") as r:
-                if p.status == process.Status.STOPPED:
-                    logger.info("Webapp<%s> analyse completed successfully." % app_dir)
-                    logger.info("Analyse result: %s", r.read())
-                else:
-                    logger.error(" Webapp<%s> analyse failed." % app_dir)
-                    logger.error("Analyse result: %s", r.read())
-
-        logger.info("Webapps deployed at <%s> initialized" % app_dir)
+            # Webapps of a shared pool are loaded in the same interpreter. So, they share the virtualenv.
+            pool = webapps.get_pool(app_dir, webapp_folder)
+            if pool:
+                webapp_virtenv = os.path.join(virtenv_folder, "pool_" + pool)
+            jobs.append((app_dir, webapp_folder, webapp_virtenv))
+
+    # New virtualenvs are cloned from the base virtualenv
+    base_virtenv = None
+    if [job for job in jobs if not os.access(job[2], os.F_OK)]:
+        base_virtenv = yield from _timed(timeline, "analysis/base virtualenv",
+                                         _prepare_base_virtenv(config, pypath, virtenv_folder, timeline))
+
+    for app_dir, webapp_folder, webapp_virtenv in jobs:
+        virtenv_lock = virtenv_locks.setdefault(webapp_virtenv, asyncio.Lock())
+        tasks.append(asyncio.async(_timed(timeline, "analysis/%s" % webapp_folder, _analyse_webapp(
+            config, pypath, webapp_virtenv, base_virtenv, pickle_folder, app_dir, webapp_folder, semaphore,
+            virtenv_lock, timeline))))
+
+    logger.info("Analysing <%s> webapps with <%s> analyzers in parallel" % (len(tasks), parallelism))
+    if tasks:
+        yield from asyncio.wait(tasks)
 
     if os.access(webapps_minimal_file, os.F_OK):
         with open(webapps_minimal_file, "rb") as rb:
@@ -101,6 +138,28 @@ def analyse_and_pickle_webapps(config, pypath, virtenv_folder, pickle_folder, *a
     else:
         analyse_result_list = []
 
+    failed = []
+    for (app_dir, webapp_folder, webapp_virtenv), task in zip(jobs, tasks):
+        webapp_minimal = task.result()
+        if webapp_minimal:
+            webapps.replace_minimal(analyse_result_list, webapp_minimal)
+        else:
+            failed.append(os.path.join(app_dir, webapp_folder))
+
+    # Webapp disabled or failing its analysis is not served with its previous analysis result, as its handlers
+    # would be imported from the new sources. Its instances are stopped along with the removed webapps.
+    if failed:
+        logger.info("Webapps disabled or failed the analysis : %s" % failed)
+
+    # Webapps removed since the previous analysis
+    removed = [ret for ret in analyse_result_list if not os.path.isdir(ret.location) or ret.location in failed]
+    if removed:
+        logger.info("Webapps removed : %s" % removed)
+        analyse_result_list = [ret for ret in analyse_result_list if ret not in removed]
+
+    with open(webapps_minimal_file, "wb") as wb:
+        pickle.dump(analyse_result_list, wb)
+
     logger.info("List of initialized webapps : %s" % analyse_result_list)
 
     # Writing webapp list to file
@@ -115,6 +174,241 @@ def analyse_and_pickle_webapps(config, pypath, virtenv_folder, pickle_folder, *a
     return analyse_result_list
 
 
+@asyncio.coroutine
+def _prepare_base_virtenv(config, pypath, virtenv_folder, timeline):
+    """Creates the base virtualenv, having the packages required by BlackPearl, if it is not yet created.
+    Returns the path of the base virtualenv or None if it could not be created."""
+    base = virtenvs.base_path(virtenv_folder)
+    if virtenvs.is_ready(base):
+        return base
+    if os.access(base, os.F_OK):
+        # Partially created or created by a different python
+        shutil.rmtree(base)
+
+    logger.info("Creating the base virtual environment at <%s>. This till take some time." % base)
+    with timeline.span("analysis/base virtualenv/create"):
+        yield from asyncio.get_event_loop().run_in_executor(None, virtualenv.create_environment, base)
+    timeline_file = os.path.join(config['path']['run'], "base_virtenv.timeline")
+    command = [os.path.join(base, "bin/python"), os.path.join(os.path.dirname(__file__), 'analyzer.py'), "--base",
+               os.path.join(config['path']['cache'], "wheels"), str(config['logging']['level']),
+               config['logging']['format'], timeline_file]
+    out_file = os.path.join(config['path']['log'], "blackpearl", "base_virtenv.out")
+    with open(out_file, "w") as out, timeline.span("analysis/base virtualenv/analyzer"):
+        p = Process("Process: Base virtualenv initializer", command, env={"PYTHONPATH": pypath},
+                    stdout=out, stderr=out)
+        yield from p.start()
+        yield from p.wait_for_completion()
+    timeline.merge(timeline_file, "analysis/base virtualenv/analyzer")
+    if os.access(timeline_file, os.F_OK):
+        os.remove(timeline_file)
+
+    if p.status != process.Status.STOPPED:
+        with open(out_file, encoding="UTF-8") as r:
+            logger.error(" Failed to install the packages in the base virtual environment. Creating the virtual "
+                         "environments of the webapps from scratch.")
+            logger.error("Result: %s", r.read())
+        return None
+    virtenvs.mark_ready(base)
+    logger.info("The base virtual environment completed successfully.")
+    return base
+
+
+@asyncio.coroutine
+def _analyse_webapp(config, pypath, webapp_virtenv, base_virtenv, pickle_folder, app_dir, webapp_folder, semaphore,
+                    virtenv_lock, timeline):
+    """Analyses the webapp in an analyzer process running in the virtualenv of the webapp.
+    Returns the WebAppMinimal of the webapp or None if the analysis failed."""
+    # Analysis result of the previous run is used if the webapp is not changed since then
+    location = os.path.join(app_dir, webapp_folder)
+    span = "analysis/%s" % webapp_folder
+    webapp_cache = analysiscache.cache_folder(os.path.join(config['path']['cache'], "analysis"), location)
+    with timeline.span(span + "/fingerprint"):
+        webapp_fingerprint, fingerprint_files = analysiscache.fingerprint(
+            location, webapp_virtenv, pypath, analysiscache.known_files(webapp_cache),
+            config['analysis']['unchecked_hash_pycs'])
+    if os.access(webapp_virtenv, os.F_OK):
+        webapp_minimal = analysiscache.load(webapp_cache, webapp_fingerprint, pickle_folder)
+        if webapp_minimal:
+            logger.info("Webapp <%s> is not changed since its last analysis. Using the cached analysis "
+                        "result." % location)
+            return webapp_minimal
+
+    queued = time.time()
+    yield from semaphore.acquire()
+    yield from virtenv_lock.acquire()
+    timeline.add(span + "/queue", queued, time.time())
+    try:
+        virtenv_started = time.time()
+        if not os.access(webapp_virtenv, os.F_OK) and base_virtenv:
+            logger.info("Cloning the virtual environment at <%s> from <%s>." % (webapp_virtenv, base_virtenv))
+            start = time.time()
+            yield from asyncio.get_event_loop().run_in_executor(None, virtenvs.clone, base_virtenv, webapp_virtenv)
+            logger.info("The virtual environment cloned in <%.2f> seconds." % (time.time() - start))
+        elif not os.access(webapp_virtenv, os.F_OK):
+            logger.info("Creating the virtual environment at <%s>. This till take some time." % webapp_virtenv)
+            yield from asyncio.get_event_loop().run_in_executor(None, virtualenv.create_environment,
+                                                                webapp_virtenv)
+            logger.info("The virtual environment completed successfully.")
+        else:
+            logger.info("Using the virtual environment at <%s>" % webapp_virtenv)
+        timeline.add(span + "/virtualenv", virtenv_started, time.time())
+
+        # Result of the analyzer is written to its own file and merged by the server
+        result_file = os.path.join(pickle_folder, os.path.basename(webapp_cache) + ".minimal")
+        if os.access(result_file, os.F_OK):
+            os.remove(result_file)
+
+        # Running the analysing working in a separate process to avoid webapp modules getting imported to main
+        # process
+        command = [os.path.join(webapp_virtenv, "bin/python"),
+                   os.path.join(os.path.dirname(__file__), 'analyzer.py'), result_file,
+                   pickle_folder, app_dir, webapp_folder, str(config['logging']['level']),
+                   config['logging']['format'], os.path.join(config['path']['cache'], "wheels"),
+                   str(config['analysis']['compile_workers']),
+                   "unchecked-hash" if config['analysis']['unchecked_hash_pycs'] else "timestamp"]
+        out_file = os.path.join(config['path']['log'], "blackpearl", "%s_analysis.out" % webapp_folder)
+        with open(out_file, "w") as out, timeline.span(span + "/analyzer"):
+            p = Process("Process: Webapp <%s> initializer" % location, command, env={
+                "PYTHONPATH": ":".join(
+                    [pypath,
+                     os.path.join(app_dir, webapp_folder, "src", "api"),
+                     os.path.join(app_dir, webapp_folder, "lib"),
+                     os.path.join(app_dir, webapp_folder, 'test')]
+                )
+            }, stdout=out, stderr=out)
+            yield from p.start()
+            yield from p.wait_for_completion()
+    finally:
+        virtenv_lock.release()
+        semaphore.release()
+
+    # Steps of the analyzer (requirements install and the analysis) are shown under its span
+    timeline.merge(result_file + ".timeline", span + "/analyzer")
+    if os.access(result_file + ".timeline", os.F_OK):
+        os.remove(result_file + ".timeline")
+
+    with open(out_file, encoding="UTF-8") as r:
+        if p.status != process.Status.STOPPED:
+            logger.error(" Webapp<%s> analyse failed." % location)
+            logger.error("Analyse result: %s", r.read())
+            return None
+        logger.info("Webapp<%s> analyse completed successfully." % location)
+        logger.info("Analyse result: %s", r.read())
+
+    with open(result_file, "rb") as rb:
+        webapp_minimal = pickle.load(rb)[0]
+    os.remove(result_file)
+
+    try:
+        analysiscache.store(webapp_cache, webapp_fingerprint, fingerprint_files, webapp_minimal)
+    except OSError as e:
+        logger.warn("Failed to cache the analysis result of webapp <%s>. Reason: %s" % (location, e))
+    return webapp_minimal
+
+
+def socket_path(run_loc, instance_id):
+    return run_loc + "/uwsgi/%s.socket" % instance_id
+
+
+def take_snapshot(webapp, snapshot_folder):
+    """Copies the python sources (with their compiled files) and the manifest of the webapp to the snapshot
+    folder. Returns the snapshot environment (PYTHONPATH folders and the manifest file) for the instance."""
+    folders = []
+    for folder in (os.path.join("src", "api"), "lib", "test"):
+        source = os.path.join(webapp.location, folder)
+        target = os.path.join(snapshot_folder, folder)
+        if os.path.isdir(source):
+            shutil.copytree(source, target, symlinks=True)
+        folders.append(target)
+    pickle_file = os.path.join(snapshot_folder, os.path.basename(webapp.pickle_file))
+    shutil.copyfile(webapp.pickle_file, pickle_file)
+    return {"folders": folders, "pickle_file": pickle_file}
+
+
+def hot_reload_path(run_loc, instance_id):
+    """Returns the file to which the changed files are written for the workers of the instance to reload them"""
+    return run_loc + "/uwsgi/%s.hotreload" % instance_id
+
+
+def startup_profile_path(run_loc, instance_id):
+    """Returns the path prefix of the startup profiles of the instance. Each worker of the instance writes its
+    profile to <prefix>.<worker id>.json"""
+    return run_loc + "/uwsgi/startup/%s" % instance_id
+
+
+def assign_sockets(webapps_list, run_loc):
+    """Assigns the uwsgi socket for each instance of the webapps"""
+    assign_pools(webapps_list)
+    for webapp in webapps_list:
+        webapp.sockets = {instance_id: socket_path(run_loc, instance_id)
+                          for instance_id, priority in webapp.instances()}
+        if webapp.pool_instance:
+            webapp.sockets[webapp.id] = socket_path(run_loc, webapp.pool_instance)
+        webapp.socket = webapp.sockets[webapp.id]
+
+
+def _top_level_modules(webapp):
+    """Returns the names of the modules and packages which the webapp adds to the python path"""
+    names = set()
+    for folder in (os.path.join(webapp.location, "src", "api"), os.path.join(webapp.location, "lib"),
+                   os.path.join(webapp.location, "test")):
+        if os.access(folder, os.F_OK):
+            names.update(name[:-3] if name.endswith(".py") else name for name in os.listdir(folder)
+                         if name.endswith(".py") or os.path.isdir(os.path.join(folder, name)))
+    names.discard("__pycache__")
+    return names
+
+
+def assign_pools(webapps_list):
+    """Assigns the uwsgi instance of the shared pool to the webapps configured with the same pool.
+
+    The webapps of a pool are loaded in the same interpreter. So, a webapp is served in its own processes
+    if it uses a different python environment or if its modules clash with the other webapps of the pool."""
+    pools = {}
+    for webapp in sorted(webapps_list, key=lambda w: w.url_prefix):
+        webapp.pool_instance = None
+        if not webapp.pool:
+            continue
+        members = pools.setdefault(webapp.pool, [])
+        modules = _top_level_modules(webapp)
+        if members and members[0][0].python_home_path != webapp.python_home_path:
+            logger.warn("Webapp <%s> uses python at <%s> but the pool <%s> uses <%s>. Serving the webapp in its "
+                        "own processes .." % (webapp.name, webapp.python_home_path, webapp.pool,
+                                              members[0][0].python_home_path))
+            continue
+        clashes = set()
+        for member, member_modules in members:
+            clashes.update(modules & member_modules)
+        if clashes:
+            logger.warn("Modules <%s> of webapp <%s> clash with the other webapps of the pool <%s>. Serving the "
+                        "webapp in its own processes .." % (", ".join(sorted(clashes)), webapp.name, webapp.pool))
+            continue
+        members.append((webapp, modules))
+
+    for pool, members in pools.items():
+        # Pool of a single webapp has nothing to share
+        if len(members) > 1:
+            for webapp, modules in members:
+                webapp.pool_instance = "__pool__" + pool
+
+
+def uwsgi_instances(webapps_list):
+    """Returns the list of (instance id, webapps served, priority class) of the uwsgi instances serving the
+    webapps. The default priority class of the webapps in a shared pool is served by a single instance."""
+    instances = []
+    pools = {}
+    for webapp in sorted(webapps_list, key=lambda w: w.url_prefix):
+        for instance_id, priority in webapp.instances():
+            if instance_id == webapp.id and webapp.pool_instance:
+                if webapp.pool_instance not in pools:
+                    pools[webapp.pool_instance] = []
+                    instances.append((webapp.pool_instance, pools[webapp.pool_instance], priority))
+                pools[webapp.pool_instance].append(webapp)
+            else:
+                instances.append((instance_id, [webapp], priority))
+    return instances
+
+
 def precheck():
     """Function used to perform precheck before starting the application"""
     try:
@@ -127,14 +421,52 @@ def precheck():
         return False
 
 
+def webapp_environment(webapp, run_loc, security_key, security_block_size, nginx_bind, pypath,
+                       job_queue, job_result_ttl):
+    """Returns the environment variables required by BlackPearl.application to initialize the webapp"""
+    return {
+        "BLACKPEARL_DEPLOYED_APPS_PICKLE": "%s/uwsgi/pickle/deployed_apps.pickle" % run_loc,
+        "BLACKPEARL_PICKLE_FILE": webapp.pickle_file,
+        "BLACKPEARL_ENCRYPT_KEY": security_key,
+        "BLACKPEARL_ENCRYPT_BLOCK_SIZE": str(security_block_size),
+        "BLACKPEARL_LISTEN": str(nginx_bind),
+        "BLACKPEARL_JOB_QUEUE": job_queue,
+        "BLACKPEARL_JOB_RESULT_TTL": str(job_result_ttl),
+        "BLACKPEARL_RATELIMIT_FILE": "%s/uwsgi/%s.ratelimit" % (run_loc, webapp.id),
+        "PYTHONPATH": ":".join(
+            [pypath,
+             os.path.join(webapp.location, "src", "api"),
+             os.path.join(webapp.location, "lib"),
+             os.path.join(webapp.location, 'test')]
+        )
+    }
+
+
+def pool_environment(instance_id, members, run_loc, security_key, security_block_size, nginx_bind, pypath,
+                     job_queue, job_result_ttl):
+    """Returns the environment variables required by BlackPearl.application to initialize the webapps
+    of the shared pool"""
+    env = webapp_environment(members[0], run_loc, security_key, security_block_size, nginx_bind, pypath,
+                             job_queue, job_result_ttl)
+    env["BLACKPEARL_PICKLE_FILE"] = os.pathsep.join(webapp.pickle_file for webapp in members)
+    env["BLACKPEARL_RATELIMIT_FILE"] = "%s/uwsgi/%s.ratelimit" % (run_loc, instance_id)
+    env["PYTHONPATH"] = ":".join(
+        [pypath] + [os.path.join(webapp.location, folder) for webapp in members
+                    for folder in (os.path.join("src", "api"), "lib", "test")]
+    )
+    return env
+
+
 class Uwsgi(ProcessGroup):
     # List of options which can not be overriding from configuration file.
     __immutable_options__ = [
-        'socket', 'wsgi-file', 'log-to', 'pidfile', 'touch-workers-reload', 'lazy-apps'
+        'socket', 'wsgi-file', 'log-to', 'pidfile', 'touch-workers-reload', 'touch-chain-reload', 'touch-reload',
+        'lazy-apps', 'stats', 'master-fifo'
     ]
 
     def __init__(self, uwsgi_loc, uwsgi_file, webapps_list, logs_dir, run_loc,
-                 security_key, security_block_size, nginx_bind, pypath, uwsgi_options, max_log_size, max_log_files):
+                 security_key, security_block_size, nginx_bind, pypath, uwsgi_options, max_log_size, max_log_files,
+                 job_queue, job_result_ttl, production=False, startup_profile=None, hot_reload=False):
 
         super().__init__(name="uWsgi Service")
         self.run_loc = run_loc
@@ -147,57 +479,261 @@ class Uwsgi(ProcessGroup):
         self.nginx_bind = nginx_bind
         self.pypath = pypath
         self.uwsgi_options = uwsgi_options
+        self.job_queue = job_queue
+        self.job_result_ttl = job_result_ttl
+        self.production = production
+        self.startup_profile = startup_profile
+        self.hot_reload = hot_reload
+
+        # Number of consecutive autoscale checks in which the instance was found underused
+        self._underused_checks = {}
+
+        # Listening sockets held by the server for the instances of the webapps having idle_timeout,
+        # so that the connections are queued while the instance is suspended.
+        self._held_sockets = {}
+        # instance id -> (requests served, time at which the requests served is last changed)
+        self._last_activity = {}
+        self._suspended = {}
+        # instance id -> pid of the worker being recycled
+        self._recycling = {}
+        # instance id -> conf file of the blue-green candidate (running or promoted as the instance)
+        self._candidate_confs = {}
+        self._promoted_confs = {}
+        # instance id -> (conf, environment) with which the running instance was started
+        self._running_settings = {}
+        # instance id (or candidate id) -> snapshot folder of the sources the blue-green instance was started with
+        self._snapshots = {}
 
         self._add_apps(webapps_list)
         self.webapps_list = webapps_list
+        # instance id -> ids of the webapps served by the instance
+        self._deployed_instances = {instance_id: [w.id for w in members]
+                                    for instance_id, members, priority in uwsgi_instances(webapps_list)}
 
         self.max_log_size = max_log_size
         self.max_log_files = max_log_files
 
     @asyncio.coroutine
-    def add_apps(self, webapps_list):
-        deployed_apps_id = [w.id for w in self.webapps_list]
-        new_apps_id = [w.id for w in webapps_list]
-        logger.debug("Already deployed apps :", deployed_apps_id)
-        logger.debug("Apps recently analyzed :", new_apps_id)
-        apps_to_start = [webapp for webapp in webapps_list if webapp.id not in deployed_apps_id]
-        apps_to_stop = [webapp for webapp in self.webapps_list if webapp.id not in new_apps_id]
-        for webapp in apps_to_stop:
-            logger.debug("Stopping uWsgi Service for <", webapp.name, "(", webapp.url_prefix,
-                         ") > webapp as it is removed or it has error after recent code change")
-            yield from self.remove_process("'%s' uWsgi Service" % webapp.id)
+    def add_apps(self, webapps_list, modified_webapps=(), restart_instances=()):
+        """Starts the instances of the new webapps and stops the instances of the removed ones. The conf files of
+        the instances of the modified webapps are written again. Instances in restart_instances (returned by
+        changed_instances) are restarted."""
+        # Instance of a shared pool is restarted when the webapps in the pool are changed
+        deployed_instances = self._deployed_instances
+        new_instances = {instance_id: [w.id for w in members]
+                         for instance_id, members, priority in uwsgi_instances(webapps_list)}
+        logger.debug("Already deployed instances :", deployed_instances)
+        logger.debug("Instances of apps recently analyzed :", new_instances)
+        for instance_id in deployed_instances:
+            if new_instances.get(instance_id) != deployed_instances[instance_id] or instance_id in restart_instances:
+                logger.debug("Stopping uWsgi Service <", instance_id, "> as its webapp or priority class is "
+                             "removed or it has error after recent code change")
+                if instance_id in self._suspended:
+                    del self._suspended[instance_id]
+                    asyncio.get_event_loop().remove_reader(self._held_sockets[instance_id].fileno())
+                else:
+                    yield from self.remove_process("'%s' uWsgi Service" % instance_id)
+                self._release_socket(instance_id)
+                self._recycling.pop(instance_id, None)
+                self._running_settings.pop(instance_id, None)
+                self._remove_snapshot(instance_id)
+                if instance_id in self._promoted_confs:
+                    os.remove(self._promoted_confs.pop(instance_id))
 
         self.webapps_list = webapps_list
-        if len(apps_to_start) > 0:
-            self.generate_conf_file()
-            self._add_apps(apps_to_start)
+        self._deployed_instances = new_instances
+        instances_to_start = [instance_id for instance_id in new_instances
+                              if deployed_instances.get(instance_id) != new_instances[instance_id] or
+                              instance_id in restart_instances]
+        # Running (or suspended) instances of the modified webapps read their conf again when they are reloaded
+        # or resumed
+        modified = set(w.id for w in modified_webapps)
+        modified_instances = []
+        for instance_id, members, priority in uwsgi_instances(webapps_list):
+            if modified.intersection(w.id for w in members):
+                modified_instances.append(instance_id)
+                if instance_id in self._suspended:
+                    self._suspended[instance_id] = members
+        if len(instances_to_start) > 0 or len(modified_instances) > 0:
+            self.generate_conf_file(instances_to_start + modified_instances)
+        if len(instances_to_start) > 0:
+            self._add_apps(webapps_list, instances_to_start)
+
+    def changed_instances(self, webapps_list, modified_webapps):
+        """Returns the ids of the running instances of the modified webapps whose conf or environment is changed
+        by the new settings of the webapps (e.g. performance, autoscale or preload). uwsgi reads them only when
+        the instance is started, not when its workers are reloaded. So, those instances are to be restarted."""
+        opt = {key: value for key, value in self.uwsgi_options.items() if key not in Uwsgi.__immutable_options__}
+        modified = set(w.id for w in modified_webapps)
+        changed = []
+        for instance_id, members, priority in uwsgi_instances(webapps_list):
+            if not modified.intersection(w.id for w in members) or instance_id not in self._running_settings or \
+                    self._deployed_instances.get(instance_id) != [w.id for w in members]:
+                continue
+            settings = (self._conf_text(self._instance_config(instance_id, members, priority, opt)),
+                        self._instance_environment(members, instance_id))
+            if settings != self._running_settings[instance_id]:
+                changed.append(instance_id)
+        return changed
+
+    def _add_apps(self, apps_to_start, instances_to_start=None):
+        for instance_id, members, priority in uwsgi_instances(apps_to_start):
+            if instances_to_start is not None and instance_id not in instances_to_start:
+                continue
+            logger.debug("Starting uWsgi Service for <", ", ".join("%s (%s)" % (w.name, w.url_prefix)
+                                                                   for w in members),
+                         "> webapp priority class <", priority, ">")
+            self._add_instance(members, instance_id)
+
+    def _add_instance(self, members, instance_id):
+        # Settings of the first webapp (by url_prefix) are used for the instance of a shared pool
+        webapp = members[0]
+        conf_file = "%s/uwsgi/%s.conf" % (self.run_loc, instance_id)
+        command = [self.uwsgi_loc, '--ini', conf_file]
+        out_file = open('%s/uwsgi/%s.out' % (self.logs_dir, instance_id), "a")
+        pass_fds = ()
+        if webapp.idle_timeout:
+            # uwsgi inherits the socket bound with the name configured in its conf, instead of binding it again
+            pass_fds = (self._hold_socket(webapp, instance_id).fileno(),)
+            self._last_activity[instance_id] = (None, time.time())
+        env = self._instance_environment(members, instance_id)
+        with open(conf_file) as f:
+            self._running_settings[instance_id] = (f.read(), env)
+        if self._blue_green_instance(webapp, instance_id):
+            self._remove_snapshot(instance_id)
+            try:
+                env = self._snapshot_environment(webapp, instance_id, env)
+            except OSError as e:
+                logger.warn("Failed to snapshot the sources of webapp <%s>. The instance runs from its deployed "
+                            "sources. Reason: %s" % (webapp.name, e))
+        self.add_process(
+            name="'%s' uWsgi Service" % instance_id, command=command,
+            env=env,
+            stdout=out_file,
+            stderr=out_file,
+            pass_fds=pass_fds
+        )
+
+    def _instance_environment(self, members, instance_id):
+        webapp = members[0]
+        if instance_id == webapp.pool_instance:
+            env = pool_environment(instance_id, members, self.run_loc, self.security_key, self.security_block_size,
+                                   self.nginx_bind, self.pypath, self.job_queue, self.job_result_ttl)
+        else:
+            env = webapp_environment(webapp, self.run_loc, self.security_key, self.security_block_size,
+                                     self.nginx_bind, self.pypath, self.job_queue, self.job_result_ttl)
+        if webapp.preload:
+            env["BLACKPEARL_PRELOAD"] = "1"
+        if self.production:
+            env["BLACKPEARL_PRODUCTION"] = "1"
+        if self.startup_profile and self.startup_profile["enabled"]:
+            env["BLACKPEARL_STARTUP_PROFILE"] = startup_profile_path(self.run_loc, instance_id)
+            env["BLACKPEARL_STARTUP_BUDGET"] = str(self.startup_profile["budget"])
+            env["BLACKPEARL_IMPORT_BUDGET"] = str(self.startup_profile["import_budget"])
+        if self._hot_reloadable(webapp, instance_id):
+            env["BLACKPEARL_HOT_RELOAD"] = hot_reload_path(self.run_loc, instance_id)
+            env["BLACKPEARL_RELOAD_FILE"] = '%s/uwsgi/%s.reload' % (self.run_loc, instance_id)
+        return env
+
+    @staticmethod
+    def _blue_green_instance(webapp, instance_id):
+        """Returns True if the instance is replaced by a blue-green candidate when the webapp is modified"""
+        return webapp.blue_green and not webapp.pool_instance and not webapp.idle_timeout and \
+            instance_id == webapp.id
+
+    def _snapshot_environment(self, webapp, name, env):
+        """Returns the environment of the instance (or candidate) with the name, running from a snapshot of the
+        sources and the manifest of the webapp. As the handlers are imported lazily, the workers would
+        otherwise import the new sources while the candidate is tested, or after it is rolled back."""
+        snapshot_folder = "%s/uwsgi/snapshots/%s.%d" % (self.run_loc, name, int(time.time() * 1000))
+        self._snapshots[name] = snapshot_folder
+        snapshot = take_snapshot(webapp, snapshot_folder)
+        env = dict(env)
+        env["BLACKPEARL_PICKLE_FILE"] = snapshot["pickle_file"]
+        env["PYTHONPATH"] = ":".join([self.pypath] + snapshot["folders"])
+        return env
+
+    def _remove_snapshot(self, name):
+        snapshot_folder = self._snapshots.pop(name, None)
+        if snapshot_folder:
+            shutil.rmtree(snapshot_folder, ignore_errors=True)
+
+    def _hot_reloadable(self, webapp, instance_id):
+        """Returns True if the workers of the instance can reload the modules of the webapp in place. Workers
+        forked from the master having the old code (preload) or shared by several webapps are always reloaded."""
+        return self.hot_reload and not webapp.preload and not webapp.blue_green and \
+            instance_id != webapp.pool_instance
+
+    def _hold_socket(self, webapp, instance_id):
+        """Binds the socket of the instance, if it is not already held by the server"""
+        if instance_id in self._held_sockets:
+            return self._held_sockets[instance_id]
+
+        path = socket_path(self.run_loc, instance_id)
+        if os.access(path, os.F_OK):
+            os.remove(path)
+        listen = webapp.performance["listen"] or self.uwsgi_options.get("listen", webapps.DEFAULT_LISTEN_BACKLOG)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.listen(int(listen))
+        self._held_sockets[instance_id] = sock
+        return sock
+
+    def _release_socket(self, instance_id):
+        try:
+            sock = self._held_sockets.pop(instance_id)
+        except KeyError:
+            return
+        sock.close()
+        self._last_activity.pop(instance_id, None)
 
-    def _add_apps(self, apps_to_start):
-        for webapp in apps_to_start:
-            logger.debug("Starting uWsgi Service for <", webapp.name, "(", webapp.url_prefix, ") > webapp")
-            command = [self.uwsgi_loc, '--ini', "%s/uwsgi/%s.conf" % (self.run_loc, webapp.id)]
-            out_file = open('%s/uwsgi/%s.out' % (self.logs_dir, webapp.id), "w")
-            self.add_process(
-                name="'%s' uWsgi Service" % webapp.id, command=command,
-                env={
-                    "BLACKPEARL_DEPLOYED_APPS_PICKLE": "%s/uwsgi/pickle/deployed_apps.pickle" % self.run_loc,
-                    "BLACKPEARL_PICKLE_FILE": webapp.pickle_file,
-                    "BLACKPEARL_ENCRYPT_KEY": self.security_key,
-                    "BLACKPEARL_ENCRYPT_BLOCK_SIZE": str(self.security_block_size),
-                    "BLACKPEARL_LISTEN": str(self.nginx_bind),
-                    "PYTHONPATH": ":".join(
-                        [self.pypath,
-                         os.path.join(webapp.location, "src", "api"),
-                         os.path.join(webapp.location, "lib"),
-                         os.path.join(webapp.location, 'test')]
-                    )
-                },
-                stdout=out_file,
-                stderr=out_file
-            )
+    @asyncio.coroutine
+    def suspend_idle(self):
+        """Stops the instances of the webapps which have not served any request for idle_timeout seconds.
+        The socket of the instance stays open, so the instance is resumed on the next connection."""
+        for instance_id, members, priority in uwsgi_instances(self.webapps_list):
+            webapp = members[0]
+            if not webapp.idle_timeout:
+                continue
+            if instance_id in self._suspended or instance_id not in self._held_sockets:
+                continue
+            try:
+                stats = yield from uwsgictl.read_stats('%s/uwsgi/%s.stats' % (self.run_loc, instance_id))
+            except (OSError, ValueError) as e:
+                logger.debug("Stats of uWsgi Service <%s> not available. Reason: %s" % (instance_id, e))
+                continue
 
-    def generate_conf_file(self):
+            workers, busy, listen_queue = uwsgictl.worker_summary(stats)
+            requests = sum(worker.get('requests', 0) for worker in stats.get('workers', []))
+            last_requests, last_active = self._last_activity[instance_id]
+            now = time.time()
+            if busy > 0 or listen_queue > 0 or requests != last_requests:
+                self._last_activity[instance_id] = (requests, now)
+                continue
 
+            if now - last_active < webapp.idle_timeout:
+                continue
+
+            logger.info("Suspending uWsgi Service <%s> as it is idle for <%d> seconds" % (
+                instance_id, now - last_active))
+            self._suspended[instance_id] = members
+            self._running_settings.pop(instance_id, None)
+            yield from self.remove_process("'%s' uWsgi Service" % instance_id)
+            asyncio.get_event_loop().add_reader(self._held_sockets[instance_id].fileno(),
+                                                self._resume, instance_id)
+
+    def _resume(self, instance_id):
+        """Called when a connection is waiting on the socket of the suspended instance"""
+        asyncio.get_event_loop().remove_reader(self._held_sockets[instance_id].fileno())
+        members = self._suspended.pop(instance_id)
+        if self.__status__ in (process.Status.STOPPING, process.Status.STOPPED, process.Status.TERMINATED):
+            return
+        logger.info("Resuming uWsgi Service <%s> on incoming connection" % instance_id)
+        self._add_instance(members, instance_id)
+
+    def generate_conf_file(self, instances=None):
+        """Writes the conf file of the uwsgi instances. If instances (list of instance ids) is given, only the conf
+        files of those instances are written."""
         opt = {}
         for key, value in self.uwsgi_options.items():
             if key in Uwsgi.__immutable_options__:
@@ -207,27 +743,335 @@ class Uwsgi(ProcessGroup):
 
         for webapp in self.webapps_list:
             logger.info("Using python at <%s> for webapp<%s>" % (webapp.python_path, webapp.name))
-            config = {"socket": webapp.socket, "wsgi-file": self.uwsgi_file,
-                      "logto": '%s/uwsgi/%s.log' % (self.logs_dir, webapp.id),
-                      "pidfile": '%s/uwsgi/%s.pid' % (self.run_loc, webapp.id), "buffer-size": '32768',
-                      "touch-workers-reload": '%s/uwsgi/%s.reload' % (self.run_loc, webapp.id),
-                      "workers": str(multiprocessing.cpu_count()), "lazy-apps": 'true',
-                      'home': webapp.python_home_path,
-                      "touch-logreopen": '%s/uwsgi/%s.log_reopen' % (self.run_loc, webapp.id)}
-
-            config.update(opt)
-            conf_list = [str(key) + " = " + str(value) for key, value in config.items()]
-            conf_list.insert(0, "[uwsgi]")
 
-            with open("%s/uwsgi/%s.conf" % (self.run_loc, webapp.id), "w") as f:
-                f.write("\n".join(conf_list))
+        for instance_id, members, priority in uwsgi_instances(self.webapps_list):
+            if instances is not None and instance_id not in instances:
+                continue
+            config = self._instance_config(instance_id, members, priority, opt)
+            self._write_conf_file("%s/uwsgi/%s.conf" % (self.run_loc, instance_id), config)
+            # Instance promoted from a blue-green candidate was started with its own conf file, which is read
+            # again when the instance is reloaded
+            if instance_id in self._promoted_confs:
+                self._write_conf_file(self._promoted_confs[instance_id], config)
+
+    def _instance_config(self, instance_id, members, priority, opt):
+        """Returns the uwsgi options of the instance"""
+        # Settings of the first webapp (by url_prefix) are used for the instance of a shared pool
+        webapp = members[0]
+        config = {"socket": socket_path(self.run_loc, instance_id), "wsgi-file": self.uwsgi_file,
+                  "logto": '%s/uwsgi/%s.log' % (self.logs_dir, instance_id),
+                  "pidfile": '%s/uwsgi/%s.pid' % (self.run_loc, instance_id), "buffer-size": '32768',
+                  "touch-chain-reload": '%s/uwsgi/%s.reload' % (self.run_loc, instance_id),
+                  "workers": str(multiprocessing.cpu_count()), "lazy-apps": 'true',
+                  "enable-threads": 'true', "listen": str(webapps.DEFAULT_LISTEN_BACKLOG),
+                  "master": 'true', "stats": '%s/uwsgi/%s.stats' % (self.run_loc, instance_id),
+                  "master-fifo": '%s/uwsgi/%s.fifo' % (self.run_loc, instance_id),
+                  'home': webapp.python_home_path,
+                  "touch-logreopen": '%s/uwsgi/%s.log_reopen' % (self.run_loc, instance_id)}
+
+        config.update(opt)
+        # Tuning done in the webapp overrides the server wide uwsgi_options
+        for option, uwsgi_option in webapps.PERFORMANCE_OPTIONS.items():
+            if webapp.performance[option] is not None:
+                config[uwsgi_option] = str(webapp.performance[option])
+        # Worker pool size configured for the priority class in the webapp
+        if priority in webapp.priority_workers:
+            config["workers"] = str(webapp.priority_workers[priority])
+        # Autoscaled instance starts with min_workers. Other workers are spawned/stopped
+        # by the autoscaler through the master fifo.
+        if webapp.autoscale:
+            config["workers"] = str(webapp.autoscale["max_workers"])
+            config["cheaper-algo"] = 'manual'
+            config["cheaper"] = str(webapp.autoscale["min_workers"])
+            config["cheaper-initial"] = str(webapp.autoscale["min_workers"])
+        # Webapp is initialized once in the master and the workers are forked from it. Reloading only
+        # the workers would fork them again from the old code, so the whole instance is reloaded.
+        if webapp.preload:
+            config["lazy-apps"] = 'false'
+            config["touch-reload"] = config.pop("touch-chain-reload")
+        return config
+
+    @staticmethod
+    def _write_conf_file(conf_file, config):
+        with open(conf_file, "w") as f:
+            f.write(Uwsgi._conf_text(config))
+
+    @staticmethod
+    def _conf_text(config):
+        conf_list = [str(key) + " = " + str(value) for key, value in config.items()]
+        conf_list.insert(0, "[uwsgi]")
+        return "\n".join(conf_list)
 
     def reload_conf(self):
         self.send_signal(signal.SIGHUP)
 
+    def reload_app(self, webapp, skip_default=False):
+        """Reloads the workers of all the instances of the webapp. The instance serving the default priority
+        class is skipped if skip_default is set (it is replaced by a blue-green deployment).
+
+        Workers are reloaded one at a time (chain reload). The next worker is reloaded only after the new worker
+        has loaded the webapp (application.initialize() including the warm-up hook), so the instance never
+        has less than N-1 workers accepting requests."""
+        for instance_id, members, priority in uwsgi_instances([webapp]):
+            if skip_default and instance_id == webapp.id:
+                continue
+            with open('%s/uwsgi/%s.reload' % (self.run_loc, instance_id), "w") as f:
+                f.write("reload workers")
+
+    def hot_reload_app(self, webapp, changed_files):
+        """Reloads the changed modules of the webapp in the running workers of its instances, without restarting
+        the workers. Returns False, without doing anything, if the change can not be applied in place. The webapp
+        is then to be reloaded with reload_app."""
+        instances = [instance_id for instance_id, members, priority in uwsgi_instances([webapp])]
+        for instance_id in instances:
+            if not self._hot_reloadable(webapp, instance_id) or instance_id in self._suspended or \
+                    self._deployed_instances.get(instance_id) != [webapp.id]:
+                return False
+
+        source_folders = [os.path.join(webapp.location, folder, "")
+                          for folder in (os.path.join("src", "api"), "lib", "test")]
+        for changed_file in changed_files:
+            if not changed_file.endswith(".py") or not changed_file.startswith(tuple(source_folders)) or \
+                    not os.access(changed_file, os.F_OK):
+                logger.info("Change of <%s> can not be hot reloaded. Reloading the workers of webapp <%s>" % (
+                    changed_file, webapp.name))
+                return False
+
+        for instance_id in instances:
+            # Written to a temporary file and renamed, as the workers read it while serving the requests
+            signal_file = hot_reload_path(self.run_loc, instance_id)
+            with open(signal_file + ".tmp", "w") as f:
+                json.dump({"files": changed_files}, f)
+            os.rename(signal_file + ".tmp", signal_file)
+        logger.info("Hot reloading the files <%s> in the workers of webapp <%s>" % (", ".join(changed_files),
+                                                                                    webapp.name))
+        return True
+
+    def _candidate_files(self, instance_id):
+        """Returns the list of (file of the candidate, file of the instance) which are replaced by the candidate
+        when it is promoted"""
+        candidate_id = "%s.__candidate__" % instance_id
+        return [(socket_path(self.run_loc, candidate_id), socket_path(self.run_loc, instance_id))] + [
+            ('%s/uwsgi/%s.%s' % (self.run_loc, candidate_id, ext), '%s/uwsgi/%s.%s' % (self.run_loc, instance_id, ext))
+            for ext in ("stats", "fifo", "pid")]
+
+    def start_candidate(self, webapp, secret):
+        """Starts the candidate instance serving the new code of the webapp, next to the running instance.
+        The candidate uses the settings of the instance with its own socket, stats, master fifo and pid files.
+        Its testcases send the secret in the candidate header. Returns the socket of the candidate."""
+        instance_id = webapp.id
+        candidate_id = "%s.__candidate__" % instance_id
+        opt = {key: value for key, value in self.uwsgi_options.items() if key not in Uwsgi.__immutable_options__}
+        config = self._instance_config(instance_id, [webapp], webapps.DEFAULT_PRIORITY, opt)
+        files = self._candidate_files(instance_id)
+        for option, (candidate_file, instance_file) in zip(("socket", "stats", "master-fifo", "pidfile"), files):
+            config[option] = candidate_file
+            if os.access(candidate_file, os.F_OK):
+                os.remove(candidate_file)
+
+        # Conf file is named uniquely, as it stays in use by the candidate after it is promoted
+        conf_file = "%s/uwsgi/%s.%d.conf" % (self.run_loc, candidate_id, int(time.time()))
+        self._write_conf_file(conf_file, config)
+        self._candidate_confs[instance_id] = conf_file
+
+        env = self._snapshot_environment(webapp, candidate_id, self._instance_environment([webapp], instance_id))
+        env["BLACKPEARL_CANDIDATE"] = "1"
+        env["BLACKPEARL_CANDIDATE_SECRET"] = secret
+        out_file = open('%s/uwsgi/%s.out' % (self.logs_dir, instance_id), "a")
+        self.add_process(
+            name="'%s' uWsgi Service" % candidate_id, command=[self.uwsgi_loc, '--ini', conf_file],
+            env=env,
+            stdout=out_file,
+            stderr=out_file,
+            optional=True
+        )
+        return config["socket"]
+
+    @asyncio.coroutine
+    def promote_candidate(self, webapp, drain_timeout):
+        """Replaces the instance of the webapp with its candidate. Called after nginx is switched to send the
+        requests to the candidate.
+
+        The socket, stats, master fifo and pid files of the candidate are linked to the names of the instance,
+        so the candidate is managed as the instance from now on. The instance is stopped only after that, once
+        it has served its in-flight requests (or after drain_timeout seconds). If the candidate can not be
+        promoted, the instance is left running and CandidateFailedError is raised."""
+        instance_id = webapp.id
+        candidate_id = "%s.__candidate__" % instance_id
+        deadline = time.time() + drain_timeout
+        while True:
+            try:
+                stats = yield from uwsgictl.read_stats('%s/uwsgi/%s.stats' % (self.run_loc, instance_id))
+            except (OSError, ValueError):
+                break
+            workers, busy, listen_queue = uwsgictl.worker_summary(stats)
+            if busy == 0 and listen_queue == 0:
+                break
+            if time.time() > deadline:
+                logger.warn("uWsgi Service <%s> is still serving <%s> requests after <%s> seconds. Stopping it "
+                            "anyway" % (instance_id, busy + listen_queue, drain_timeout))
+                break
+            yield from asyncio.sleep(1)
+
+        if "'%s' uWsgi Service" % candidate_id not in self.processes:
+            raise CandidateFailedError("Candidate of the webapp <%s> stopped unexpectedly" % webapp.name)
+
+        # Everything which can fail is done while the instance is still running, so that the deployment can be
+        # rolled back to it. Conf file of the candidate is used when the instance is reloaded. So, it is
+        # rewritten with the names of the instance.
+        opt = {key: value for key, value in self.uwsgi_options.items() if key not in Uwsgi.__immutable_options__}
+        config = self._instance_config(instance_id, [webapp], webapps.DEFAULT_PRIORITY, opt)
+        files = self._candidate_files(instance_id)
+        try:
+            self._write_conf_file(self._candidate_confs[instance_id], config)
+            for candidate_file, instance_file in files:
+                if os.access(instance_file + ".promoted", os.F_OK):
+                    os.remove(instance_file + ".promoted")
+                os.link(candidate_file, instance_file + ".promoted")
+        except OSError as e:
+            for candidate_file, instance_file in files:
+                if os.access(instance_file + ".promoted", os.F_OK):
+                    os.remove(instance_file + ".promoted")
+            raise CandidateFailedError("Failed to link the files of the candidate of the webapp <%s>. Reason: %s" % (
+                webapp.name, e))
+        # Renamed over the names of the instance. The running instance keeps the socket it has already bound.
+        for candidate_file, instance_file in files:
+            os.rename(instance_file + ".promoted", instance_file)
+
+        yield from self.remove_process("'%s' uWsgi Service" % instance_id)
+        self._recycling.pop(instance_id, None)
+        self._underused_checks.pop(instance_id, None)
+        self._remove_snapshot(instance_id)
+        self._snapshots[instance_id] = self._snapshots.pop(candidate_id)
+        self.rename_process("'%s' uWsgi Service" % candidate_id, "'%s' uWsgi Service" % instance_id)
+        self.processes["'%s' uWsgi Service" % instance_id]["optional"] = False
+
+        if instance_id in self._promoted_confs:
+            os.remove(self._promoted_confs[instance_id])
+        self._promoted_confs[instance_id] = self._candidate_confs.pop(instance_id)
+        self._running_settings[instance_id] = (self._conf_text(config),
+                                               self._instance_environment([webapp], instance_id))
+
+    def remove_candidate_files(self, webapp):
+        """Removes the names of the candidate files, once nobody uses them"""
+        for candidate_file, instance_file in self._candidate_files(webapp.id):
+            if os.access(candidate_file, os.F_OK):
+                os.remove(candidate_file)
+
+    @asyncio.coroutine
+    def discard_candidate(self, webapp):
+        """Stops the candidate of the webapp. The running instance is left as it is."""
+        name = "'%s.__candidate__' uWsgi Service" % webapp.id
+        if name in self.processes:
+            yield from self.remove_process(name)
+        self.remove_candidate_files(webapp)
+        conf_file = self._candidate_confs.pop(webapp.id, None)
+        if conf_file and os.access(conf_file, os.F_OK):
+            os.remove(conf_file)
+        self._remove_snapshot("%s.__candidate__" % webapp.id)
+
+    @asyncio.coroutine
+    def autoscale(self, busy_high, busy_low, scale_down_after):
+        """Adds a worker to the instances whose busy workers ratio reached busy_high or having requests waiting
+        in the listen queue. Removes a worker from the instances whose busy workers ratio stayed at or below
+        busy_low for scale_down_after consecutive checks. The workers are kept within the autoscale bounds of
+        the webapp."""
+        for instance_id, members, priority in uwsgi_instances(self.webapps_list):
+            webapp = members[0]
+            if not webapp.autoscale:
+                continue
+            min_workers = webapp.autoscale["min_workers"]
+            max_workers = webapp.autoscale["max_workers"]
+
+            try:
+                stats = yield from uwsgictl.read_stats('%s/uwsgi/%s.stats' % (self.run_loc, instance_id))
+            except (OSError, ValueError) as e:
+                logger.debug("Stats of uWsgi Service <%s> not available. Reason: %s" % (instance_id, e))
+                continue
+
+            workers, busy, listen_queue = uwsgictl.worker_summary(stats)
+            if workers == 0:
+                continue
+            busy_ratio = busy / workers
+            metrics = "busy workers <%s/%s>, listen queue <%s>" % (busy, workers, listen_queue)
+
+            if (busy_ratio >= busy_high or listen_queue > 0) and workers < max_workers:
+                command = uwsgictl.ADD_WORKER
+                logger.info("Scaling up uWsgi Service <%s> from <%s> to <%s> workers. Metrics: %s" % (
+                    instance_id, workers, workers + 1, metrics))
+            elif busy_ratio <= busy_low and listen_queue == 0 and workers > min_workers:
+                self._underused_checks[instance_id] = self._underused_checks.get(instance_id, 0) + 1
+                if self._underused_checks[instance_id] < scale_down_after:
+                    continue
+                command = uwsgictl.REMOVE_WORKER
+                logger.info("Scaling down uWsgi Service <%s> from <%s> to <%s> workers. Metrics: %s, "
+                            "underused for <%s> checks" % (instance_id, workers, workers - 1, metrics,
+                                                           self._underused_checks[instance_id]))
+            else:
+                self._underused_checks[instance_id] = 0
+                continue
+
+            self._underused_checks[instance_id] = 0
+            try:
+                uwsgictl.send_command('%s/uwsgi/%s.fifo' % (self.run_loc, instance_id), command)
+            except OSError as e:
+                logger.warn("Failed to scale uWsgi Service <%s>. Reason: %s" % (instance_id, e))
+
+    @asyncio.coroutine
+    def recycle_workers(self):
+        """Recycles the workers which crossed the max_rss or max_requests limit of the webapp.
+
+        The worker is sent SIGHUP, so that it finishes the in-flight request before exiting and the uwsgi master
+        spawns a new one. Only one worker of an instance is recycled at a time. The next one is recycled only
+        after the previous one is replaced."""
+        for instance_id, members, priority in uwsgi_instances(self.webapps_list):
+            webapp = members[0]
+            max_rss = webapp.recycle["max_rss"]
+            max_requests = webapp.recycle["max_requests"]
+            if not max_rss and not max_requests:
+                continue
+            try:
+                stats = yield from uwsgictl.read_stats('%s/uwsgi/%s.stats' % (self.run_loc, instance_id))
+            except (OSError, ValueError) as e:
+                logger.debug("Stats of uWsgi Service <%s> not available. Reason: %s" % (instance_id, e))
+                continue
+
+            # Workers stopped by the cheaper subsystem have pid 0
+            workers = [worker for worker in stats.get('workers', []) if worker.get('pid')]
+            if instance_id in self._recycling:
+                if self._recycling[instance_id] in [worker['pid'] for worker in workers]:
+                    # Still serving its in-flight request
+                    continue
+                logger.info("Recycled worker (pid <%s>) of uWsgi Service <%s> is replaced" % (
+                    self._recycling.pop(instance_id), instance_id))
+
+            for worker in workers:
+                try:
+                    rss = meminfo.rss(worker['pid'])
+                except OSError:
+                    continue
+                requests = worker.get('delta_requests', 0)
+                if max_rss and rss > max_rss * 1024 * 1024:
+                    reason = "its RSS <%s> is above max_rss <%s MB>" % (meminfo.to_mb(rss), max_rss)
+                elif max_requests and requests >= max_requests:
+                    reason = "it served <%s> requests" % requests
+                else:
+                    continue
+
+                logger.info("Recycling worker <%s> (pid <%s>) of uWsgi Service <%s> as %s. RSS before "
+                            "recycle <%s>, requests served <%s>" % (worker.get('id'), worker['pid'], instance_id,
+                                                                    reason, meminfo.to_mb(rss), requests))
+                try:
+                    os.kill(worker['pid'], signal.SIGHUP)
+                except OSError as e:
+                    logger.warn("Failed to recycle worker (pid <%s>). Reason: %s" % (worker['pid'], e))
+                    continue
+                self._recycling[instance_id] = worker['pid']
+                break
+
     def check_and_rotate_log(self):
-        for webapp in self.webapps_list:
-            log = '%s/uwsgi/%s.log' % (self.logs_dir, webapp.id)
+        for instance_id, members, priority in uwsgi_instances(self.webapps_list):
+            log = '%s/uwsgi/%s.log' % (self.logs_dir, instance_id)
 
             rotated = False
             if os.stat(log).st_size > self.max_log_size:
@@ -241,10 +1085,103 @@ class Uwsgi(ProcessGroup):
                 shutil.move(log, "%s.1" % log)
 
             if rotated:
-                with open('%s/uwsgi/%s.log_reopen' % (self.run_loc, webapp.id), "w") as w:
+                with open('%s/uwsgi/%s.log_reopen' % (self.run_loc, instance_id), "w") as w:
                     w.write(datetime.now().isoformat())
 
 
+class JobWorkers(ProcessGroup):
+    """Pool of job worker processes executing the webmodules decorated with @job.
+    Each webapp having job webmodules gets its own set of workers running in its virtualenv."""
+
+    def __init__(self, jobworker_file, webapps_list, logs_dir, run_loc, security_key, security_block_size,
+                 nginx_bind, pypath, job_queue, job_result_ttl, workers, poll_interval, log_level, log_format,
+                 production=False):
+
+        super().__init__(name="Job Workers")
+        self.jobworker_file = jobworker_file
+        self.logs_dir = logs_dir
+        self.run_loc = run_loc
+        self.security_key = security_key
+        self.security_block_size = security_block_size
+        self.nginx_bind = nginx_bind
+        self.pypath = pypath
+        self.job_queue = job_queue
+        self.job_result_ttl = job_result_ttl
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.log_level = log_level
+        self.log_format = log_format
+        self.production = production
+        self.queue = JobQueue(job_queue)
+
+        self.webapps_list = []
+        self._add_apps(webapps_list)
+        self.webapps_list = webapps_list
+
+    def _worker_names(self, webapp):
+        return ["'%s' Job Worker %s" % (webapp.id, i) for i in range(self.workers)]
+
+    def _add_apps(self, apps_to_start):
+        for webapp in apps_to_start:
+            if not webapp.jobs:
+                continue
+
+            count = self.queue.requeue_interrupted(webapp.id)
+            if count:
+                logger.info("Requeued <%s> interrupted jobs of webapp <%s>" % (count, webapp.name))
+
+            logger.debug("Starting job workers for <%s (%s)> webapp" % (webapp.name, webapp.url_prefix))
+            command = [webapp.python_path, self.jobworker_file, str(self.poll_interval),
+                       str(self.log_level), self.log_format]
+            env = webapp_environment(webapp, self.run_loc, self.security_key, self.security_block_size,
+                                     self.nginx_bind, self.pypath, self.job_queue, self.job_result_ttl)
+            if self.production:
+                env["BLACKPEARL_PRODUCTION"] = "1"
+            for i, name in enumerate(self._worker_names(webapp)):
+                out_file = open('%s/jobs/%s.%s.out' % (self.logs_dir, webapp.id, i), "w")
+                self.add_process(
+                    name=name, command=command,
+                    env=env,
+                    stdout=out_file,
+                    stderr=out_file
+                )
+
+    @asyncio.coroutine
+    def update_apps(self, webapps_list, modified_webapps):
+        """Restarts the workers of the modified webapps and
+        starts/stops the workers of the added/removed webapps"""
+        new_apps_id = [w.id for w in webapps_list]
+        modified_apps_id = [w.id for w in modified_webapps]
+        deployed_apps_id = [w.id for w in self.webapps_list]
+
+        apps_to_stop = [webapp for webapp in self.webapps_list
+                        if webapp.id not in new_apps_id or webapp.id in modified_apps_id]
+        for webapp in apps_to_stop:
+            for name in self._worker_names(webapp):
+                if name in self.processes:
+                    yield from self.remove_process(name)
+
+        self.webapps_list = webapps_list
+        self._add_apps([webapp for webapp in webapps_list
+                        if webapp.id not in deployed_apps_id or webapp.id in modified_apps_id])
+
+        if self.status == process.Status.NOTSTARTED:
+            yield from self.start()
+
+    @asyncio.coroutine
+    def start(self):
+        # None of the deployed webapps have job webmodules
+        if not self.processes:
+            return
+        yield from super().start()
+
+    @asyncio.coroutine
+    def stop(self):
+        if not self.processes:
+            return
+        yield from super().stop()
+
+
 class Nginx(Process):
     def __init__(self, nginx_loc, hostname, listen,
                  run_loc, share_loc, logs_loc, max_log_size, max_log_files):
@@ -257,6 +1194,9 @@ class Nginx(Process):
 
         self.max_log_size = max_log_size
         self.max_log_files = max_log_files
+        # url_prefix -> (socket, secret) of the blue-green candidate of the webapp. Requests having the secret
+        # in the candidate header are sent to the candidate.
+        self.candidates = {}
 
         command = [self.nginx_loc, '-c', '{run}/nginx/nginx.conf'.format(run=self.run_loc)]
 
@@ -265,51 +1205,21 @@ class Nginx(Process):
     def reload_conf(self):
         self.send_signal(signal.SIGHUP)
 
-    def generate_conf_file(self, webapps_list):
-        locations = []
-        root_location = []
-
-        class Location:
-
-            def __init__(self):
-                self.path = None
-                self.values = []
-
-            def add_value(self, key, *value):
-                self.values.append([key, value])
-
+    def generate_conf_file(self, webapps_list, modified_webapps=None):
+        """Writes the nginx conf. The locations of each webapp are written to its own file, included from the
+        nginx conf in the order of the webapps list. If modified_webapps is given, only the files of those
+        webapps (and of the newly added webapps) are rewritten."""
+        webapps_dir = "%s/nginx/webapps" % self.run_loc
+        webapp_files = {webapp.id: "%s/%s.conf" % (webapps_dir, webapp.id) for webapp in webapps_list}
+        for name in os.listdir(webapps_dir):
+            if os.path.join(webapps_dir, name) not in webapp_files.values():
+                os.remove(os.path.join(webapps_dir, name))
+
+        modified = [webapp.id for webapp in modified_webapps] if modified_webapps is not None else None
         for webapp in webapps_list:
-            location = Location()
-            if len(webapp.url_prefix) > 1:
-                location.path = '^%s/?$' % webapp.url_prefix
-                location.add_value('alias', '%s/src/static/' % webapp.location)
-                location.add_value('try_files', 'index.html', '%s/index' % webapp.url_prefix)
-                locations.append(location)
-                location = Location()
-                location.path = '(^%s/(.+))/$' % webapp.url_prefix
-                location.add_value('alias', '%s/src/static/$2/' % webapp.location)
-                location.add_value('try_files', 'index.html', '$1/index')
-                locations.append(location)
-
-                location = Location()
-                location.path = '^%s/(.+\.[^/]+$)' % webapp.url_prefix
-                location.add_value('alias', '%s/src/static/$1' % webapp.location)
-                locations.append(location)
-            else:
-                location.path = '^/?$'
-                location.add_value('alias', '%s/src/static/' % webapp.location)
-                location.add_value('try_files', 'index.html', '/index')
-                locations.append(location)
-                location = Location()
-                location.path = '(^/(.+))/$'
-                location.add_value('alias', '%s/src/static/$2/' % webapp.location)
-                location.add_value('try_files', 'index.html', '$1/index')
-                locations.append(location)
-
-                location = Location()
-                location.path = '^/(.+\.[^/]+$)'
-                location.add_value('alias', '%s/src/static/$1' % webapp.location)
-                locations.append(location)
+            if modified is None or webapp.id in modified or not os.access(webapp_files[webapp.id], os.F_OK):
+                with open(webapp_files[webapp.id], "w") as f:
+                    f.write(self._webapp_locations(webapp))
 
         conf = "\n pid  %s/nginx/nginx.pid;" % self.run_loc
         conf += "\n daemon off;"
@@ -339,29 +1249,97 @@ class Nginx(Process):
         conf += "\n\t\t server_name %s;" % self.hostname
         conf += "\n\t\t access_log %s/nginx/nginx.access.log  main;" % self.logs_loc
 
-        for loc in locations:
-            conf += "\n\n\t\t location ~ %s {" % loc.path
-            for val in loc.values:
-                conf += "\n\t\t\t %s '%s';" % (val[0], "' '".join(val[1]))
-            conf += "\n\t\t }"
-
-        for loc in root_location:
-            conf += "\n\n\t\t location ~ %s {" % loc.path
-            for val in loc.values:
-                conf += "\n\t\t\t %s '%s';" % (val[0], "' '".join(val[1]))
-            conf += "\n\t\t }"
-
+        # Regex locations are matched in the order they appear. So, the webapps are included in the list order.
         for webapp in webapps_list:
-            conf += "\n\n\t\t location %s {" % webapp.url_prefix
-            conf += "\n\t\t\t uwsgi_pass 'unix://%s';" % webapp.socket
-            conf += "\n\t\t\t include '%s/uwsgi_params';" % self.share_loc
-            conf += "\n\t\t }"
+            conf += "\n\t\t include '%s';" % webapp_files[webapp.id]
         conf += "\n\t }"
         conf += "\n }"
 
         with open("%s/nginx/nginx.conf" % self.run_loc, "w") as f:
             f.write(conf)
 
+    def _webapp_locations(self, webapp):
+        """Returns the nginx locations serving the static files and the webmodules of the webapp"""
+        locations = []
+
+        class Location:
+
+            def __init__(self):
+                self.path = None
+                self.values = []
+
+            def add_value(self, key, *value):
+                self.values.append([key, value])
+
+        location = Location()
+        if len(webapp.url_prefix) > 1:
+            location.path = '^%s/?$' % webapp.url_prefix
+            location.add_value('alias', '%s/src/static/' % webapp.location)
+            location.add_value('try_files', 'index.html', '%s/index' % webapp.url_prefix)
+            locations.append(location)
+            location = Location()
+            location.path = '(^%s/(.+))/$' % webapp.url_prefix
+            location.add_value('alias', '%s/src/static/$2/' % webapp.location)
+            location.add_value('try_files', 'index.html', '$1/index')
+            locations.append(location)
+
+            location = Location()
+            location.path = '^%s/(.+\.[^/]+$)' % webapp.url_prefix
+            location.add_value('alias', '%s/src/static/$1' % webapp.location)
+            locations.append(location)
+        else:
+            location.path = '^/?$'
+            location.add_value('alias', '%s/src/static/' % webapp.location)
+            location.add_value('try_files', 'index.html', '/index')
+            locations.append(location)
+            location = Location()
+            location.path = '(^/(.+))/$'
+            location.add_value('alias', '%s/src/static/$2/' % webapp.location)
+            location.add_value('try_files', 'index.html', '$1/index')
+            locations.append(location)
+
+            location = Location()
+            location.path = '^/(.+\.[^/]+$)'
+            location.add_value('alias', '%s/src/static/$1' % webapp.location)
+            locations.append(location)
+
+        conf = ""
+        for loc in locations:
+            conf += "\n\n\t\t location ~ %s {" % loc.path
+            for val in loc.values:
+                conf += "\n\t\t\t %s '%s';" % (val[0], "' '".join(val[1]))
+            conf += "\n\t\t }"
+
+        # Routing the webmodules of the non default priority classes to their own uwsgi instance
+        for instance_id, priority in webapp.instances()[1:]:
+            for url in webapp.priority_classes[priority]:
+                conf += "\n\n\t\t location = %s {" % url
+                conf += "\n\t\t\t uwsgi_pass 'unix://%s';" % webapp.sockets[instance_id]
+                conf += "\n\t\t\t include '%s/uwsgi_params';" % self.share_loc
+                conf += "\n\t\t\t uwsgi_param BLACKPEARL_REQUEST_START $msec;"
+                conf += self._candidate_routing(webapp)
+                conf += "\n\t\t }"
+
+        conf += "\n\n\t\t location %s {" % webapp.url_prefix
+        conf += "\n\t\t\t uwsgi_pass 'unix://%s';" % webapp.socket
+        conf += "\n\t\t\t include '%s/uwsgi_params';" % self.share_loc
+        # Used by the webapp to measure the time spent by the request in the uwsgi listen queue
+        conf += "\n\t\t\t uwsgi_param BLACKPEARL_REQUEST_START $msec;"
+        conf += self._candidate_routing(webapp)
+        conf += "\n\t\t }"
+        return conf
+
+    def _candidate_routing(self, webapp):
+        """Returns the conf sending the requests having the secret in the candidate header to the blue-green
+        candidate of the webapp. Candidate serves the webmodules of all the priority classes."""
+        if webapp.url_prefix not in self.candidates:
+            return ""
+        candidate_socket, secret = self.candidates[webapp.url_prefix]
+        conf = "\n\t\t\t if ($http_x_blackpearl_candidate = '%s') {" % secret
+        conf += "\n\t\t\t\t uwsgi_pass 'unix://%s';" % candidate_socket
+        conf += "\n\t\t\t }"
+        return conf
+
     def check_and_rotate_log(self):
         access_log = "%s/nginx/nginx.access.log" % self.logs_loc
         error_log = "%s/nginx/nginx.error.log" % self.logs_loc
@@ -398,19 +1376,25 @@ class AppServer(AsyncTask, ProcessStatus):
     # Instance Variables : config, status, reloading_code, reloading_conf,
     #                      webapp_locations, ev_loop, uwsgi, nginx
 
-    def __init__(self):
+    def __init__(self, timeline=None):
         AsyncTask.__init__(self)
         ProcessStatus.__init__(self, process_name="BlackPearl Server")
+        # Steps of the boot, written to the run folder once the services are started (blackpearl.py boot-report)
+        self.timeline = timeline or Timeline()
+        self._spawn_started = None
         self.environment_initialized = False
         self.config = None
         self.reloading_code = False
         self.reloading_conf = False
-        self.modified_files = []
+        # (app dir, webapp folder) of the webapps changed since the last code reload
+        self.modified_webapps = set()
+        self.change_detector = None
         self.webapp_locations = None
         self.ev_loop = None
 
         self.uwsgi = None
         self.nginx = None
+        self.job_workers = None
 
     @asyncio.coroutine
     def initialize_environment(self, config):
@@ -421,45 +1405,59 @@ class AppServer(AsyncTask, ProcessStatus):
             listen = config['listen']
             security = config['security']
             uwsgi_options = config['uwsgi_options']
+            jobs = config['jobs']
 
             self.config = config
             self.reloading_code = False
             self.reloading_conf = False
-            self.modified_files = []
+            self.modified_webapps = set()
 
             webapp_locations = path['webapps']
             self.webapp_locations = webapp_locations
 
-            webapps_list = yield from analyse_and_pickle_webapps(self.config, path['lib'],
-                                                                 os.path.join(config['path']['cache'], "virtenv"),
-                                                                 "%s/uwsgi/pickle/" % path['run'],
-                                                                 *webapp_locations
-                                                                 )
+            with self.timeline.span("analysis"):
+                webapps_list = yield from analyse_and_pickle_webapps(self.config, path['lib'],
+                                                                     os.path.join(config['path']['cache'], "virtenv"),
+                                                                     "%s/uwsgi/pickle/" % path['run'],
+                                                                     *webapp_locations, timeline=self.timeline
+                                                                     )
 
             if not webapps_list:
                 logger.critical("No application deployed.")
                 raise NoApplicationDeployedError("No application deployed")
 
-            for webapp in webapps_list:
-                webapp.socket = path['run'] + "/uwsgi/%s.socket" % webapp.id
+            configuration_started = time.time()
+            assign_sockets(webapps_list, path['run'])
 
             # Asyncio the event loop
             self.ev_loop = asyncio.get_event_loop()
 
+            job_queue = os.path.join(path['cache'], "jobs", "jobs.sqlite")
+
             self.uwsgi = Uwsgi(
                 server['uwsgi'], path['lib'] + "/wsgi.py", webapps_list,
                 path['log'], path['run'], security['key'],
                 security['block_size'], listen,
-                path['lib'], uwsgi_options, config['logging']['max_log_size'], config['logging']['max_log_files']
+                path['lib'], uwsgi_options, config['logging']['max_log_size'], config['logging']['max_log_files'],
+                job_queue, jobs['result_ttl'], config['production'], config['startup_profile'],
+                config['hot_reload']
             )
             self.uwsgi.generate_conf_file()
 
+            self.job_workers = JobWorkers(
+                os.path.join(os.path.dirname(__file__), 'jobworker.py'), webapps_list,
+                path['log'], path['run'], security['key'], security['block_size'], listen,
+                path['lib'], job_queue, jobs['result_ttl'], jobs['workers'], jobs['poll_interval'],
+                config['logging']['level'], config['logging']['format'], config['production']
+            )
+
             self.nginx = Nginx(
                 server['nginx'], hostname, listen,
                 path['run'], path['share'], path['log'], config['logging']['max_log_size'],
                 config['logging']['max_log_files']
             )
             self.nginx.generate_conf_file(webapps_list)
+            self.timeline.add("configuration", configuration_started, time.time())
 
             # Defining service status change listener
             self.nginx.add_status_listener(functools.partial(self._service_status_update_cb, "nginx "))
@@ -481,10 +1479,55 @@ class AppServer(AsyncTask, ProcessStatus):
 
         self.new_async_task(monitor())
 
+    def _init_autoscaler(self):
+        autoscale = self.config['autoscale']
+
+        @asyncio.coroutine
+        def monitor():
+            while self.__status__ not in (Status.STOPPED, Status.TERMINATED, Status.STARTFAILED):
+                yield from asyncio.sleep(autoscale['interval'])
+                try:
+                    yield from self.uwsgi.autoscale(autoscale['busy_high'], autoscale['busy_low'],
+                                                    autoscale['scale_down_after'])
+                except Exception:
+                    logger.error("Autoscaling check failed.")
+                    logger.error(" %s" % traceback.format_exc())
+
+        self.new_async_task(monitor())
+
+    def _init_idle_monitor(self):
+        @asyncio.coroutine
+        def monitor():
+            while self.__status__ not in (Status.STOPPED, Status.TERMINATED, Status.STARTFAILED):
+                yield from asyncio.sleep(IDLE_CHECK_INTERVAL)
+                try:
+                    yield from self.uwsgi.suspend_idle()
+                except Exception:
+                    logger.error("Suspending idle webapps failed.")
+                    logger.error(" %s" % traceback.format_exc())
+
+        self.new_async_task(monitor())
+
+    def _init_recycle_watchdog(self):
+        @asyncio.coroutine
+        def monitor():
+            while self.__status__ not in (Status.STOPPED, Status.TERMINATED, Status.STARTFAILED):
+                yield from asyncio.sleep(RECYCLE_CHECK_INTERVAL)
+                try:
+                    yield from self.uwsgi.recycle_workers()
+                except Exception:
+                    logger.error("Recycling workers failed.")
+                    logger.error(" %s" % traceback.format_exc())
+
+        self.new_async_task(monitor())
+
     def _code_update_monitor_init(self):
         logger.info("Watching <%s> paths for file modifications." % str(self.webapp_locations))
         paths = self.webapp_locations
         excl = pyinotify.ExcludeFilter([al + "/*/src/static" for al in self.webapp_locations])
+        self.change_detector = ChangeDetector(self.webapp_locations,
+                                              os.path.join(self.config['path']['cache'], "analysis"),
+                                              self._code_changed, self.ev_loop)
         self.afm = fileutils.AsyncFileMonitor(self._code_update_cb, loop=self.ev_loop)
         self.afm.set_watch_path(paths, rec=True, exclude_filter=excl)
 
@@ -506,6 +1549,7 @@ class AppServer(AsyncTask, ProcessStatus):
 
     @asyncio.coroutine
     def start(self):
+        self._spawn_started = time.time()
 
         # Initializing Code update Monitor
         self._code_update_monitor_init()
@@ -516,6 +1560,15 @@ class AppServer(AsyncTask, ProcessStatus):
         # Initializing log rotation manager
         self._init_log_rotation_manager()
 
+        # Initializing the autoscaler of uwsgi workers
+        self._init_autoscaler()
+
+        # Initializing the monitor suspending the idle webapps
+        self._init_idle_monitor()
+
+        # Initializing the watchdog recycling the workers using too much memory
+        self._init_recycle_watchdog()
+
         def start_cb(service, future):
             try:
                 future.result()
@@ -527,10 +1580,12 @@ class AppServer(AsyncTask, ProcessStatus):
 
         uwsgi_task = asyncio.async(self.uwsgi.start())
         nginx_task = asyncio.async(self.nginx.start())
+        job_workers_task = asyncio.async(self.job_workers.start())
         uwsgi_task.add_done_callback(functools.partial(start_cb, "uwsgi"))
         nginx_task.add_done_callback(functools.partial(start_cb, "nginx"))
+        job_workers_task.add_done_callback(functools.partial(start_cb, "job workers"))
 
-        yield from asyncio.wait([uwsgi_task, nginx_task])
+        yield from asyncio.wait([uwsgi_task, nginx_task, job_workers_task])
 
     @asyncio.coroutine
     def stop(self):
@@ -547,10 +1602,12 @@ class AppServer(AsyncTask, ProcessStatus):
 
         uwsgi_task = asyncio.async(self.uwsgi.stop())
         nginx_task = asyncio.async(self.nginx.stop())
+        job_workers_task = asyncio.async(self.job_workers.stop())
         uwsgi_task.add_done_callback(functools.partial(stop_cb, "uwsgi"))
         nginx_task.add_done_callback(functools.partial(stop_cb, "nginx"))
+        job_workers_task.add_done_callback(functools.partial(stop_cb, "job workers"))
 
-        yield from asyncio.wait([uwsgi_task, nginx_task])
+        yield from asyncio.wait([uwsgi_task, nginx_task, job_workers_task])
 
     @asyncio.coroutine
     def restart(self):
@@ -567,15 +1624,18 @@ class AppServer(AsyncTask, ProcessStatus):
 
         uwsgi_task = asyncio.async(self.uwsgi.restart())
         nginx_task = asyncio.async(self.nginx.restart())
+        job_workers_task = asyncio.async(self.job_workers.restart())
         uwsgi_task.add_done_callback(functools.partial(restart_cb, "uwsgi"))
         nginx_task.add_done_callback(functools.partial(restart_cb, "nginx"))
+        job_workers_task.add_done_callback(functools.partial(restart_cb, "job workers"))
 
-        yield from asyncio.wait([uwsgi_task, nginx_task])
+        yield from asyncio.wait([uwsgi_task, nginx_task, job_workers_task])
 
     @asyncio.coroutine
     def wait_for_completion(self):
         self.new_async_task(self.uwsgi.wait_for_completion())
         self.new_async_task(self.nginx.wait_for_completion())
+        self.new_async_task(self.job_workers.wait_for_completion())
         yield from self.wait_for_async_task_completion()
         logger.info("BlackPearl service was shutdown")
 
@@ -591,42 +1651,156 @@ class AppServer(AsyncTask, ProcessStatus):
 
         try:
             self.reloading_code = True
-            yield from asyncio.sleep(2)
+            # Webapps modified from now on are picked by the next reload
+            webapp_folders, self.modified_webapps = self.modified_webapps, set()
             if self.__status__ == Status.STARTED:
+                # Files analysed last time, to find the files changed by the new analysis
+                analysed_files = {location: analysiscache.known_files(self._analysis_cache(location))
+                                  for location in (os.path.join(app_dir, folder) for app_dir, folder in webapp_folders)}
+                logger.info("Analysing the modified webapps <%s>" % ", ".join(
+                    os.path.join(app_dir, folder) for app_dir, folder in sorted(webapp_folders)))
                 webapps_list = yield from analyse_and_pickle_webapps(
-                    self.config['path']['lib'], os.path.join(self.config['path']['cache'], "virtenv"),
+                    self.config, self.config['path']['lib'], os.path.join(self.config['path']['cache'], "virtenv"),
                     "%s/uwsgi/pickle/" % self.config['path']['run'],
-                    *self.webapp_locations
+                    *self.webapp_locations, webapp_folders=webapp_folders
                 )
 
                 self.afm.update_watch_path(rec=True)
                 if not webapps_list:
                     logger.warn("Old code retained. Modified code not redeployed.")
                 else:
-                    modified_webapps = []
-                    for webapp in webapps_list:
-                        for modified_file in self.modified_files:
-                            if modified_file.startswith(webapp.location):
-                                modified_webapps.append(webapp)
-                    modified_webapps = set(modified_webapps)
-
-                    for webapp in webapps_list:
-                        webapp.socket = self.config['path']['run'] + "/uwsgi/%s.socket" % webapp.id
-
-                    self.nginx.generate_conf_file(webapps_list)
+                    modified_locations = [os.path.join(app_dir, folder) for app_dir, folder in webapp_folders]
+                    modified_webapps = set(webapp for webapp in webapps_list if webapp.location in modified_locations)
+
+                    previous = {w.id: (w.url_prefix, w.sockets) for w in self.uwsgi.webapps_list}
+                    assign_sockets(webapps_list, self.config['path']['run'])
+                    # Webapps whose sockets are changed (e.g. joined or left a shared pool) get their nginx
+                    # locations regenerated along with the modified webapps
+                    nginx_webapps = [w for w in webapps_list
+                                     if w in modified_webapps or previous.get(w.id) != (w.url_prefix, w.sockets)]
+
+                    # Webapps which are not yet running, suspended or served from a shared pool are reloaded
+                    # as usual
+                    deployed = [w.id for w in self.uwsgi.webapps_list]
+                    blue_green_webapps = [m_webapp for m_webapp in modified_webapps
+                                          if Uwsgi._blue_green_instance(m_webapp, m_webapp.id) and
+                                          m_webapp.id in deployed]
+
+                    # Instances whose settings are changed are restarted, as reloading the workers doesn't apply
+                    # them. Instance replaced by a blue-green candidate gets the new settings in the candidate.
+                    restart_instances = [instance_id for instance_id in
+                                         self.uwsgi.changed_instances(webapps_list, modified_webapps)
+                                         if instance_id not in [w.id for w in blue_green_webapps]]
+                    if restart_instances:
+                        logger.info("Settings of the uWsgi Services <%s> are changed. Restarting them." %
+                                    ", ".join(restart_instances))
+
+                    self.nginx.generate_conf_file(webapps_list, nginx_webapps)
                     for m_webapp in modified_webapps:
+                        changed_files = analysiscache.changed_files(
+                            analysed_files[m_webapp.location],
+                            analysiscache.known_files(self._analysis_cache(m_webapp.location)))
+                        restarted = [instance_id for instance_id, members, priority in uwsgi_instances([m_webapp])
+                                     if instance_id in restart_instances]
+                        if not restarted and self.uwsgi.hot_reload_app(m_webapp, changed_files):
+                            continue
                         logger.info("Reloading webapp <", m_webapp.name, ">")
-                        with open('%s/uwsgi/%s.reload' % (self.uwsgi.run_loc, m_webapp.id), "w") as f:
-                            f.write("reload workers")
+                        self.uwsgi.reload_app(m_webapp, skip_default=m_webapp in blue_green_webapps)
 
-                    yield from self.uwsgi.add_apps(webapps_list)
+                    yield from self.uwsgi.add_apps(webapps_list, modified_webapps, restart_instances)
+                    yield from self.job_workers.update_apps(webapps_list, modified_webapps)
                     self.nginx.reload_conf()
+                    for m_webapp in blue_green_webapps:
+                        yield from self.deploy_blue_green(m_webapp)
                     logger.info("Code updated.")
             else:
                 logger.info("Server is in <%s> state. Ignoring restart request." % self.__status__)
         finally:
             self.reloading_code = False
 
+        if self.modified_webapps and self.__status__ == Status.STARTED:
+            self.new_async_task(self.reload_code())
+
+    def _analysis_cache(self, location):
+        return analysiscache.cache_folder(os.path.join(self.config['path']['cache'], "analysis"), location)
+
+    @asyncio.coroutine
+    def deploy_blue_green(self, webapp):
+        """Deploys the new code of the webapp in a candidate instance running next to the live instance.
+
+        The candidate is tested with the testsets of the webapp (requests of the testcases reach the candidate
+        through nginx using the candidate header). If all of them pass, nginx is switched to the candidate and
+        the live instance is stopped once its in-flight requests are served. Otherwise the candidate is
+        stopped and the live instance keeps serving the old code. The live instance and the candidate run from
+        their own snapshot of the sources, so the live instance never imports the new code. Returns True if the
+        candidate is promoted."""
+        logger.info("Deploying webapp <%s> in a candidate instance" % webapp.name)
+        # Only the testcases of the candidate know the secret, so that the clients can't reach the candidate
+        secret = binascii.hexlify(os.urandom(16)).decode()
+        prefix = webapp.url_prefix if len(webapp.url_prefix) > 1 else ""
+        try:
+            candidate_socket = self.uwsgi.start_candidate(webapp, secret)
+            deadline = time.time() + CANDIDATE_READY_TIMEOUT
+            while True:
+                try:
+                    status, content = yield from asyncio.wait_for(
+                        uwsgictl.request(candidate_socket, prefix + "/__application__"), CANDIDATE_READY_TIMEOUT)
+                except (OSError, asyncio.TimeoutError):
+                    status = None
+                if status == 200:
+                    break
+                if time.time() > deadline:
+                    raise CandidateFailedError("Candidate is not ready after <%s> seconds" % CANDIDATE_READY_TIMEOUT)
+                yield from asyncio.sleep(1)
+            logger.info("Candidate of webapp <%s> is ready" % webapp.name)
+
+            self.nginx.candidates[webapp.url_prefix] = (candidate_socket, secret)
+            self.nginx.generate_conf_file(self.uwsgi.webapps_list, [webapp])
+            self.nginx.reload_conf()
+            yield from asyncio.sleep(NGINX_RELOAD_GRACE)
+
+            failed = []
+            for url in webapp.testsets:
+                try:
+                    status, content = yield from asyncio.wait_for(
+                        uwsgictl.request(candidate_socket, prefix + "/__test_run_all__", {"url": url}),
+                        CANDIDATE_TEST_TIMEOUT)
+                    passed = status == 200 and json.loads(content.decode('UTF-8'))["status"] == 0
+                except (OSError, ValueError, KeyError, asyncio.TimeoutError):
+                    passed = False
+                if not passed:
+                    failed.append(url)
+            if failed:
+                raise CandidateFailedError("Testsets of the webmodules <%s> failed" % ", ".join(failed))
+            logger.info("Testsets of <%s> webmodules passed in the candidate of webapp <%s>" % (
+                len(webapp.testsets), webapp.name))
+
+            del self.nginx.candidates[webapp.url_prefix]
+            # Atomic switch: new requests are sent to the candidate once nginx is reloaded
+            webapp.socket = candidate_socket
+            self.nginx.generate_conf_file(self.uwsgi.webapps_list, [webapp])
+            self.nginx.reload_conf()
+            yield from asyncio.sleep(NGINX_RELOAD_GRACE)
+            yield from self.uwsgi.promote_candidate(webapp, DRAIN_TIMEOUT)
+        except Exception as e:
+            logger.error("Deployment of webapp <%s> failed. Reason: %s. Rolling back, the running instance keeps "
+                         "serving the old code" % (webapp.name, e))
+            self.nginx.candidates.pop(webapp.url_prefix, None)
+            webapp.socket = webapp.sockets[webapp.id]
+            self.nginx.generate_conf_file(self.uwsgi.webapps_list, [webapp])
+            self.nginx.reload_conf()
+            yield from self.uwsgi.discard_candidate(webapp)
+            return False
+
+        # Candidate serves from the socket of the instance now. Its own socket is removed once nginx stops using it.
+        webapp.socket = webapp.sockets[webapp.id]
+        self.nginx.generate_conf_file(self.uwsgi.webapps_list, [webapp])
+        self.nginx.reload_conf()
+        yield from asyncio.sleep(NGINX_RELOAD_GRACE)
+        self.uwsgi.remove_candidate_files(webapp)
+        logger.info("Webapp <%s> switched to the new code" % webapp.name)
+        return True
+
     def _service_status_update_cb(self, service, status):
         other_service = 'uwsgi' if service == "nginx" else "nginx"
 
@@ -671,20 +1845,38 @@ class AppServer(AsyncTask, ProcessStatus):
                 self.__set_status__(Status.STARTED)
                 logger.info("Services restarted.")
             elif self.__status__ != Status.STARTED:
+                self._record_spawn(service)
                 self.__set_status__(Status.STARTED)
                 logger.info("Services started up")
+                self._write_boot_timeline()
 
         elif status == process.Status.STARTED:
             logger.info("Service <%s> started up." % service)
+            if self.__status__ == Status.NOTSTARTED:
+                self._record_spawn(service)
 
         return True
 
+    def _record_spawn(self, service):
+        self.timeline.add("spawn/%s" % service.strip(), self._spawn_started, time.time())
+
+    def _write_boot_timeline(self):
+        """Writes the timeline of the boot, from the start of blackpearl.py until the services are started"""
+        self.timeline.add("spawn", self._spawn_started, time.time())
+        try:
+            self.timeline.write(os.path.join(self.config['path']['run'], "boot.json"))
+        except OSError as e:
+            logger.warn("Failed to write the boot timeline. Reason: %s" % e)
+
     def _code_update_cb(self, event):
-        if os.path.isdir(event.pathname) or event.pathname.endswith(".py"):
-            logger.info("File<%s> modified." % event.pathname)
-            self.modified_files.append(event.pathname)
-            if not self.reloading_code:
-                self.new_async_task(self.reload_code())
+        self.change_detector.file_changed(event.pathname, event.dir)
+
+    def _code_changed(self, webapp_folders):
+        logger.info("Code of the webapps <%s> modified." % ", ".join(
+            os.path.join(app_dir, folder) for app_dir, folder in sorted(webapp_folders)))
+        self.modified_webapps.update(webapp_folders)
+        if not self.reloading_code:
+            self.new_async_task(self.reload_code())
 
 
 def daemonize(log_level, log_formatter, max_log_size, max_log_files, log_folder, wd="/", umask=0):
@@ -737,15 +1929,18 @@ def daemonize(log_level, log_formatter, max_log_size, max_log_files, log_folder,
         os.dup2(w.fileno(), 2)
 
 
-def start(config, daemon=False):
+def start(config, daemon=False, timeline=None):
     ch.setLevel(config['logging']['level'])
     logger.setLevel(config['logging']['level'])
+    if timeline is None:
+        timeline = Timeline()
 
     logger.info("Performing prechecks .... ")
 
     path = config['path']
     try:
-        prechecks.check_all()
+        with timeline.span("prechecks"):
+            prechecks.check_all()
     except Exception as e:
         logger.critical("Prechecks .... [Failed]")
         logger.critical("%s" % str(e))
@@ -768,7 +1963,7 @@ def start(config, daemon=False):
             f.write(str(os.getpid()))
 
         ev_loop = asyncio.get_event_loop()
-        app_server = AppServer()
+        app_server = AppServer(timeline)
 
         initialize_task = asyncio.async(app_server.initialize_environment(config))
 
@@ -801,5 +1996,9 @@ class CodeReloadInProgressError(Exception):
     pass
 
 
+class CandidateFailedError(Exception):
+    pass
+
+
 class ConfReloadInProgressError(Exception):
     pass
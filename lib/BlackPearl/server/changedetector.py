@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+# This file is part of BlackPearl.
+
+# BlackPearl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BlackPearl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
+
+# Detection of the code changes of the deployed webapps. The file events reported by inotify are collected until
+# no event is received for QUIET_PERIOD seconds, so that an editor saving several files (or the same file several
+# times) causes a single reload. Files having the same content as when the webapp was last analysed are ignored.
+
+import os
+import hashlib
+import logging
+
+from BlackPearl.server import analysiscache
+
+logger = logging.getLogger(__name__)
+
+# Seconds without any file event after which the changes are reported
+QUIET_PERIOD = 1.0
+# Seconds after the first file event by which the changes are reported, even if the files are still being written
+MAX_DELAY = 10.0
+
+# Files of the webapp, other than the python sources, which change the analysis result of the webapp
+_WEBAPP_FILES = ("config.yaml", "requirements.txt")
+_IGNORED_FOLDERS = ("__pycache__",)
+
+
+def _sha1(file_path):
+    """Returns the sha1 of the content of the file, or None if the file doesn't exist anymore"""
+    sha1 = hashlib.sha1()
+    try:
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(65536), b""):
+                sha1.update(block)
+    except OSError:
+        return None
+    return sha1.hexdigest()
+
+
+class ChangeDetector:
+    def __init__(self, webapp_locations, analysis_folder, callback, loop):
+        self.webapp_locations = webapp_locations
+        self.analysis_folder = analysis_folder
+        # Called with the set of (app dir, webapp folder) of the changed webapps
+        self.callback = callback
+        self.loop = loop
+        # (app dir, webapp folder) -> {path of the changed file or folder: True if it is a folder}
+        self._pending = {}
+        self._first_event = None
+        self._timer = None
+
+    def _webapp(self, path, is_dir):
+        """Returns the (app dir, webapp folder) of the webapp to which the changed path belongs, or None if the
+        change doesn't affect any webapp"""
+        for app_dir in self.webapp_locations:
+            relative = os.path.relpath(path, app_dir)
+            if relative == os.curdir or relative.startswith(os.pardir):
+                continue
+            parts = relative.split(os.sep)
+            if any(part in _IGNORED_FOLDERS for part in parts):
+                return None
+            if len(parts) == 1:
+                # Webapp folder itself is deployed or removed
+                return (app_dir, parts[0]) if is_dir else None
+            if is_dir or parts[-1].endswith(".py") or (len(parts) == 2 and parts[1] in _WEBAPP_FILES):
+                return app_dir, parts[0]
+            return None
+        return None
+
+    def file_changed(self, path, is_dir):
+        """Records the change of the file (or folder) reported by inotify"""
+        webapp = self._webapp(path, is_dir)
+        if not webapp:
+            return
+        self._pending.setdefault(webapp, {})[path] = is_dir
+
+        now = self.loop.time()
+        if self._first_event is None:
+            self._first_event = now
+        if self._timer:
+            self._timer.cancel()
+        self._timer = self.loop.call_at(min(now + QUIET_PERIOD, self._first_event + MAX_DELAY), self._report)
+
+    def _changed(self, webapp, paths):
+        """Returns True if any of the paths is changed since the last analysis of the webapp"""
+        known_files = analysiscache.known_files(
+            analysiscache.cache_folder(self.analysis_folder, os.path.join(*webapp)))
+        for path, is_dir in paths.items():
+            if is_dir:
+                return True
+            known = known_files.get(path)
+            if _sha1(path) != (known[2] if known else None):
+                return True
+            logger.info("Content of file <%s> is not changed since the last analysis. Ignoring." % path)
+        return False
+
+    def _report(self):
+        self._timer = None
+        self._first_event = None
+        pending, self._pending = self._pending, {}
+        changed = set(webapp for webapp, paths in pending.items() if self._changed(webapp, paths))
+        if changed:
+            self.callback(changed)
@@ -123,7 +123,7 @@ class ProcessStatus:
 
 class Process(ProcessStatus, AsyncTask):
 
-    def __init__(self, name, command, env=None, stdin=None, stdout=sys.stdout, stderr=sys.stderr):
+    def __init__(self, name, command, env=None, stdin=None, stdout=sys.stdout, stderr=sys.stderr, pass_fds=()):
         ProcessStatus.__init__(self, process_name=name)
         AsyncTask.__init__(self)
         self.name = name
@@ -133,6 +133,8 @@ class Process(ProcessStatus, AsyncTask):
 
         self.stdout = stdout
         self.stderr = stderr
+        # File descriptors (eg. listening sockets) inherited by the process
+        self.pass_fds = pass_fds
         if stdin:
             self.stdin = stdin
         else:
@@ -189,7 +191,7 @@ class Process(ProcessStatus, AsyncTask):
             self.process = yield from asyncio.create_subprocess_exec(
                 *self.command, stdin=null_device,
                 stdout=self.stdout, stderr=self.stderr,
-                env=self.env
+                env=self.env, pass_fds=self.pass_fds
             )
 
             self.new_async_task(wait_for_return_code())
@@ -323,17 +325,28 @@ class ProcessGroup(AsyncTask, ProcessStatus):
         self.processes = {}
         self.status_listener_cb = None
 
-    def add_process(self, name, command, env=None, stdin=None, stdout=sys.stdout, stderr=sys.stderr):
+    def add_process(self, name, command, env=None, stdin=None, stdout=sys.stdout, stderr=sys.stderr, pass_fds=(),
+                    optional=False):
+        """Adds the process to the group. The whole group is stopped when a process of the group stops, unless
+        the process is added as optional (e.g. the candidate instance of a blue-green deployment)."""
         if name in self.processes:
             raise ValueError("The process with name <%s> is already added to the ProcessGroup<%s>" % (name, self.name))
 
         def set_process_status(status):
-            if name in self.processes:
-                self.processes[name]["status"] = status
+            # Looked up by the process, as the process could have been renamed after it is added
+            names = [n for n, p in self.processes.items() if p["process"] is process]
+            if names:
+                self.processes[names[0]]["status"] = status
             else:
                 return
 
-            if status in (Status.STOPPED, Status.TERMINATED, Status.STARTFAILED):
+            if status in (Status.STOPPED, Status.TERMINATED, Status.STARTFAILED) and \
+                    self.processes[names[0]]["optional"] and self.__status__ != Status.STOPPING:
+                logger.warn("Process <%s> of the ProcessGroup<%s> stopped. Removing it from the group" % (
+                    names[0], self.name))
+                del self.processes[names[0]]
+
+            elif status in (Status.STOPPED, Status.TERMINATED, Status.STARTFAILED):
                 if self.__status__ != Status.STOPPING:
                     logger.warn("Stopping all the process in the ProcessGroup<%s>" % self.name)
                     self.new_async_task(self.stop())
@@ -355,17 +368,30 @@ class ProcessGroup(AsyncTask, ProcessStatus):
                     self.__set_status__(Status.STARTED)
             # elif status == Status.STOPPED:
 
-        process = Process(name, command, env, stdin, stdout, stderr)
+        process = Process(name, command, env, stdin, stdout, stderr, pass_fds)
         process.add_status_listener(set_process_status)
         self.processes[name] = {
             "process": process,
-            "status": process.status
+            "status": process.status,
+            "optional": optional
         }
 
         if self.__status__ != Status.NOTSTARTED:
             # TODO: what if the server is currently stopping ?
             self.new_async_task(process.start())
 
+    def rename_process(self, name, new_name):
+        """Renames the process without restarting it"""
+        if new_name in self.processes:
+            raise ValueError("The process with name <%s> is already added to the ProcessGroup<%s>" % (
+                new_name, self.name))
+        try:
+            self.processes[new_name] = self.processes.pop(name)
+        except KeyError:
+            raise ValueError("The process<%s> is not added to the "
+                             "ProcessGroup<%s>" % (name, self.name)) from None
+        self.processes[new_name]["process"].name = new_name
+
     @asyncio.coroutine
     def remove_process(self, name):
         try:
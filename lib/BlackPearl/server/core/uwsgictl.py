@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# This file is part of BlackPearl.
+
+# BlackPearl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BlackPearl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import struct
+import asyncio
+import logging
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+# Commands accepted by the uwsgi master fifo
+ADD_WORKER = b"+"
+REMOVE_WORKER = b"-"
+
+
+@asyncio.coroutine
+def read_stats(stats_socket):
+    """Reads the stats of the uwsgi instance from its stats server (unix socket).
+
+    Raises OSError if the instance is not running and ValueError if the stats are not readable."""
+    reader, writer = yield from asyncio.open_unix_connection(stats_socket)
+    try:
+        data = yield from reader.read()
+    finally:
+        writer.close()
+    return json.loads(data.decode('UTF-8'))
+
+
+def send_command(master_fifo, command):
+    """Writes the command to the master fifo of the uwsgi instance.
+
+    Raises OSError if the instance is not running (nobody reading the fifo)."""
+    fd = os.open(master_fifo, os.O_WRONLY | os.O_NONBLOCK)
+    try:
+        os.write(fd, command)
+    finally:
+        os.close(fd)
+
+
+def worker_summary(stats):
+    """Returns (active workers, busy workers, listen queue) from the uwsgi stats.
+    Workers stopped by the cheaper subsystem are not counted as active."""
+    workers = [worker for worker in stats.get('workers', []) if worker.get('status') != 'cheap']
+    busy = len([worker for worker in workers if worker.get('status') == 'busy'])
+    return len(workers), busy, stats.get('listen_queue', 0)
+
+
+@asyncio.coroutine
+def request(uwsgi_socket, path, form=None):
+    """POSTs the form to the path directly to the uwsgi instance (using the uwsgi protocol), bypassing nginx.
+
+    Returns a tuple of (HTTP status code, response body). Raises OSError if the instance is not reachable."""
+    body = urllib.parse.urlencode(form or {}).encode('UTF-8')
+    variables = {
+        "REQUEST_METHOD": "POST",
+        "PATH_INFO": path,
+        "REQUEST_URI": path,
+        "QUERY_STRING": "",
+        "SCRIPT_NAME": "",
+        "SERVER_PROTOCOL": "HTTP/1.0",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "REMOTE_ADDR": "127.0.0.1",
+        "CONTENT_TYPE": "application/x-www-form-urlencoded",
+        "CONTENT_LENGTH": str(len(body))
+    }
+    packet = b""
+    for key, value in variables.items():
+        key, value = key.encode('UTF-8'), value.encode('UTF-8')
+        packet += struct.pack("<H", len(key)) + key + struct.pack("<H", len(value)) + value
+
+    reader, writer = yield from asyncio.open_unix_connection(uwsgi_socket)
+    try:
+        # uwsgi packet header: modifier1 (0 for WSGI), size of the variables and modifier2
+        writer.write(struct.pack("<BHB", 0, len(packet), 0) + packet + body)
+        response = yield from reader.read()
+    finally:
+        writer.close()
+
+    head, _, content = response.partition(b"\r\n\r\n")
+    try:
+        status = int(head.split(b" ", 2)[1])
+    except (IndexError, ValueError):
+        raise OSError("Invalid response from the uwsgi instance: %r" % head[:100]) from None
+    return status, content
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# This file is part of BlackPearl.
+
+# BlackPearl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BlackPearl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import json
+import time
+import signal
+import traceback
+import logging
+
+logger = logging.getLogger()
+
+
+def execute(webapp, job):
+    """Executes the job and returns a tuple of (result, error)"""
+    from BlackPearl.core.exceptions import RequestInvalid, UnSuccessfulException
+
+    try:
+        module = webapp.webmodules[job['url']]
+    except KeyError:
+        return None, {
+            "status": -202,
+            "desc": "The webmodule <%s> is not available anymore" % job['url']
+        }
+
+    try:
+        result = module['func'](job['session'], job['arguments'])
+    except RequestInvalid as ri:
+        return None, {
+            "status": -202,
+            "desc": str(ri)
+        }
+    except UnSuccessfulException as e:
+        return None, {
+            "status": -203,
+            "desc": e.desc,
+            "data": e.data
+        }
+    except Exception:
+        return None, {
+            "status": -299,
+            "desc": traceback.format_exc()
+        }
+
+    try:
+        json.dumps(result)
+    except:
+        return None, {
+            "status": -401,
+            "desc": "Error in serializing the return data from module. Return value <%s>" % (str(result))
+        }
+
+    return result, None
+
+
+def _stop(signum, frame):
+    # Stopped by the server (SIGTERM). Handled as SIGINT, so that the job in progress is requeued.
+    raise KeyboardInterrupt()
+
+
+def run(poll_interval):
+    from BlackPearl import application
+
+    application.initialize_job_worker()
+    webapp = application.webapp
+    queue = application.job_queue
+    logger.info("Job worker started for webapp <%s>" % webapp.name)
+
+    while True:
+        job = queue.claim(webapp.id)
+        if not job:
+            queue.purge()
+            time.sleep(poll_interval)
+            continue
+
+        logger.info("Executing job <%s> of webmodule <%s>" % (job['id'], job['url']))
+        try:
+            result, error = execute(webapp, job)
+        except KeyboardInterrupt:
+            # Worker is getting stopped. The job will be picked by an other worker.
+            queue.requeue(job['id'])
+            raise
+
+        if error:
+            logger.error("Job <%s> failed. Error: %s" % (job['id'], error['desc']))
+            queue.fail(job['id'], error)
+        else:
+            logger.info("Job <%s> completed" % job['id'])
+            queue.complete(job['id'], result)
+
+
+def main():
+    poll_interval = float(sys.argv[1])
+    log_level = int(sys.argv[2])
+    log_format = sys.argv[3]
+
+    logger.setLevel(log_level)
+    ch = logging.StreamHandler()
+    ch.setLevel(log_level)
+    ch.setFormatter(logging.Formatter(log_format))
+    logger.addHandler(ch)
+
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        run(poll_interval)
+    except KeyboardInterrupt:
+        logger.info("Job worker stopped")
+
+
+if __name__ == "__main__":
+    main()
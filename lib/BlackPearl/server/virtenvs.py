@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# This file is part of BlackPearl.
+
+# BlackPearl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BlackPearl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
+
+# Virtualenvs of the webapps are cloned from a base virtualenv having the packages required by BlackPearl,
+# instead of creating and populating each of them from scratch. Files of the clone are hard links to the files
+# of the base virtualenv, so the clones share the disk blocks and the page cache.
+
+import os
+import sys
+import shutil
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Folder of the base virtualenv in the virtualenv folder
+BASE_VIRTENV = "__base__"
+
+# Written in the base virtualenv once it is ready to be cloned
+_READY_FILE = ".blackpearl_base_ready"
+
+
+def base_path(virtenv_folder):
+    return os.path.join(virtenv_folder, BASE_VIRTENV)
+
+
+def is_ready(base):
+    """Returns True if the base virtualenv is created (and its packages installed) by the running python"""
+    try:
+        with open(os.path.join(base, _READY_FILE)) as f:
+            return f.read() == sys.version
+    except OSError:
+        return False
+
+
+def mark_ready(base):
+    with open(os.path.join(base, _READY_FILE), "w") as f:
+        f.write(sys.version)
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Different file system
+        shutil.copy2(src, dst)
+
+
+def _relocated(path, base, target):
+    """Returns the content of the file with the paths of the base virtualenv replaced with the target
+    virtualenv, or None if the file doesn't refer to the base virtualenv"""
+    with open(path, "rb") as f:
+        content = f.read()
+    base_bytes = base.encode(sys.getfilesystemencoding())
+    if base_bytes not in content:
+        return None
+    return content.replace(base_bytes, target.encode(sys.getfilesystemencoding()))
+
+
+def clone(base, target):
+    """Creates the virtualenv at target as a clone of the base virtualenv.
+
+    Files are hard linked (copied if the target is in a different file system). Scripts and activation files
+    in the bin folder referring to the base virtualenv (shebang lines, VIRTUAL_ENV) are rewritten for the
+    target instead of being linked."""
+    base = os.path.abspath(base)
+    target = os.path.abspath(target)
+    # Cloned into a temporary folder and renamed, so that a partial clone is never used
+    work = target + ".clone"
+    if os.access(work, os.F_OK):
+        shutil.rmtree(work)
+
+    for path, dirs, files in os.walk(base):
+        relative = os.path.relpath(path, base)
+        dest_dir = os.path.normpath(os.path.join(work, relative))
+        os.makedirs(dest_dir, exist_ok=True)
+
+        for name in list(dirs):
+            if os.path.islink(os.path.join(path, name)):
+                # Symbolic links to the directories are not followed by os.walk. Copied as links.
+                os.symlink(os.readlink(os.path.join(path, name)), os.path.join(dest_dir, name))
+
+        for name in files:
+            src = os.path.join(path, name)
+            dst = os.path.join(dest_dir, name)
+            if relative == os.curdir and name == _READY_FILE:
+                continue
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+                continue
+            content = _relocated(src, base, target) if relative in (os.curdir, "bin") else None
+            if content is None:
+                _link_or_copy(src, dst)
+            else:
+                with open(dst, "wb") as f:
+                    f.write(content)
+                shutil.copymode(src, dst)
+
+    os.rename(work, target)
@@ -16,6 +16,7 @@
 # along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
 import json
 import inspect
 import traceback
@@ -30,7 +31,13 @@ __all__ = ['testset', 'testcase', 'test', 'TestcaseFailed',
            'InvalidTestcaseInvoke', 'ErrorInvokingWebModule',
            'TestcaseFailed', 'TestcaseError']
 
-listen = "localhost:8080"
+# Read from the environment of the worker, as this module is imported only when the testsets are run
+listen = os.environ.get("BLACKPEARL_LISTEN", "localhost:8080")
+# Set in the candidate instance of a blue-green deployment. Requests of the testcases are sent with the
+# secret of the deployment in the candidate header, so that nginx routes them to the candidate instead of
+# the live instance.
+candidate = os.environ.get("BLACKPEARL_CANDIDATE") == "1"
+candidate_secret = os.environ.get("BLACKPEARL_CANDIDATE_SECRET")
 
 
 class TestsetInvoker:
@@ -44,6 +51,8 @@ class TestsetInvoker:
         caller = self.__call__
         webmodule = self.webmodule
         opener = requests.Session()
+        if candidate:
+            opener.headers['X-BlackPearl-Candidate'] = candidate_secret
 
         testset_outs = ['[%s] %s' % (strftime("%Y-%m-%d %H:%M:%S"), "Invoking the Testset<%s>" % self.name)]
 
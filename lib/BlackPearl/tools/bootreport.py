@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# This file is part of BlackPearl.
+
+# BlackPearl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BlackPearl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from BlackPearl.common import timeline
+
+# Width of the waterfall bars (in characters) for the whole boot
+WIDTH = 50
+
+# Seconds by which a span can start before the previous span on the critical path ends (timer resolution)
+TOLERANCE = 0.01
+
+
+def _parent(span, names):
+    """Returns the name of the parent span, or None if the span is at the top level"""
+    parent = span["name"].rpartition("/")[0]
+    while parent and parent not in names:
+        parent = parent.rpartition("/")[0]
+    return parent or None
+
+
+def _children(spans, names, parent):
+    return sorted([span for span in spans if _parent(span, names) == parent], key=lambda span: span["start"])
+
+
+def _tree(spans, names, parent=None, depth=0):
+    """Returns the list of (depth, span) with the nested spans listed under their parent"""
+    ordered = []
+    for span in _children(spans, names, parent):
+        ordered.append((depth, span))
+        ordered.extend(_tree(spans, names, span["name"], depth + 1))
+    return ordered
+
+
+def _critical_path(spans, names, parent=None, depth=0):
+    """Returns the list of (depth, span) on the critical path. Among the spans of the same parent, the critical
+    path ends with the span ending last, preceded by the span ending last before it started, and so on. The
+    critical path is followed into the nested spans of each span on it."""
+    children = _children(spans, names, parent)
+    path = []
+    current = max(children, key=lambda span: span["end"]) if children else None
+    while current:
+        path.insert(0, current)
+        before = [span for span in children
+                  if span["end"] <= current["start"] + TOLERANCE and span["start"] < current["start"]]
+        current = max(before, key=lambda span: span["end"]) if before else None
+
+    critical = []
+    for span in path:
+        critical.append((depth, span))
+        critical.extend(_critical_path(spans, names, span["name"], depth + 1))
+    return critical
+
+
+def _bar(span, started, total):
+    offset = int((span["start"] - started) / total * WIDTH)
+    length = max(int((span["end"] - span["start"]) / total * WIDTH), 1)
+    return " " * offset + "#" * length
+
+
+def invoke(config):
+    """Prints the waterfall of the steps of the last boot of the server, and its critical path"""
+    boot_file = os.path.join(config['path']['run'], "boot.json")
+    try:
+        boot = timeline.load(boot_file)
+    except (OSError, ValueError, KeyError):
+        print("Boot timeline not found. It is written to <%s> once the BlackPearl services are started." % boot_file)
+        return
+
+    spans = boot.spans
+    names = set(span["name"] for span in spans)
+    total = max([span["end"] for span in spans] + [boot.started + 0.001]) - boot.started
+    print("Boot took %.3f seconds, from the start of blackpearl.py until the services are started\n" % total)
+
+    row = "{:<48} {:>9} {:>9}  {}"
+    print(row.format("Step", "Start", "Duration", "Waterfall"))
+    for depth, span in _tree(spans, names):
+        print(row.format("  " * depth + span["name"].rpartition("/")[2], "%.3fs" % (span["start"] - boot.started),
+                         "%.3fs" % (span["end"] - span["start"]), _bar(span, boot.started, total)))
+
+    print("\nCritical path")
+    row = "{:<48} {:>9} {:>6}"
+    for depth, span in _critical_path(spans, names):
+        duration = span["end"] - span["start"]
+        print(row.format("  " * depth + span["name"].rpartition("/")[2], "%.3fs" % duration,
+                         "%.0f%%" % (duration * 100 / total)))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# This file is part of BlackPearl.
+
+# BlackPearl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BlackPearl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import asyncio
+
+from BlackPearl.common import meminfo
+from BlackPearl.server.core import uwsgictl
+
+
+def _instances(run_loc):
+    """Returns the ids of the uwsgi instances having the stats socket"""
+    uwsgi_run = os.path.join(run_loc, "uwsgi")
+    return sorted(name[:-len(".stats")] for name in os.listdir(uwsgi_run) if name.endswith(".stats"))
+
+
+def _worker_pids(run_loc, instance_id):
+    stats = asyncio.get_event_loop().run_until_complete(
+        uwsgictl.read_stats(os.path.join(run_loc, "uwsgi", "%s.stats" % instance_id)))
+    return [worker['pid'] for worker in stats.get('workers', []) if worker.get('pid')]
+
+
+def invoke(config):
+    """Prints the private and shared memory of the uwsgi workers of each webapp.
+
+    Pages shared copy-on-write with the master (preload mode) are counted as shared. PSS splits the
+    shared pages among the processes sharing them, so the sum of PSS is the actual memory used."""
+    run_loc = config['path']['run']
+    if not os.access(os.path.join(run_loc, "uwsgi"), os.F_OK):
+        print("BlackPearl service is not running.")
+        return
+
+    row = "{:<12} {:>8} {:>12} {:>12} {:>12} {:>12}"
+    for instance_id in _instances(run_loc):
+        try:
+            pids = _worker_pids(run_loc, instance_id)
+        except (OSError, ValueError) as e:
+            print("uWsgi Service <%s> is not running. Reason: %s\n" % (instance_id, e))
+            continue
+
+        print("uWsgi Service <%s>" % instance_id)
+        print(row.format("Process", "PID", "RSS", "Private", "Shared", "PSS"))
+        processes = []
+        try:
+            with open(os.path.join(run_loc, "uwsgi", "%s.pid" % instance_id)) as f:
+                processes.append(("master", int(f.read().strip())))
+        except (OSError, ValueError):
+            pass
+        processes += [("worker %s" % (i + 1), pid) for i, pid in enumerate(pids)]
+
+        total = {"rss": 0, "pss": 0, "private": 0, "shared": 0}
+        for name, pid in processes:
+            try:
+                usage = meminfo.smaps(pid)
+            except OSError:
+                continue
+            for key in total:
+                total[key] += usage[key]
+            print(row.format(name, pid, meminfo.to_mb(usage['rss']), meminfo.to_mb(usage['private']),
+                             meminfo.to_mb(usage['shared']), meminfo.to_mb(usage['pss'])))
+
+        print(row.format("total", "", meminfo.to_mb(total['rss']), meminfo.to_mb(total['private']),
+                         meminfo.to_mb(total['shared']), meminfo.to_mb(total['pss'])))
+        # Without sharing, each process would have used its full RSS
+        print("Memory saved by sharing: %s\n" % meminfo.to_mb(total['rss'] - total['pss']))
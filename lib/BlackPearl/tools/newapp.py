@@ -117,12 +117,145 @@ posthandlers : []
 #
 # Note: Posthandlers list defined here is for specifying the order of execution only. The python function must be
 #       decorated with @posthandler to define it as posthandler
+
+# cpu_bound_processes : 4
+
+# Description: Number of processes used for executing the web modules decorated with @cpu_bound, for each uwsgi
+#              instance of the webapp.
+# Optional: Yes (if not specified: The number of CPU cores will be used)
+#
+# Note: The process pool is created in each uwsgi worker of the webapp only if it has a @cpu_bound web module.
+#       The processes are split among the workers (each worker gets processes / workers, at least 1). A pool
+#       process which dies is replaced, and the request it was running gets the status -204.
+
+# priority_classes :
+#     interactive : 4
+#     bulk : 1
+
+# Description: Number of uwsgi workers for each priority class of the web modules.
+# Optional: Yes (if not specified: The number of CPU cores will be used for each class)
+#
+# Note: Web modules are assigned to a priority class using @priority decorator (eg. @priority("bulk")). Web modules
+#       without @priority belongs to the "interactive" class. Each priority class is served by its own uwsgi socket
+#       and worker pool, so that the slow web modules doesn't add latency to the others.
+
+# performance :
+#     processes : 4
+#     threads : 1
+#     listen : 100
+#     buffer_size : 32768
+#     max_requests : 5000
+#     harakiri : 60
+
+# Description: uwsgi tuning of the webapp.
+#       processes - Number of uwsgi workers (default: number of CPU cores).
+#       threads - Number of threads in each uwsgi worker (default: 1).
+#       listen - Size of the uwsgi listen queue (backlog) of the webapp (default: 100).
+#       buffer_size - Maximum size of the request headers in bytes (default: 32768).
+#       max_requests - Worker is recycled after serving the given number of requests (default: never).
+#       harakiri - Worker is killed if a request takes more than the given seconds (default: never).
+# Optional: Yes (if not specified: uwsgi_options in server configuration or the defaults are used)
+#
+# Note:
+#       1. listen queue size can't be greater than the system limit (net.core.somaxconn).
+#       2. processes is overridden by the worker count of the priority class, if configured in priority_classes.
+
+# recycle :
+#     max_rss : 512
+#     max_requests : 10000
+
+# Description: uwsgi workers of the webapp are recycled by the server when they cross the limits.
+#       max_rss - Worker is recycled when its resident memory goes above the given MB.
+#       max_requests - Worker is recycled after serving the given number of requests.
+# Optional: Yes (if not specified: workers are not recycled by the server)
+#
+# Note: Recycled worker finishes its in-flight request before exiting and only one worker is recycled at a time.
+#       Recycling is logged along with the RSS of the worker, which helps in finding memory leaks.
+#       Unlike max_requests under performance section, the workers don't get recycled all at once.
+
+# autoscale :
+#     min_workers : 1
+#     max_workers : 8
+
+# Description: uwsgi workers of the webapp are grown and shrunk between min_workers and max_workers based on the
+#              busy workers and the listen queue. The thresholds are set in autoscale section of server configuration.
+# Optional: Yes (if not specified: the worker count is fixed)
+#
+# Note: When enabled, max_workers overrides processes and the worker count of the priority classes.
+
+# idle_timeout : 600
+
+# Description: uwsgi processes of the webapp are stopped after it has not served any request for the given seconds.
+#              The socket of the webapp is kept open by the server and the processes are started again on the next
+#              request, so an idle webapp does not use any memory.
+# Optional: Yes (if not specified: the uwsgi processes of the webapp are always running)
+#
+# Note: First request after the idle_timeout waits for the webapp to get initialized.
+
+# preload : true
+
+# Description: Webapp is initialized once in the uwsgi master and the workers are forked from it, instead of each
+#              worker initializing the webapp on its own. The memory of the initialized webapp stays shared between
+#              the workers (copy-on-write). Use "blackpearl.py memory-report" to check the private and shared memory
+#              of the workers.
+# Optional: Yes (if not specified: false)
+#
+# Note: Code changes reload the whole uwsgi instance of the webapp, instead of only its workers.
+
+# warmup_hook : handlers.warmup
+
+# Description: Function (<module>.<function>) called without arguments after the webapp is initialized in the
+#              uwsgi worker, to load caches, open connections etc. Worker accepts requests only after it returns.
+# Optional: Yes (if not specified: no warm-up)
+#
+# Note:
+#       1. On code change, the workers are reloaded one at a time. The next worker is reloaded only after the new
+#          worker has run the warm-up hook, so the webapp keeps serving with all but one of its workers.
+#       2. Functions of the handlers can also be decorated with @on_worker_start (called without arguments when
+#          the worker starts) and @warmup (called after them with call(url, **parameters), which calls the
+#          webmodule in-process). warmup_hook is called after the @warmup hooks. Time taken by each of them is
+#          logged in the uwsgi log.
+
+# blue_green : true
+
+# Description: On code change, the new code is started in a candidate uwsgi instance next to the running one.
+#              Testsets of the webapp are run against the candidate. If all of them pass, nginx is switched to
+#              the candidate and the old instance is stopped after serving its in-flight requests. Otherwise the
+#              candidate is stopped and the old instance keeps serving.
+# Optional: Yes (if not specified: false)
+#
+# Note: Not used for the webapps with idle_timeout or served from a shared pool. Webmodules of the other priority
+#       classes are reloaded as usual.
+
+# pool : shared
+
+# Description: Webapps configured with the same pool are loaded into a single uwsgi worker pool, instead of each
+#              webapp having its own processes with its own interpreter. It saves the memory of the interpreter
+#              and BlackPearl per webapp. The saving is reported in the uwsgi log of the pool.
+# Optional: Yes (if not specified: the webapp is served by its own processes)
+#
+# Note:
+#       1. Webapps of a pool share the virtualenv. So, their requirements should not conflict.
+#       2. Webapp is served by its own processes, if its modules (in src/api, lib and test) have the same name as
+#          the modules of the other webapps in the pool.
+#       3. uwsgi tuning (performance, autoscale and idle_timeout) of the pool is taken from the first webapp of the pool
+#          (by url_prefix).
+
+# overload :
+#     max_queue_wait : 2.0
+
+# Description: Overload protection of the webapp.
+#       max_queue_wait - Requests waited in the listen queue for more than the given seconds are rejected with
+#                        503 status without processing them, as the client would have most likely given up already.
+# Optional: Yes (if not specified: requests are never rejected)
+#
+# Note: Use @ratelimit decorator to limit the request rate of a web module (eg. @ratelimit(10, per="session")).
 """
 
 handlers_file = """#!/usr/bin/env python
 
 from BlackPearl.core import datatype
-from BlackPearl.core.decorators import weblocation
+from BlackPearl.core.decorators import weblocation, warmup
 
 
 @weblocation("helloworld")
@@ -146,6 +279,12 @@ def simple_calculator(operation: datatype.Options("add", "sub", "mul", "div"),
         return value1 * value2
     else:
         return value1 / value2
+
+
+@warmup
+def warmup_calculator(call):
+    # Called in each worker before it accepts requests, so that the first requests don't pay for the warm-up
+    call("/calculator", operation="add", value1=1, value2=2)
 """
 
 
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+# This file is part of BlackPearl.
+
+# BlackPearl is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# BlackPearl is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+
+# Number of the slowest imports listed per instance
+SLOWEST_IMPORTS = 10
+
+# Phase or import is reported as a regression when it is slower than in the previous run by this ratio
+# and by at least REGRESSION_MIN seconds
+REGRESSION_RATIO = 0.2
+REGRESSION_MIN = 0.01
+
+
+def _load(profile_file):
+    try:
+        with open(profile_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _phases(profile):
+    """Returns the list of (phase, seconds) with the time of the repeated phases (shared pool) summed up"""
+    phases = {}
+    for name, seconds in profile["phases"]:
+        phases[name] = phases.get(name, 0) + seconds
+    completed = []
+    for name, seconds in profile["phases"]:
+        if name not in completed:
+            completed.append(name)
+
+    def position(name):
+        # Parent phase is completed after its nested phases, but listed before them
+        parts = name.split("/")
+        return [completed.index("/".join(parts[:i + 1])) for i in range(len(parts))]
+
+    return [(name, phases[name]) for name in sorted(completed, key=position)]
+
+
+def _regressed(current, previous):
+    return previous is not None and current - previous > max(previous * REGRESSION_RATIO, REGRESSION_MIN)
+
+
+def _change(current, previous):
+    if previous is None:
+        return ""
+    if previous == 0:
+        return "new"
+    return "%+.0f%%" % ((current - previous) * 100 / previous)
+
+
+def _report(instance_id, worker_id, profile, previous):
+    print("uWsgi Service <%s> - worker <%s> (pid <%s>) started at %s" % (
+        instance_id, worker_id, profile["pid"],
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(profile["time"]))))
+
+    previous_phases = dict(_phases(previous)) if previous else {}
+    previous_imports = previous["imports"] if previous else {}
+    regressions = []
+
+    row = "{:<40} {:>10} {:>10} {:>8}"
+    print(row.format("Phase", "Time", "Previous", "Change"))
+    for name, seconds in _phases(profile):
+        before = previous_phases.get(name)
+        print(row.format("  " * name.count("/") + name.split("/")[-1], "%.3fs" % seconds,
+                         "%.3fs" % before if before is not None else "-", _change(seconds, before)))
+        if _regressed(seconds, before):
+            regressions.append("Phase <%s> took <%.3f> seconds, <%.3f> seconds in the previous run" % (
+                name, seconds, before))
+    before = previous["total"] if previous else None
+    print(row.format("total (budget %.3fs)" % profile["budget"], "%.3fs" % profile["total"],
+                     "%.3fs" % before if before is not None else "-", _change(profile["total"], before)))
+
+    print(row.format("Slowest imports (self time)", "Self", "Previous", "Change"))
+    slowest = sorted(profile["imports"].items(), key=lambda item: -item[1][1])
+    for module, (cumulative, own) in slowest[:SLOWEST_IMPORTS]:
+        before = previous_imports[module][1] if module in previous_imports else None
+        print(row.format(module, "%.3fs" % own, "%.3fs" % before if before is not None else "-",
+                         _change(own, before)))
+
+    for module, (cumulative, own) in slowest:
+        if module in previous_imports and _regressed(own, previous_imports[module][1]):
+            regressions.append("Import of <%s> took <%.3f> seconds, <%.3f> seconds in the previous run" % (
+                module, own, previous_imports[module][1]))
+        elif previous and module not in previous_imports and own > REGRESSION_MIN:
+            regressions.append("Module <%s> is newly imported during the startup and took <%.3f> seconds" % (
+                module, own))
+
+    for violation in profile["violations"]:
+        print("OVER BUDGET: %s" % violation)
+    for regression in regressions:
+        print("REGRESSION: %s" % regression)
+    if not previous:
+        print("No profile from the previous run to compare with.")
+    elif not regressions:
+        print("No regression compared to the previous run.")
+    print()
+
+
+def invoke(config):
+    """Prints the startup profile of each uwsgi worker of each instance, checked against the budget and
+    compared with the profile of the same worker in the previous run of the server"""
+    profiles_loc = os.path.join(config['path']['run'], "uwsgi", "startup")
+    previous_loc = os.path.join(config['path']['cache'], "startup")
+    if not config['startup_profile']['enabled']:
+        print("Startup profiling is not enabled. Enable it under the category <startup_profile> in the "
+              "configuration file and restart the server.")
+        return
+    if not os.access(profiles_loc, os.F_OK):
+        print("BlackPearl service is not running.")
+        return
+
+    names = sorted(name for name in os.listdir(profiles_loc) if name.endswith(".json"))
+    if not names:
+        print("No worker has recorded its startup profile yet.")
+    for name in names:
+        profile = _load(os.path.join(profiles_loc, name))
+        if profile:
+            # <instance id>.<worker id>.json, instance id can have dots (candidate instance)
+            instance_id, worker_id = name[:-len(".json")].rsplit(".", 1)
+            _report(instance_id, worker_id, profile, _load(os.path.join(previous_loc, name)))
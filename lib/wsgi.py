@@ -15,8 +15,21 @@
 # You should have received a copy of the GNU General Public License
 # along with BlackPearl.  If not, see <http://www.gnu.org/licenses/>.
 
-import BlackPearl.application
+import os
+import gc
+from BlackPearl.common import startupprofile
 
-BlackPearl.application.initialize()
+startupprofile.start()
+with startupprofile.phase("import"):
+    import BlackPearl.application
+with startupprofile.phase("initialize"):
+    BlackPearl.application.initialize()
+startupprofile.finish()
 application = BlackPearl.application.application
 
+# In preload mode, this file is loaded once in the uwsgi master before forking the workers. Objects
+# created during the initialization are moved out of the gc's reach, so that the collections in the
+# workers don't write to their pages and the pages stay shared copy-on-write (python 3.7+).
+if os.environ.get("BLACKPEARL_PRELOAD") == "1" and hasattr(gc, "freeze"):
+    gc.freeze()
+